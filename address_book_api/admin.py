@@ -1,9 +1,26 @@
 from django.contrib import admin
 
-from address_book_api.models import AddressUser, PostalAddress
+from address_book_api.models import (
+    AddressUser,
+    AddressUserPostalAddress,
+    PostalAddress,
+)
 
 # Register your models here.
 
+
+class AddressUserPostalAddressInline(admin.TabularInline):
+    # postal_addresses has an explicit through model, so the admin form can't edit
+    # it directly. A raw id rather than a select of every address
+    model = AddressUserPostalAddress
+    raw_id_fields = ["postaladdress"]
+    extra = 1
+
+
+class AddressUserAdmin(admin.ModelAdmin):
+    inlines = [AddressUserPostalAddressInline]
+
+
 # Re-register UserAdmin
-admin.site.register(AddressUser)
+admin.site.register(AddressUser, AddressUserAdmin)
 admin.site.register(PostalAddress)
@@ -1,33 +1,227 @@
-from django.contrib.auth.models import User
+import hashlib
+
+import iso3166
+
+from django import forms
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F, Prefetch
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import extend_schema, OpenApiParameter
-from rest_framework import viewsets, authentication, status
+from rest_framework import mixins, viewsets, authentication, status
 from rest_framework import permissions
+from rest_framework.authtoken.models import Token
+from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.decorators import action
-from rest_framework.exceptions import PermissionDenied
-from rest_framework.generics import get_object_or_404
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from django_filters import rest_framework as filters
 
-from address_book_api.models import AddressUser, PostalAddress
-from address_book_api.serialisers import AddressUserSerializer, PostalAddressSerializer
+from address_book_api import routers, search
+from address_book_api.authentication import (
+    AccessTokenAuthentication,
+    CachedTokenAuthentication,
+    issue_access_token,
+)
+from address_book_api.models import (
+    AddressUser,
+    AddressUserPostalAddress,
+    PostalAddress,
+)
+from address_book_api.pagination import PostalAddressCursorPagination
+from address_book_api.renderers import NDJSONRenderer, stream_json
+from address_book_api.serialisers import (
+    AddressUserSerializer,
+    PostalAddressSerializer,
+    PostalAddressPatchSerializer,
+    PostalAddressUpsertSerializer,
+    representation_values,
+)
+from address_book_api.timing import ServerTimingMixin, timed
+
+# Largest id a (64 bit) primary key can hold
+MAX_ID = 2**63 - 1
+
+
+class CountryField(forms.CharField):
+    """Form field for an ISO 3166 alpha-3 country code, validated like the model's
+    choices but without a ChoiceField, whose ~250 choices would be deep copied into
+    every filter form, i.e. on every list request
+    """
+
+    default_error_messages = {
+        "invalid_choice": forms.ChoiceField.default_error_messages["invalid_choice"]
+    }
+
+    def validate(self, value):
+        super().validate(value)
+        if value and value not in iso3166.countries_by_alpha3:
+            raise forms.ValidationError(
+                self.error_messages["invalid_choice"],
+                code="invalid_choice",
+                params={"value": value},
+            )
+
+
+class CountryFilter(filters.CharFilter):
+    field_class = CountryField
 
 
 class PostalAddressFilter(filters.FilterSet):
+    """Exact match on each field (e.g. ?city=London), plus ?<field>__<lookup>= for
+    the lookups below. in takes a comma separated list (?country__in=GBR,FRA) and
+    range a pair (?zip_code__range=CB1,CB5)
+
+    The country, city and zip_code lookups are all backed by PostalAddress indexes
+    """
+
+    country = CountryFilter()
+
+    def get_form_class(self):
+        # The filters are the same for every request, so the form class built from
+        # them (usually once per request) only needs making once
+        cls = type(self)
+        if "_form_class" not in cls.__dict__:
+            cls._form_class = super().get_form_class()
+        return cls._form_class
+
     class Meta:
         model = PostalAddress
-        fields = ["address1", "address2", "zip_code", "city", "country", "id"]
+        fields = {
+            "address1": ["exact"],
+            "address2": ["exact"],
+            "zip_code": [
+                "exact",
+                "iexact",
+                "in",
+                "startswith",
+                "istartswith",
+                "range",
+                "gte",
+                "lte",
+            ],
+            "city": ["exact", "iexact", "in", "startswith", "istartswith"],
+            "country": ["exact", "in"],
+            "id": ["exact", "in", "range"],
+        }
+
+
+SPARSE_FIELDS_PARAMETERS = [
+    OpenApiParameter(
+        "fields",
+        OpenApiTypes.STR,
+        OpenApiParameter.QUERY,
+        description="Comma separated fields to return (and read from the database), "
+        "e.g. fields=id,city,country",
+    ),
+    OpenApiParameter(
+        "exclude",
+        OpenApiTypes.STR,
+        OpenApiParameter.QUERY,
+        description="Comma separated fields to leave out, e.g. exclude=address1,address2",
+    ),
+]
+
 
-class AddressUserViewSet(viewsets.ModelViewSet):
+class ObtainAuthTokenView(ServerTimingMixin, ObtainAuthToken):
+    """Exchange a username and password for the user's API token, and a short lived
+    signed access token
+
+    Clients can send the access token ("Authorization: Bearer <access>") until it
+    expires, which is checked without any database access or password hashing, and
+    then fetch a new one. The API token ("Authorization: Token <token>") doesn't expire
     """
-    API endpoint that allows current user
-    to be viewed, created or deleted
 
-    Used by Django admin interface
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        # Checking the password is the authentication, its hashing the bulk of it
+        with timed("auth"):
+            serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data["user"]
+        token, created = Token.objects.get_or_create(user=user)
+
+        return Response(
+            {
+                "token": token.key,
+                "access": issue_access_token(user),
+                "expires_in": settings.ADDRESS_BOOK_ACCESS_TOKEN_MAX_AGE,
+            }
+        )
+
+
+class AddressUserMixin:
+    """Routes the request's queries of the address book to the requesting user's
+    shard (see routers.py), and resolves their AddressUser once per request
+
+    request.user is already a User instance, so a single AddressUser query is all
+    that's needed, later calls reuse it
+    """
+
+    # Actions that read from a replica, unless the user has written recently
+    replica_actions = ()
+
+    def dispatch(self, request, *args, **kwargs):
+        self.routing_tokens = []
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            routers.reset(*self.routing_tokens)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.routing_tokens.append(
+            routers.use_shard(routers.get_shard(request.user.pk))
+        )
+        if self.action in self.replica_actions:
+            self.routing_tokens.append(
+                routers.read_from(routers.get_read_database(request.user.pk))
+            )
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if (
+            request.method not in permissions.SAFE_METHODS
+            and response.status_code < 400
+        ):
+            routers.stick_to_primary(request.user.pk)
+        return response
+
+    def get_address_user(self):
+        if not hasattr(self, "_address_user"):
+            try:
+                self._address_user = AddressUser.objects.get(
+                    user_id=self.request.user.pk
+                )
+            except AddressUser.DoesNotExist:
+                raise PermissionDenied(detail="User is not an address book user")
+            # The user is on the primary, which a shard can't join
+            self._address_user.user = self.request.user
+
+        return self._address_user
+
+
+class AddressUserViewSet(
+    ServerTimingMixin,
+    AddressUserMixin,
+    mixins.RetrieveModelMixin,
+    viewsets.GenericViewSet,
+):
+    """
+    API endpoint for the current user's profile
+
+    The nested addresses are capped at ADDRESS_BOOK_PROFILE_ADDRESSES (the most
+    recently added), the full address book is paginated by PostalAddressViewSet.
+    Rendering takes three queries however many addresses the user has
     """
 
     authentication_classes = [
-        authentication.TokenAuthentication,
+        AccessTokenAuthentication,
+        CachedTokenAuthentication,
         authentication.SessionAuthentication,
         authentication.BasicAuthentication,
     ]
@@ -36,70 +230,384 @@ class AddressUserViewSet(viewsets.ModelViewSet):
     serializer_class = AddressUserSerializer
 
     def get_queryset(self):
-        username = self.request.user
-        user = User.objects.get(username=username)
-        queryset = AddressUser.objects.get(user=user)
-        return queryset
+        # A single query for the newest links of every AddressUser in the queryset,
+        # sliced per user (with a window function) by the Prefetch
+        recent_links = AddressUserPostalAddress.objects.select_related(
+            "postaladdress"
+        ).order_by("-id")[: settings.ADDRESS_BOOK_PROFILE_ADDRESSES]
+        return AddressUser.objects.filter(
+            user_id=self.request.user.pk
+        ).prefetch_related(
+            Prefetch(
+                "addressuserpostaladdress_set",
+                queryset=recent_links,
+                to_attr="recent_links",
+            )
+        )
 
+    def get_object(self):
+        address_user = self.get_queryset().first()
+        if address_user is None:
+            raise PermissionDenied(detail="User is not an address book user")
+        address_user.user = self.request.user
 
-class PostalAddressViewSet(viewsets.ModelViewSet):
+        address_user.recent_postal_addresses = [
+            link.postaladdress for link in address_user.recent_links
+        ]
+        # Straight off the through table (and its unique index), without loading
+        # the addresses themselves
+        address_user.postal_addresses_ids = list(
+            AddressUserPostalAddress.objects.filter(addressuser=address_user)
+            .order_by("id")
+            .values_list("postaladdress_id", flat=True)
+        )
+        return address_user
+
+
+class PostalAddressViewSet(ServerTimingMixin, AddressUserMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows addresses associated with current user
     to be viewed, created or deleted
     """
 
     authentication_classes = [
-        authentication.TokenAuthentication,
+        AccessTokenAuthentication,
+        CachedTokenAuthentication,
         authentication.SessionAuthentication,
         authentication.BasicAuthentication,
     ]
     permission_classes = [permissions.IsAuthenticated]
     filter_backends = [filters.DjangoFilterBackend]
+    filterset_class = PostalAddressFilter
+    pagination_class = PostalAddressCursorPagination
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, NDJSONRenderer]
 
     serializer_class = PostalAddressSerializer
+    # The bulk of the traffic. The AddressUser is read from the replica too, so the
+    # version behind the ETag and list cache matches the rows
+    replica_actions = ("list", "retrieve")
 
     http_method_names = ["get", "post", "patch", "delete"]
 
     def get_queryset(self):
-        username = self.request.user
-        user = User.objects.get(username=username)
-        if not AddressUser.objects.filter(user=user).exists():
-            raise PermissionDenied(detail="User is not an address book user")
+        if getattr(self, "swagger_fake_view", False):
+            # Generating the schema, there's no user (or address book) to look up
+            return PostalAddress.objects.none()
+
+        # Expose the through row id so pagination can key on the through table index
+        queryset = PostalAddress.objects.filter(
+            address_user_links__addressuser=self.get_address_user()
+        ).annotate(book_position=F("address_user_links__id"))
+
+        if self.action == "retrieve":
+            # Only read the columns of the requested fields, the list reads them with
+            # values() instead (see representation_values)
+            queryset = queryset.only(*self.get_serializer().fields)
+
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        """The representation of GETs can be narrowed with ?fields= / ?exclude="""
+        if self.action in ("list", "retrieve"):
+            for argument in ("fields", "exclude"):
+                names = [
+                    name
+                    for name in self.request.query_params.get(argument, "").split(",")
+                    if name
+                ]
+                if names:
+                    kwargs.setdefault(argument, names)
+
+        return super().get_serializer(*args, **kwargs)
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                "stream",
+                OpenApiTypes.BOOL,
+                OpenApiParameter.QUERY,
+                description="Stream the whole address book unpaginated, "
+                "also enabled by requesting application/x-ndjson",
+            ),
+            OpenApiParameter(
+                "q",
+                OpenApiTypes.STR,
+                OpenApiParameter.QUERY,
+                description="Full-text search, returns the best matching addresses "
+                "(up to page_size) ranked best first, instead of a page",
+            ),
+            *SPARSE_FIELDS_PARAMETERS,
+        ],
+    )
+    def list(self, request, *args, **kwargs):
+        not_modified = self.get_not_modified_response()
+        if not_modified is not None:
+            return not_modified
+
+        if "q" not in request.query_params and self.is_stream_request():
+            return self.stream_list()
+
+        cache_key = self.get_list_cache_key()
+        if cache_key is not None:
+            data = caches["address_book"].get(cache_key)
+            if data is not None:
+                return Response(data, headers={"X-Cache": "HIT"})
+
+        if "q" in request.query_params:
+            response = self.search_list(request.query_params["q"])
+        else:
+            response = self.page_list()
+
+        if cache_key is not None:
+            caches["address_book"].set(cache_key, response.data)
+            response["X-Cache"] = "MISS"
 
-        return AddressUser.objects.get(user=user).postal_addresses
+        return response
 
-    def perform_create(self, serializer):
-        """Overwrite preform_create for view, to associate PostalAddress with AddressUser
-        after PostalAddress has been saved
+    @extend_schema(parameters=SPARSE_FIELDS_PARAMETERS)
+    def retrieve(self, request, *args, **kwargs):
+        not_modified = self.get_not_modified_response()
+        if not_modified is not None:
+            return not_modified
+
+        return super().retrieve(request, *args, **kwargs)
+
+    def get_representation(self):
+        """Hash of the url and media type, as different filters, pages or formats are
+        different representations of the address book
         """
-        saved_address = serializer.save()
+        return hashlib.md5(
+            f"{self.request.build_absolute_uri()} {self.request.accepted_media_type}".encode()
+        ).hexdigest()[:16]
 
-        username = self.request.user
-        user = User.objects.get(username=username)
+    def get_etag(self):
+        """ETag of a GET of the address book, any change to the user's addresses
+        bumps their version
+        """
+        address_user = self.get_address_user()
+        return (
+            f'"{address_user.user_id}-{address_user.version}-'
+            f'{self.get_representation()}"'
+        )
 
-        AddressUser.objects.get(user=user).postal_addresses.add(saved_address)
+    def get_list_cache_key(self):
+        """Key of the user's cached list response, or None if caching is disabled
 
-    def destroy(self, request, *args, **kwargs):
-        """Overwrite destroy so that if address is referenced by other AddressUsers, it is only removed
-        from the ManyToMany model and not deleted. We this by using delete member function that's part of
-        AddressUser, instead of Postal
+        Keyed on the address book version (like the ETag), so there's nothing to
+        delete when the addresses change, the bumped version stops old entries being
+        read and the LRU eviction of the cache discards them
+        """
+        if not settings.ADDRESS_BOOK_LIST_CACHE:
+            return None
+
+        address_user = self.get_address_user()
+        return (
+            f"address-list:{address_user.user_id}:{address_user.version}:"
+            f"{self.get_representation()}"
+        )
+
+    def get_last_modified(self):
+        return int(self.get_address_user().modified_at.timestamp())
 
+    def get_not_modified_response(self):
+        """Answer If-None-Match / If-Modified-Since with a 304 without running the list
+        or serializer, the validators come from the AddressUser, which is already
+        looked up for the request
         """
-        postal_address_instance = self.get_object()
+        return get_conditional_response(
+            self.request,
+            etag=self.get_etag(),
+            last_modified=self.get_last_modified(),
+        )
 
-        user = User.objects.get(username=self.request.user)
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.action in ("list", "retrieve") and response.status_code in (200, 304):
+            response["ETag"] = self.get_etag()
+            response["Last-Modified"] = http_date(self.get_last_modified())
+        return response
 
-        # This will remove the Postal Address from AddressUser and only
-        # delete the Postal Address if it's not used by anything else
-        AddressUser.objects.get(user=user).postal_addresses.remove(
-            postal_address_instance
+    @extend_schema(
+        responses={status.HTTP_200_OK: OpenApiTypes.OBJECT},
+        description="Hit, miss and eviction counts of the address list cache "
+        "(of the process handling the request), admin users only",
+    )
+    @action(
+        detail=False,
+        methods=["get"],
+        url_path="cache-stats",
+        permission_classes=[permissions.IsAdminUser],
+    )
+    def cache_stats(self, request):
+        cache = caches["address_book"]
+        if not hasattr(cache, "stats"):
+            raise NotFound(detail="The address book cache doesn't keep stats")
+
+        return Response({"enabled": settings.ADDRESS_BOOK_LIST_CACHE, **cache.stats()})
+
+    def is_stream_request(self):
+        return self.request.accepted_renderer.format == NDJSONRenderer.format or (
+            self.request.query_params.get("stream", "").lower() in ("1", "true")
+        )
+
+    def search_list(self, text):
+        """Ranked full-text search of the user's addresses
+
+        The FTS index returns the ids of the best matches for the user, which are
+        then loaded through the usual (filtered) queryset. The response has the same
+        shape as a page, without next/previous links
+        """
+        if not search.is_available():
+            raise ValidationError({"q": "Search isn't supported on this database"})
+
+        ids = search.search_postal_addresses(
+            self.get_address_user(), text, self.paginator.get_page_size(self.request)
+        )
+        rows = {
+            row.pop("search_id"): row
+            for row in representation_values(
+                self.get_serializer(),
+                self.filter_queryset(self.get_queryset())
+                .filter(pk__in=ids)
+                .annotate(search_id=F("pk")),
+                "search_id",
+            )
+        }
+
+        return Response(
+            {
+                "next": None,
+                "previous": None,
+                "results": [rows[pk] for pk in ids if pk in rows],
+            }
         )
 
-        if not AddressUser.objects.filter(
-            postal_addresses=postal_address_instance.id
-        ).exists():
-            # If it's not associated else where, remove it
-            self.perform_destroy(postal_address_instance)
+    def page_list(self):
+        """A page of the (filtered) address book, read as plain rows rather than
+        serializing PostalAddress instances, see representation_values()
+        """
+        queryset = representation_values(
+            self.get_serializer(),
+            self.filter_queryset(self.get_queryset()),
+            "book_position",
+        )
+        page = self.paginate_queryset(queryset)
+        # The next/previous links are made from the page's book_position, so it's
+        # only dropped from the rows once they have been
+        response = self.get_paginated_response(page)
+        for row in page:
+            del row["book_position"]
+
+        return response
+
+    def stream_list(self):
+        """Stream the full (filtered) address book as a JSON array or NDJSON
+
+        Rows are read with a chunked iterator and rendered as they arrive, rather than
+        serializing the whole book into memory before sending the first byte
+        """
+        ndjson = self.request.accepted_renderer.format == NDJSONRenderer.format
+        queryset = self.filter_queryset(self.get_queryset()).order_by("book_position")
+        # Streamed after the view returns, so the database (replica or shard) is fixed
+        # while the request's routing still applies
+        queryset = queryset.using(queryset.db)
+        chunk_size = settings.ADDRESS_BOOK_STREAM_CHUNK_SIZE
+
+        rows = representation_values(self.get_serializer(), queryset).iterator(
+            chunk_size=chunk_size
+        )
+
+        return StreamingHttpResponse(
+            stream_json(rows, ndjson=ndjson, chunk_size=chunk_size),
+            content_type=NDJSONRenderer.media_type if ndjson else "application/json",
+        )
+
+    def get_serializer_class(self):
+        if self.action in ("create", "bulk", "partial_update"):
+            return PostalAddressUpsertSerializer
+        if self.action == "bulk_partial_update":
+            return PostalAddressPatchSerializer
+
+        return super().get_serializer_class()
+
+    @extend_schema(
+        responses={
+            status.HTTP_201_CREATED: PostalAddressSerializer,
+            status.HTTP_200_OK: PostalAddressSerializer,
+        },
+        description="Create a PostalAddress, or attach it if it already exists. "
+        "Returns 201 if the address was new and 200 if it already existed",
+    )
+    def create(self, request, *args, **kwargs):
+        """Overwrite create as an upsert, so an address that already exists (e.g. one
+        shared with another AddressUser) is associated with the user rather than
+        rejected. There is no uniqueness pre-check, the INSERT itself decides
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        address_user = self.get_address_user()
+
+        with transaction.atomic(using=address_user._state.db):
+            postal_address, created = PostalAddress.objects.upsert(
+                serializer.validated_data
+            )
+            address_user.add_postal_addresses([postal_address])
+
+        data = PostalAddressSerializer(postal_address).data
+        return Response(
+            data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+            headers=self.get_success_headers(data),
+        )
+
+    @extend_schema(
+        request=PostalAddressUpsertSerializer(partial=True),
+        responses={status.HTTP_200_OK: PostalAddressSerializer},
+        description="Update one of the user's PostalAddresses. Like the bulk PATCH, "
+        "an address shared with other users is copied rather than changed for "
+        "everyone, and changing it into an address that exists moves the user onto "
+        "it, so the returned id can differ",
+    )
+    def partial_update(self, request, *args, **kwargs):
+        """Copy on write PATCH of a single address, see
+        AddressUser.update_postal_addresses
+        """
+        try:
+            pk = int(self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+        except ValueError:
+            raise NotFound()
+        # Ids past the database's 64 bit integers would overflow in the query
+        if not 0 < pk <= MAX_ID:
+            raise NotFound()
+
+        serializer = self.get_serializer(data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            updated = self.get_address_user().update_postal_addresses(
+                {pk: serializer.validated_data}
+            )
+        except PostalAddress.DoesNotExist:
+            raise NotFound()
+
+        return Response(PostalAddressSerializer(updated[pk]).data)
+
+    def destroy(self, request, *args, **kwargs):
+        """Overwrite destroy so that if address is referenced by other AddressUsers, it is only removed
+        from the ManyToMany model and not deleted. Whether it's still referenced is
+        decided by the address's owner_count, rather than scanning the through table
+        """
+        postal_address_instance = self.get_object()
+        address_user = self.get_address_user()
+
+        with transaction.atomic(using=address_user._state.db):
+            # This will remove the Postal Address from AddressUser and only
+            # delete the Postal Address if it's not used by anything else
+            address_user.remove_postal_addresses([postal_address_instance.id])
+            PostalAddress.objects.filter(
+                pk=postal_address_instance.id
+            ).orphaned().delete()
 
         return Response(status=status.HTTP_204_NO_CONTENT)
 
@@ -113,15 +621,102 @@ class PostalAddressViewSet(viewsets.ModelViewSet):
         name="batch_delete",
     )
     def batch(self, request):
-        ids = request.query_params.get("ids")
-        user = User.objects.get(username=self.request.user)
+        """Set based batch delete, removes the addresses from the user with a single
+        through table DELETE, then deletes whichever of them are no longer referenced
+        by any AddressUser (the same shared address semantics as destroy)
+        """
+        try:
+            ids = {
+                int(identifier) for identifier in request.query_params["ids"].split(",")
+            }
+            # Ids past the database's 64 bit integers would overflow in the query
+            if not all(-MAX_ID - 1 <= identifier <= MAX_ID for identifier in ids):
+                raise ValueError()
+        except (KeyError, ValueError):
+            raise ValidationError(
+                {"ids": "Expected a comma seperated list of PostalAddress ids"}
+            )
 
-        obj_list = []
-        for identifier in ids.split(","):
-            obj_list.append(get_object_or_404(PostalAddress, id=identifier, user=user))
+        address_user = self.get_address_user()
 
-        # We only want to delete to occur if all ids have matched
-        [x.delete() for x in obj_list]
+        with transaction.atomic(using=address_user._state.db):
+            # We only want to delete to occur if all ids have matched,
+            # raising rolls back the removal
+            if address_user.remove_postal_addresses(ids) != len(ids):
+                raise NotFound()
+
+            PostalAddress.objects.filter(pk__in=ids).orphaned().delete()
 
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @extend_schema(
+        request=PostalAddressSerializer(many=True),
+        responses={status.HTTP_201_CREATED: PostalAddressSerializer(many=True)},
+        description="Create (or attach, if they already exist) a list of PostalAddresses",
+    )
+    @action(
+        detail=False,
+        methods=["post"],
+        name="bulk_create",
+    )
+    def bulk(self, request):
+        """Set based create, the payload is validated in memory, new addresses are
+        inserted with bulk_create and everything is associated with the user in
+        a single through table insert
+        """
+        serializer = self.get_serializer(
+            data=request.data,
+            many=True,
+            min_length=1,
+            max_length=settings.ADDRESS_BOOK_MAX_BULK_SIZE,
+        )
+        serializer.is_valid(raise_exception=True)
+
+        address_user = self.get_address_user()
+
+        with transaction.atomic(using=address_user._state.db):
+            postal_addresses = PostalAddress.objects.bulk_get_or_create(
+                serializer.validated_data
+            )
+            address_user.add_postal_addresses(postal_addresses)
+
+        return Response(
+            PostalAddressSerializer(postal_addresses, many=True).data,
+            status=status.HTTP_201_CREATED,
+        )
+
+    @extend_schema(
+        request=PostalAddressPatchSerializer(many=True, partial=True),
+        responses={status.HTTP_200_OK: PostalAddressSerializer(many=True)},
+        description="Update a list of the user's PostalAddresses, each item is an id "
+        "and the fields to change. Addresses shared with other users are copied "
+        "rather than changed for everyone, so the returned ids can differ",
+    )
+    @bulk.mapping.patch
+    def bulk_partial_update(self, request):
+        """Set based, copy on write, PATCH of many addresses in one transaction, see
+        AddressUser.update_postal_addresses
+        """
+        serializer = self.get_serializer(
+            data=request.data,
+            many=True,
+            partial=True,
+            min_length=1,
+            max_length=settings.ADDRESS_BOOK_MAX_BULK_SIZE,
+        )
+        serializer.is_valid(raise_exception=True)
+
+        changes = {}
+        for item in serializer.validated_data:
+            changes[item.pop("id")] = item
+        if len(changes) != len(serializer.validated_data):
+            raise ValidationError({"id": "Each address can only be updated once"})
+
+        try:
+            updated = self.get_address_user().update_postal_addresses(changes)
+        except PostalAddress.DoesNotExist:
+            raise NotFound()
+
+        return Response(
+            PostalAddressSerializer([updated[pk] for pk in changes], many=True).data
+        )
@@ -5,3 +5,7 @@ class AddressBookApiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "address_book_api"
     verbose_name = "Address book API"
+
+    def ready(self):
+        # Connect the signal handlers
+        from address_book_api import signals  # noqa: F401
@@ -0,0 +1,265 @@
+"""Native async versions of the address book's list, retrieve, create and delete
+endpoints, for running under ASGI (see django_many_to_many/asgi.py)
+
+DRF views are synchronous, so under an ASGI server every request to them holds a
+thread until the response has been sent, slow clients included. These are plain Django
+async views instead: queries go through the async ORM and responses (streams
+especially) are sent without holding a thread, writes are run in a thread with
+sync_to_async as transactions aren't supported in async code.
+
+They mirror PostalAddressViewSet (the same filters, ?fields= / ?exclude=, cursors and
+JSON) but only accept API and access tokens, session and Basic authentication (and so
+CSRF) aren't supported. Conditional GETs, the list cache and replica reads are also
+only done by the DRF views (writes do make the user's DRF reads stick to the primary)
+"""
+
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.pagination import Cursor
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from address_book_api import routers
+from address_book_api.apis import PostalAddressFilter
+from address_book_api.authentication import (
+    AccessTokenAuthentication,
+    CachedTokenAuthentication,
+)
+from address_book_api.models import AddressUser, PostalAddress
+from address_book_api.pagination import PostalAddressCursorPagination
+from address_book_api.renderers import NDJSONRenderer, astream_json
+from address_book_api.serialisers import (
+    PostalAddressSerializer,
+    PostalAddressUpsertSerializer,
+    representation_values,
+)
+from address_book_api.timing import timed
+
+
+def json_response(data, status=status.HTTP_200_OK, headers=None):
+    with timed("serialize"):
+        content = JSONRenderer().render(data)
+    return HttpResponse(
+        content,
+        content_type="application/json",
+        status=status,
+        headers=headers,
+    )
+
+
+async def aauthenticate(request):
+    """The user of an "Authorization: Bearer <access token>" or "Token <token>" request,
+    None if there's no Authorization header
+    """
+    header = request.headers.get("Authorization", "").split()
+    if not header:
+        return None
+    if len(header) != 2:
+        raise exceptions.AuthenticationFailed("Invalid token header.")
+
+    keyword, key = header
+    if keyword == AccessTokenAuthentication.keyword:
+        # Checked without any database access, so there's nothing to await
+        user, _ = AccessTokenAuthentication().authenticate_credentials(key)
+    elif keyword == CachedTokenAuthentication.keyword:
+        user, _ = await CachedTokenAuthentication().aauthenticate_credentials(key)
+    else:
+        raise exceptions.AuthenticationFailed("Unsupported authorization scheme.")
+
+    return user
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncAddressBookView(View):
+    """Authenticates the request and resolves its AddressUser, then dispatches to the
+    (async) handler. DRF exceptions raised along the way are returned as DRF would
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        routing_tokens = []
+        try:
+            with timed("auth"):
+                user = await aauthenticate(request)
+            if user is None:
+                raise exceptions.NotAuthenticated()
+
+            # Writes run in threads with a copy of this context, so they're routed too
+            routing_tokens.append(routers.use_shard(routers.get_shard(user.pk)))
+            try:
+                self.address_user = await AddressUser.objects.aget(user_id=user.pk)
+            except AddressUser.DoesNotExist:
+                raise exceptions.PermissionDenied(
+                    detail="User is not an address book user"
+                )
+
+            return await super().dispatch(request, *args, **kwargs)
+        except exceptions.APIException as exception:
+            detail = exception.detail
+            if not isinstance(detail, (list, dict)):
+                detail = {"detail": detail}
+
+            headers = {}
+            if isinstance(
+                exception,
+                (exceptions.NotAuthenticated, exceptions.AuthenticationFailed),
+            ):
+                headers["WWW-Authenticate"] = AccessTokenAuthentication.keyword
+
+            return json_response(detail, status=exception.status_code, headers=headers)
+        finally:
+            routers.reset(*routing_tokens)
+
+    def get_queryset(self):
+        return PostalAddress.objects.filter(
+            address_user_links__addressuser=self.address_user
+        ).annotate(book_position=F("address_user_links__id"))
+
+    def get_serializer(self):
+        """PostalAddressSerializer narrowed by ?fields= / ?exclude="""
+        kwargs = {}
+        for argument in ("fields", "exclude"):
+            names = [
+                name for name in self.request.GET.get(argument, "").split(",") if name
+            ]
+            if names:
+                kwargs[argument] = names
+
+        return PostalAddressSerializer(**kwargs)
+
+
+class AsyncPostalAddressListView(AsyncAddressBookView):
+    async def get(self, request):
+        filterset = PostalAddressFilter(request.GET, queryset=self.get_queryset())
+        if not filterset.is_valid():
+            raise exceptions.ValidationError(filterset.errors)
+
+        queryset = filterset.qs
+        ndjson = NDJSONRenderer.media_type in request.headers.get("Accept", "")
+        if ndjson or request.GET.get("stream", "").lower() in ("1", "true"):
+            return self.stream_list(queryset, ndjson)
+
+        return await self.page_list(queryset)
+
+    def stream_list(self, queryset, ndjson):
+        chunk_size = settings.ADDRESS_BOOK_STREAM_CHUNK_SIZE
+        # Streamed after dispatch() returns, so the shard is fixed while it applies
+        rows = representation_values(
+            self.get_serializer(),
+            queryset.using(queryset.db).order_by("book_position"),
+        ).aiterator(chunk_size=chunk_size)
+
+        return StreamingHttpResponse(
+            astream_json(rows, ndjson=ndjson, chunk_size=chunk_size),
+            content_type=NDJSONRenderer.media_type if ndjson else "application/json",
+        )
+
+    async def page_list(self, queryset):
+        """A page of the address book, with the same cursors as
+        PostalAddressCursorPagination (so either view's links work with the other)
+        """
+        paginator = PostalAddressCursorPagination()
+        drf_request = Request(self.request)
+        paginator.base_url = self.request.build_absolute_uri()
+        page_size = paginator.get_page_size(drf_request)
+        cursor = paginator.decode_cursor(drf_request)
+
+        reverse = cursor is not None and cursor.reverse
+        if cursor is not None and cursor.position is not None:
+            queryset = queryset.filter(
+                **{f"book_position__{'lt' if reverse else 'gt'}": cursor.position}
+            )
+        queryset = representation_values(
+            self.get_serializer(),
+            queryset.order_by("-book_position" if reverse else "book_position"),
+            "book_position",
+        )[: page_size + 1]
+
+        rows = [row async for row in queryset]
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+
+        def link(row, reverse):
+            return paginator.encode_cursor(
+                Cursor(offset=0, reverse=reverse, position=str(row["book_position"]))
+            )
+
+        next_link = previous_link = None
+        if rows:
+            if has_more or reverse:
+                next_link = link(rows[-1], reverse=False)
+            if (has_more and reverse) or (cursor is not None and not reverse):
+                previous_link = link(rows[0], reverse=True)
+
+        for row in rows:
+            del row["book_position"]
+
+        return json_response(
+            {"next": next_link, "previous": previous_link, "results": rows}
+        )
+
+    async def post(self, request):
+        """Upsert, as PostalAddressViewSet.create"""
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            raise exceptions.ParseError()
+
+        # Validated in memory, without any queries
+        serializer = PostalAddressUpsertSerializer(data=data)
+        if not serializer.is_valid():
+            raise exceptions.ValidationError(serializer.errors)
+
+        postal_address, created = await sync_to_async(self.create)(
+            serializer.validated_data
+        )
+        return json_response(
+            PostalAddressSerializer(postal_address).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        )
+
+    def create(self, address):
+        with transaction.atomic(using=self.address_user._state.db):
+            postal_address, created = PostalAddress.objects.upsert(address)
+            self.address_user.add_postal_addresses([postal_address])
+        routers.stick_to_primary(self.address_user.user_id)
+
+        return postal_address, created
+
+
+class AsyncPostalAddressDetailView(AsyncAddressBookView):
+    async def get(self, request, pk):
+        row = await representation_values(
+            self.get_serializer(), self.get_queryset().filter(pk=pk)
+        ).afirst()
+        if row is None:
+            raise exceptions.NotFound()
+
+        return json_response(row)
+
+    async def delete(self, request, pk):
+        """As PostalAddressViewSet.destroy, the address is only deleted if no other
+        user has it
+        """
+        if not await sync_to_async(self.destroy)(pk):
+            raise exceptions.NotFound()
+
+        return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+
+    def destroy(self, pk):
+        with transaction.atomic(using=self.address_user._state.db):
+            removed = self.address_user.remove_postal_addresses([pk])
+            PostalAddress.objects.filter(pk=pk).orphaned().delete()
+        routers.stick_to_primary(self.address_user.user_id)
+
+        return removed
@@ -0,0 +1,128 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+ACCESS_TOKEN_SALT = "address_book_api.access_token"
+
+
+def token_cache_key(key):
+    # The token itself is a credential, so it's hashed rather than used in the key
+    return "auth-token:" + hashlib.sha256(key.encode()).hexdigest()
+
+
+def user_claims(user):
+    """What authentication needs to know about a user, without their password hash or
+    any other credentials, see build_user()
+    """
+    return [user.pk, user.username, user.is_staff, user.is_superuser]
+
+
+def build_user(pk, username, is_staff, is_superuser):
+    """An (unsaved) active User from user_claims(), for request.user"""
+    return User(
+        pk=pk,
+        username=username,
+        is_staff=is_staff,
+        is_superuser=is_superuser,
+        is_active=True,
+    )
+
+
+def forget_tokens(keys):
+    """Drop cached Token lookups, e.g. after the token is deleted or its user changes"""
+    cache.delete_many([token_cache_key(key) for key in keys])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication that caches the token's user for
+    ADDRESS_BOOK_AUTH_CACHE_TIMEOUT seconds, rather than querying the token and user
+    tables on every request
+
+    Only the user's user_claims() are cached (the default cache may be shared, e.g.
+    Redis, so never the password hash), request.user is built from them like
+    AccessTokenAuthentication's. Cached entries are dropped when the token is deleted,
+    or its user is saved or logs out, see signals.py. The cache is per process unless
+    the default cache is shared, so other processes may still accept a deleted token
+    until their entry expires
+    """
+
+    def authenticate_credentials(self, key):
+        cache_key = token_cache_key(key)
+        claims = cache.get(cache_key)
+        if claims is None:
+            user, token = super().authenticate_credentials(key)
+            claims = user_claims(user)
+            cache.set(cache_key, claims, settings.ADDRESS_BOOK_AUTH_CACHE_TIMEOUT)
+
+        return self.build_credentials(key, claims)
+
+    async def aauthenticate_credentials(self, key):
+        """authenticate_credentials() for async views, with the cache and ORM's async
+        methods
+        """
+        cache_key = token_cache_key(key)
+        claims = await cache.aget(cache_key)
+        if claims is None:
+            try:
+                token = (
+                    await self.get_model().objects.select_related("user").aget(key=key)
+                )
+            except self.get_model().DoesNotExist:
+                raise exceptions.AuthenticationFailed(_("Invalid token."))
+
+            if not token.user.is_active:
+                raise exceptions.AuthenticationFailed(_("User inactive or deleted."))
+            claims = user_claims(token.user)
+            await cache.aset(
+                cache_key, claims, settings.ADDRESS_BOOK_AUTH_CACHE_TIMEOUT
+            )
+
+        return self.build_credentials(key, claims)
+
+    def build_credentials(self, key, claims):
+        user = build_user(*claims)
+        return user, self.get_model()(key=key, user=user)
+
+
+def issue_access_token(user):
+    """Short lived access token for user, signed with SECRET_KEY
+
+    It carries everything authentication needs to know about the user, so it's
+    verified without any database access. The flip side is it can't be revoked, it's
+    valid until it expires after ADDRESS_BOOK_ACCESS_TOKEN_MAX_AGE seconds
+    """
+    return signing.dumps(
+        user_claims(user),
+        salt=ACCESS_TOKEN_SALT,
+        compress=True,
+    )
+
+
+class AccessTokenAuthentication(TokenAuthentication):
+    """Authenticates "Authorization: Bearer <access token>", see issue_access_token()
+
+    request.user is an (unsaved) User built from the token rather than loaded, it has
+    the user's pk, username and staff/superuser flags
+    """
+
+    keyword = "Bearer"
+
+    def authenticate_credentials(self, key):
+        try:
+            pk, username, is_staff, is_superuser = signing.loads(
+                key,
+                salt=ACCESS_TOKEN_SALT,
+                max_age=settings.ADDRESS_BOOK_ACCESS_TOKEN_MAX_AGE,
+            )
+        except signing.SignatureExpired:
+            raise exceptions.AuthenticationFailed(_("Access token has expired."))
+        except (signing.BadSignature, TypeError, ValueError):
+            raise exceptions.AuthenticationFailed(_("Invalid token."))
+
+        return build_user(pk, username, is_staff, is_superuser), key
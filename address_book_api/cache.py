@@ -0,0 +1,52 @@
+from collections import Counter
+
+from django.core.cache.backends.locmem import LocMemCache
+
+# Counters for each named cache, shared by the per thread instances like LocMemCache's
+# own storage
+_stats = {}
+
+_MISSING = object()
+
+
+class LRULocMemCache(LocMemCache):
+    """Local memory cache bounded by MAX_ENTRIES, evicting the least recently used
+    entry one at a time
+
+    LocMemCache already keeps entries in recency order, but once it's full it culls
+    1/CULL_FREQUENCY of them at once, dropping a large share of the address list
+    cache whenever it fills. This evicts just enough to make room, and counts hits,
+    misses and evictions, see stats()
+    """
+
+    def __init__(self, name, params):
+        super().__init__(name, params)
+        self._stats = _stats.setdefault(name, Counter())
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _MISSING, version=version)
+        with self._lock:
+            self._stats["misses" if value is _MISSING else "hits"] += 1
+        return default if value is _MISSING else value
+
+    def _cull(self):
+        # Called with the lock held, entries are kept most recently used first
+        while len(self._cache) >= self._max_entries:
+            key, _ = self._cache.popitem()
+            del self._expire_info[key]
+            self._stats["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self._stats["hits"],
+                "misses": self._stats["misses"],
+                "evictions": self._stats["evictions"],
+                "entries": len(self._cache),
+                "max_entries": self._max_entries,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+        super().clear()
@@ -0,0 +1,382 @@
+import json
+import platform
+import statistics
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import Client, override_settings
+from django.test.utils import setup_databases, teardown_databases
+from django.urls import reverse
+
+from address_book_api.authentication import issue_access_token
+from address_book_api.management.commands.generate_synthetic_data import (
+    insert_postal_addresses,
+    insert_rows,
+)
+from address_book_api.models import AddressUser, AddressUserPostalAddress, PostalAddress
+
+CITIES = ("London", "York", "Cambridge", "Manchester")
+
+# Addresses deleted by each batch_delete request
+BATCH_SIZE = 10
+
+PASSWORD = "benchmark-password"
+
+
+def percentile(latencies, fraction):
+    latencies = sorted(latencies)
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+
+def result_key(result):
+    return result["operation"], result["addresses"], result["share_ratio"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the address book API in process (the full middleware stack, "
+        "through Django's test client). For each --addresses and --share-ratios "
+        "(the fraction of the address book shared with another user) a benchmark "
+        "user is seeded with that address book, then every operation is requested "
+        "--requests times, measuring latency percentiles, throughput and SQL queries "
+        "per request. Results can be written as JSON with --output and compared "
+        "against an earlier run's with --baseline, failing if any operation's median "
+        "latency is more than --threshold slower or it makes more queries. It runs "
+        "on test databases, created and migrated for the run like the test runner's "
+        "and destroyed afterwards (however the run ends), so the configured "
+        "databases are left untouched, unless --existing-databases"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--addresses",
+            type=int,
+            nargs="+",
+            default=[10, 1000, 100000],
+            help="Address book sizes to seed",
+        )
+        parser.add_argument("--share-ratios", type=float, nargs="+", default=[0, 0.5])
+        parser.add_argument("--requests", type=int, default=30)
+        parser.add_argument("--output", help="Write the results to this JSON file")
+        parser.add_argument("--baseline", help="JSON results to compare against")
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.2,
+            help="Fraction the median latency may grow by over the baseline's",
+        )
+        parser.add_argument(
+            "--existing-databases",
+            action="store_true",
+            help="Run on the configured databases rather than test databases, they "
+            "must be migrated already. The benchmark's users and addresses are "
+            "deleted afterwards",
+        )
+
+    def handle(self, *args, **options):
+        if options["requests"] < 1:
+            raise CommandError("--requests must be at least 1")
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"]) as file:
+                baseline = {
+                    result_key(result): result for result in json.load(file)["results"]
+                }
+
+        self.stdout.write(
+            f"{'operation':>31} {'addresses':>9} {'shared':>6} {'p50 ms':>8} "
+            f"{'p90 ms':>8} {'p99 ms':>8} {'req/s':>7} {'queries':>7}"
+        )
+        results = []
+        old_config = None if options["existing_databases"] else self.setup_databases()
+        try:
+            # The test client's requests are for "testserver"
+            with override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]
+            ):
+                self.client = Client()
+                results.append(self.measure_token_auth(options["requests"]))
+                for addresses in options["addresses"]:
+                    for share_ratio in options["share_ratios"]:
+                        results += self.measure_dataset(
+                            addresses, share_ratio, options["requests"]
+                        )
+        finally:
+            if old_config is not None:
+                teardown_databases(old_config, verbosity=0)
+
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump(
+                    {
+                        "environment": {
+                            "python": platform.python_version(),
+                            "django": django.get_version(),
+                            "database": connections[DEFAULT_DB_ALIAS].vendor,
+                        },
+                        "results": results,
+                    },
+                    file,
+                    indent=2,
+                )
+
+        if baseline is not None:
+            self.compare(results, baseline, options["threshold"])
+
+    def setup_databases(self):
+        """Switch every connection to a fresh, migrated test database, returns what
+        teardown_databases() needs to destroy them and switch back
+        """
+        for alias in connections:
+            settings_dict = connections[alias].settings_dict
+            test_settings = settings_dict["TEST"]
+            if (
+                settings_dict["ENGINE"] == "django.db.backends.sqlite3"
+                and not test_settings.get("MIRROR")
+                and not test_settings.get("NAME")
+            ):
+                # A file next to the database, rather than the test runner's in
+                # memory database, so it's measured with the same I/O
+                name = Path(settings_dict["NAME"])
+                test_settings["NAME"] = str(name.with_name(f"benchmark_{name.name}"))
+
+        return setup_databases(verbosity=0, interactive=False, serialized_aliases=())
+
+    def measure_token_auth(self, requests):
+        user = User.objects.create_user(
+            username="benchmark_api_auth", password=PASSWORD
+        )
+        try:
+            return self.measure(
+                "token_auth",
+                None,
+                None,
+                requests,
+                lambda _: self.client.post(
+                    reverse("api_token_auth"),
+                    {"username": user.username, "password": PASSWORD},
+                ),
+            )
+        finally:
+            user.delete()
+
+    def measure_dataset(self, addresses, share_ratio, requests):
+        # Everything created is deleted however the run ends, including part way
+        # through seeding (e.g. interrupted)
+        with ExitStack() as cleanup:
+            address_user = AddressUser.objects.create_user(username="benchmark_api")
+            cleanup.callback(self.delete, address_user)
+            neighbour = AddressUser.objects.create_user(username="benchmark_api_shared")
+            cleanup.callback(self.delete, neighbour)
+            admin = User.objects.create_superuser(username="benchmark_api_admin")
+            cleanup.callback(admin.delete)
+
+            ids = self.seed(address_user, neighbour, addresses, share_ratio)
+            self.client.force_login(admin)
+            cleanup.callback(self.client.logout)
+            return [
+                self.measure(operation, addresses, share_ratio, requests, request)
+                for operation, request in self.operations(
+                    address_user, ids, requests
+                ).items()
+            ]
+
+    def operations(self, address_user, ids, requests):
+        """Functions making the number-th request of each operation"""
+        url = reverse("postaladdress-list")
+        headers = {"Authorization": f"Bearer {issue_access_token(address_user.user)}"}
+
+        def api(method, path, data=None):
+            return getattr(self.client, method)(
+                path, data, content_type="application/json", headers=headers
+            )
+
+        # Addresses for destroy and batch_delete to delete, so the measured address
+        # book keeps its size
+        destroyed = self.add_addresses(address_user, requests)
+        batches = self.add_addresses(address_user, requests * BATCH_SIZE)
+
+        def patch(number):
+            index = number % len(ids)
+            response = api("patch", f"{url}/{ids[index]}", {"zip_code": f"P{number}"})
+            # A shared address is copied for the user, later requests patch the copy
+            if response.status_code == 200:
+                ids[index] = response.json()["id"]
+            return response
+
+        return {
+            "list": lambda number: api("get", url),
+            "filtered_list": lambda number: api(
+                "get", url, {"city": "London", "country": "GBR"}
+            ),
+            "retrieve": lambda number: api("get", f"{url}/{ids[number % len(ids)]}"),
+            "create": lambda number: api(
+                "post",
+                url,
+                {"address1": f"{number} Benchmark Created Road", "country": "GBR"},
+            ),
+            "patch": patch,
+            "destroy": lambda number: api("delete", f"{url}/{destroyed[number]}"),
+            "batch_delete": lambda number: api(
+                "delete",
+                f"{url}/batch/?ids="
+                + ",".join(
+                    map(str, batches[number * BATCH_SIZE : (number + 1) * BATCH_SIZE])
+                ),
+            ),
+            "admin_postaladdress_changelist": lambda number: self.client.get(
+                reverse("admin:address_book_api_postaladdress_changelist")
+            ),
+            "admin_addressuser_changelist": lambda number: self.client.get(
+                reverse("admin:address_book_api_addressuser_changelist")
+            ),
+        }
+
+    def measure(self, operation, addresses, share_ratio, requests, request):
+        latencies = []
+        queries = []
+        started = time.perf_counter()
+        for number in range(requests):
+            count = 0
+
+            def count_query(execute, sql, params, many, context):
+                nonlocal count
+                count += 1
+                return execute(sql, params, many, context)
+
+            with ExitStack() as stack:
+                # Queries to every database, e.g. a shard as well as the primary
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(count_query))
+                request_started = time.perf_counter()
+                response = request(number)
+                latencies.append(time.perf_counter() - request_started)
+            if response.status_code >= 400:
+                raise CommandError(
+                    f"{operation} failed with {response.status_code}: "
+                    f"{response.content[:200]!r}"
+                )
+            queries.append(count)
+        seconds = time.perf_counter() - started
+
+        result = {
+            "operation": operation,
+            "addresses": addresses,
+            "share_ratio": share_ratio,
+            "requests": requests,
+            "p50_ms": statistics.median(latencies) * 1000,
+            "p90_ms": percentile(latencies, 0.9) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "mean_ms": statistics.fmean(latencies) * 1000,
+            "requests_per_second": requests / seconds,
+            "queries": statistics.median(queries),
+            "max_queries": max(queries),
+        }
+        self.stdout.write(
+            f"{operation:>31} {addresses if addresses is not None else '-':>9} "
+            f"{share_ratio if share_ratio is not None else '-':>6} "
+            f"{result['p50_ms']:>8.1f} {result['p90_ms']:>8.1f} "
+            f"{result['p99_ms']:>8.1f} {result['requests_per_second']:>7.0f} "
+            f"{result['queries']:>7g}"
+        )
+        return result
+
+    def seed(self, address_user, neighbour, addresses, share_ratio):
+        """Give the user an address book of addresses, a share_ratio of them also in
+        neighbour's, returns their ids
+        """
+        # Spread evenly through the address book
+        shared = [
+            int((number + 1) * share_ratio) > int(number * share_ratio)
+            for number in range(addresses)
+        ]
+        ids = self.add_addresses(address_user, addresses, shared)
+        insert_rows(
+            connections[neighbour._state.db],
+            AddressUserPostalAddress,
+            ("addressuser_id", "postaladdress_id"),
+            [(neighbour.pk, pk) for pk, is_shared in zip(ids, shared) if is_shared],
+        )
+        return ids
+
+    def add_addresses(self, address_user, count, shared=None):
+        """Insert count new addresses into the user's address book, returns their
+        ids. The shared ones get an owner_count of 2, for the user they're added to
+        next
+        """
+        using = address_user._state.db
+        shared = shared or [False] * count
+        # Numbered on from the user's other addresses, so they're all distinct
+        first = address_user.postal_addresses.count()
+        addresses = [
+            {
+                "address1": f"{address_user.pk}-{first + number} Benchmark Road",
+                "address2": None if number % 3 else f"Flat {number}",
+                "zip_code": f"BM{number % 1000}",
+                "city": CITIES[number % len(CITIES)],
+                "country": "GBR",
+            }
+            for number in range(count)
+        ]
+
+        ids = [None] * count
+        for owner_count in (1, 2):
+            numbers = [
+                number
+                for number in range(count)
+                if shared[number] == (owner_count == 2)
+            ]
+            new_ids = insert_postal_addresses(
+                using, [addresses[number] for number in numbers], owner_count
+            )
+            for number, pk in zip(numbers, new_ids):
+                ids[number] = pk
+        insert_rows(
+            connections[using],
+            AddressUserPostalAddress,
+            ("addressuser_id", "postaladdress_id"),
+            [(address_user.pk, pk) for pk in ids],
+        )
+        return ids
+
+    def delete(self, address_user):
+        """Delete a benchmark user, and the addresses that are left without owners"""
+        using = address_user._state.db
+        ids = list(address_user.postal_addresses.values_list("pk", flat=True))
+        address_user.user.delete()
+        for batch in range(0, len(ids), 500):
+            PostalAddress.objects.using(using).filter(
+                pk__in=ids[batch : batch + 500]
+            ).orphaned().delete()
+
+    def compare(self, results, baseline, threshold):
+        regressions = []
+        for result in results:
+            before = baseline.get(result_key(result))
+            if before is None:
+                continue
+            name = "/".join(
+                str(part) for part in result_key(result) if part is not None
+            )
+            if result["p50_ms"] > before["p50_ms"] * (1 + threshold):
+                regressions.append(
+                    f"{name}: median {result['p50_ms']:.1f}ms, was "
+                    f"{before['p50_ms']:.1f}ms"
+                )
+            if result["queries"] > before["queries"]:
+                regressions.append(
+                    f"{name}: {result['queries']:g} queries, was {before['queries']:g}"
+                )
+
+        if regressions:
+            raise CommandError(
+                f"{len(regressions)} regressions against the baseline:\n"
+                + "\n".join(regressions)
+            )
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
@@ -0,0 +1,168 @@
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+
+from address_book_api.authentication import issue_access_token
+from address_book_api.models import AddressUser, PostalAddress
+
+MODES = ("wsgi", "asgi", "asgi-drf")
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare how many slow clients streaming an address book are served at once "
+        "under WSGI (a pool of --threads worker threads, like gunicorn's gthread "
+        "workers) and ASGI, with the async views (asgi) and the DRF views (asgi-drf). "
+        "The handlers are driven in process, every client takes --delay seconds to "
+        "receive each chunk of the response. Creates (and afterwards deletes) a "
+        "benchmark user with --rows addresses"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=1000)
+        parser.add_argument("--delay", type=float, default=0.5)
+        parser.add_argument("--threads", type=int, default=32)
+        parser.add_argument("--rows", type=int, default=50)
+        parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+
+    def handle(self, *args, **options):
+        address_user = AddressUser.objects.create_user(username="benchmark_concurrency")
+        postal_addresses = PostalAddress.objects.bulk_get_or_create(
+            [
+                {"address1": f"{number} Concurrency Road", "country": "GBR"}
+                for number in range(options["rows"])
+            ]
+        )
+        address_user.add_postal_addresses(postal_addresses)
+        self.authorization = f"Bearer {issue_access_token(address_user.user)}"
+
+        try:
+            self.stdout.write(
+                f"{'mode':>9} {'clients':>8} {'seconds':>8} {'req/s':>8} "
+                f"{'p50 ms':>8} {'p99 ms':>8} {'errors':>7}"
+            )
+            for mode in options["modes"]:
+                if mode == "wsgi":
+                    result = self.run_wsgi(options)
+                else:
+                    path = reverse(
+                        "postaladdress-async-list"
+                        if mode == "asgi"
+                        else "postaladdress-list"
+                    )
+                    result = asyncio.run(self.run_asgi(path, options))
+                self.report(mode, options["clients"], *result)
+        finally:
+            PostalAddress.objects.filter(
+                pk__in=[a.pk for a in postal_addresses]
+            ).delete()
+            address_user.user.delete()
+
+    def report(self, mode, clients, seconds, latencies, errors):
+        latencies = sorted(latencies)
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        self.stdout.write(
+            f"{mode:>9} {clients:>8} {seconds:>8.2f} {clients / seconds:>8.0f} "
+            f"{statistics.median(latencies) * 1000:>8.0f} {p99 * 1000:>8.0f} "
+            f"{errors:>7}"
+        )
+
+    def run_wsgi(self, options):
+        handler = WSGIHandler()
+        path = reverse("postaladdress-list")
+        delay = options["delay"]
+
+        def client(submitted):
+            environ = {
+                "REQUEST_METHOD": "GET",
+                "PATH_INFO": path,
+                "QUERY_STRING": "stream=true",
+                "SERVER_NAME": "localhost",
+                "SERVER_PORT": "80",
+                "HTTP_HOST": "localhost",
+                "HTTP_AUTHORIZATION": self.authorization,
+                "wsgi.url_scheme": "http",
+                "wsgi.input": BytesIO(),
+                "wsgi.errors": BytesIO(),
+            }
+            statuses = []
+            body = handler(environ, lambda status, headers: statuses.append(status))
+            try:
+                for _ in body:
+                    # The worker thread is blocked writing to the slow client
+                    time.sleep(delay)
+            finally:
+                body.close()
+            return time.perf_counter() - submitted, statuses[0].startswith("200")
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["threads"]) as pool:
+            results = list(pool.map(client, [time.perf_counter()] * options["clients"]))
+        seconds = time.perf_counter() - start
+
+        return (
+            seconds,
+            [latency for latency, _ in results],
+            sum(not ok for _, ok in results),
+        )
+
+    async def run_asgi(self, path, options):
+        handler = ASGIHandler()
+        delay = options["delay"]
+
+        async def client():
+            scope = {
+                "type": "http",
+                "asgi": {"version": "3.0"},
+                "http_version": "1.1",
+                "method": "GET",
+                "scheme": "http",
+                "path": path,
+                "raw_path": path.encode(),
+                "query_string": b"stream=true",
+                "headers": [
+                    (b"host", b"localhost"),
+                    (b"authorization", self.authorization.encode()),
+                ],
+                "server": ("localhost", 80),
+            }
+            disconnected = asyncio.Event()
+            requested = False
+            statuses = []
+
+            async def receive():
+                nonlocal requested
+                if not requested:
+                    requested = True
+                    return {"type": "http.request", "body": b"", "more_body": False}
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    statuses.append(message["status"])
+                elif message["type"] == "http.response.body":
+                    # Only this client waits on its slow connection
+                    await asyncio.sleep(delay)
+
+            start = time.perf_counter()
+            await handler(scope, receive, send)
+            disconnected.set()
+            return time.perf_counter() - start, statuses[0] == 200
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(client() for _ in range(options["clients"])))
+        seconds = time.perf_counter() - start
+
+        return (
+            seconds,
+            [latency for latency, _ in results],
+            sum(not ok for _, ok in results),
+        )
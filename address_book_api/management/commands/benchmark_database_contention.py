@@ -0,0 +1,172 @@
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, transaction
+
+from address_book_api.models import AddressUser, PostalAddress
+
+# SQLITE_TUNING of each mode, see settings.py
+MODES = {"default": "false", "tuned": "true"}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure SQLite lock contention with Django's default connection settings "
+        "and with the tuned ones (WAL, synchronous=normal, busy_timeout and "
+        "BEGIN IMMEDIATE transactions). Each mode migrates a new database in a "
+        "temporary directory, then --processes worker processes (like gunicorn's) "
+        "each write to their own address book (--write-ratio of the operations, "
+        "adding an address or editing one, which reads before it writes) and read a "
+        "page of it for --seconds. Reports the throughput, latencies and "
+        '"database is locked" errors'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=8)
+        parser.add_argument("--seconds", type=float, default=10)
+        parser.add_argument("--write-ratio", type=float, default=0.2)
+        parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+        # Internal, runs one worker process until the --start + --seconds timestamp
+        parser.add_argument("--worker", type=int, help="Run as worker number N")
+        parser.add_argument("--start", type=float)
+
+    def handle(self, *args, **options):
+        if options["worker"] is not None:
+            result = self.run_worker(options)
+            self.stdout.write(json.dumps(result))
+            return
+
+        self.stdout.write(
+            f"{'mode':>8} {'ops/s':>8} {'writes/s':>9} {'read p50':>9} "
+            f"{'read p99':>9} {'write p50':>10} {'write p99':>10} {'locked':>7}"
+        )
+        for mode in options["modes"]:
+            with tempfile.TemporaryDirectory() as directory:
+                self.report(mode, self.run_mode(mode, Path(directory), options))
+
+    def run_mode(self, mode, directory, options):
+        env = {
+            **os.environ,
+            "DATABASE_URL": f"sqlite:///{directory / 'contention.sqlite3'}",
+            "SQLITE_TUNING": MODES[mode],
+        }
+
+        def django_admin(*arguments, **kwargs):
+            return subprocess.Popen(
+                [sys.executable, "-m", "django", *arguments],
+                cwd=settings.BASE_DIR,
+                env=env,
+                **kwargs,
+            )
+
+        django_admin("migrate", "--verbosity", "0").wait()
+
+        # Every worker starts at once, after they've all loaded Django
+        start = time.time() + 3
+        workers = [
+            django_admin(
+                "benchmark_database_contention",
+                f"--worker={number}",
+                f"--start={start}",
+                f"--seconds={options['seconds']}",
+                f"--write-ratio={options['write_ratio']}",
+                stdout=subprocess.PIPE,
+            )
+            for number in range(options["processes"])
+        ]
+        results = [json.loads(worker.communicate()[0]) for worker in workers]
+
+        return {
+            "reads": [latency for result in results for latency in result["reads"]],
+            "writes": [latency for result in results for latency in result["writes"]],
+            "locked": sum(result["locked"] for result in results),
+            "seconds": options["seconds"],
+        }
+
+    def run_worker(self, options):
+        address_user = self.retry(
+            AddressUser.objects.create_user, username=f"contention{options['worker']}"
+        )
+        # Every worker's address book has a page of addresses to read
+        address_ids = [
+            postal_address.pk
+            for postal_address in self.retry(self.add_addresses, address_user, 100)
+        ]
+
+        time.sleep(max(0, options["start"] - time.time()))
+        end = options["start"] + options["seconds"]
+        result = {"reads": [], "writes": [], "locked": 0}
+        while time.time() < end:
+            write = random.random() < options["write_ratio"]
+            started = time.perf_counter()
+            try:
+                if write and random.random() < 0.5:
+                    address_ids += [
+                        postal_address.pk
+                        for postal_address in self.add_addresses(address_user, 1)
+                    ]
+                elif write:
+                    address_user.update_postal_addresses(
+                        {random.choice(address_ids): {"address1": self.address1()}}
+                    )
+                else:
+                    list(
+                        PostalAddress.objects.filter(
+                            address_user_links__addressuser=address_user
+                        )
+                        .order_by("address_user_links__id")
+                        .values()[:100]
+                    )
+            except OperationalError as error:
+                if "locked" not in str(error):
+                    raise
+                result["locked"] += 1
+                continue
+            result["writes" if write else "reads"].append(time.perf_counter() - started)
+
+        return result
+
+    def add_addresses(self, address_user, count):
+        with transaction.atomic():
+            postal_addresses = PostalAddress.objects.bulk_get_or_create(
+                [{"address1": self.address1(), "country": "GBR"} for _ in range(count)]
+            )
+            address_user.add_postal_addresses(postal_addresses)
+
+        return postal_addresses
+
+    def address1(self):
+        return f"{random.getrandbits(64)} Contention Road"
+
+    def retry(self, function, *args, **kwargs):
+        # Setting up isn't measured, so lock errors are simply retried
+        while True:
+            try:
+                return function(*args, **kwargs)
+            except OperationalError:
+                time.sleep(0.1)
+
+    def report(self, mode, result):
+        def percentile(latencies, fraction):
+            if not latencies:
+                return float("nan")
+            latencies = sorted(latencies)
+            return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+        reads, writes = result["reads"], result["writes"]
+        self.stdout.write(
+            f"{mode:>8} {(len(reads) + len(writes)) / result['seconds']:>8.0f} "
+            f"{len(writes) / result['seconds']:>9.0f} "
+            f"{percentile(reads, 0.5) * 1000:>7.1f}ms "
+            f"{percentile(reads, 0.99) * 1000:>7.1f}ms "
+            f"{percentile(writes, 0.5) * 1000:>8.1f}ms "
+            f"{percentile(writes, 0.99) * 1000:>8.1f}ms {result['locked']:>7}"
+        )
@@ -0,0 +1,109 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from address_book_api.models import AddressUser, AddressUserPostalAddress, PostalAddress
+from address_book_api.serialisers import PostalAddressSerializer, representation_values
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the time per row of serializing a user's address book with "
+        "PostalAddressSerializer and with the values() read path used by the list "
+        "endpoints, both including the query. Rendering the JSON (the same for both) "
+        "is timed separately. The addresses are created in a transaction that's "
+        "rolled back"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows",
+            type=int,
+            nargs="+",
+            default=[1000, 10000, 100000],
+            help="Address book sizes to measure",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=3,
+            help="Runs of each path, the fastest is reported",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'rows':>8} {'serializer us/row':>18} {'values us/row':>14} "
+            f"{'speedup':>8} {'render us/row':>14}"
+        )
+        for rows in options["rows"]:
+            try:
+                with transaction.atomic():
+                    self.measure(rows, options["repeat"])
+                    raise Rollback
+            except Rollback:
+                pass
+
+    def measure(self, rows, repeat):
+        address_user = AddressUser.objects.create_user(username="benchmark_user")
+        PostalAddress.objects.bulk_create(
+            [
+                PostalAddress(
+                    address1=f"{number} Benchmark Road",
+                    address2=None if number % 3 else f"Flat {number}",
+                    zip_code=f"BM{number % 1000}",
+                    city="Cambridge",
+                    country="GBR",
+                )
+                for number in range(rows)
+            ],
+            batch_size=1000,
+        )
+        AddressUserPostalAddress.objects.bulk_create(
+            [
+                AddressUserPostalAddress(
+                    addressuser=address_user, postaladdress=address
+                )
+                for address in PostalAddress.objects.filter(
+                    address1__endswith=" Benchmark Road"
+                )
+            ],
+            batch_size=1000,
+        )
+        queryset = PostalAddress.objects.filter(
+            address_user_links__addressuser=address_user
+        ).order_by("address_user_links__id")
+        renderer = JSONRenderer()
+
+        def serializer_path():
+            return PostalAddressSerializer(queryset, many=True).data
+
+        def values_path():
+            return list(representation_values(PostalAddressSerializer(), queryset))
+
+        serializer_time, serializer_data = self.best_of(serializer_path, repeat)
+        values_time, values_data = self.best_of(values_path, repeat)
+        render_time, serializer_json = self.best_of(
+            lambda: renderer.render(serializer_data), repeat
+        )
+        if renderer.render(values_data) != serializer_json:
+            self.stderr.write(f"{rows} rows: the values() JSON differs")
+
+        self.stdout.write(
+            f"{rows:>8} {serializer_time / rows * 1e6:>18.2f} "
+            f"{values_time / rows * 1e6:>14.2f} {serializer_time / values_time:>7.1f}x "
+            f"{render_time / rows * 1e6:>14.2f}"
+        )
+
+    def best_of(self, path, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = path()
+            timings.append(time.perf_counter() - start)
+        return min(timings), result
@@ -0,0 +1,119 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from address_book_api.models import PostalAddress
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete PostalAddresses that no AddressUser references, in bounded batches. "
+        "Orphans are found with an anti-join on the through table, so addresses "
+        "orphaned by cascades or admin deletes are collected too"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Maximum number of addresses deleted per transaction",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0,
+            help="Seconds to sleep between batches, to give other writers a turn",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count the orphaned addresses, don't delete them",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep running, collecting orphans every --interval seconds",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=3600,
+            help="Seconds between collections when running with --loop",
+        )
+        parser.add_argument(
+            "--database",
+            default=DEFAULT_DB_ALIAS,
+            help="Database (e.g. address book shard) to collect orphans from",
+        )
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1")
+
+        self.database = options["database"]
+        try:
+            while True:
+                self.collect(
+                    options["batch_size"], options["sleep"], options["dry_run"]
+                )
+                if not options["loop"]:
+                    break
+                time.sleep(options["interval"])
+        except KeyboardInterrupt:
+            self.stdout.write("Interrupted")
+
+    def collect(self, batch_size, sleep, dry_run):
+        """Walk the orphans in primary key order, a batch at a time
+
+        Each batch is selected by an indexed anti-join and deleted in its own short
+        transaction, re-checking that it's still unreferenced in case it's been
+        associated with a user in the meantime
+        """
+        action = "Found" if dry_run else "Deleted"
+        started = time.monotonic()
+        last_id = 0
+        total = 0
+
+        while True:
+            ids = list(
+                PostalAddress.objects.using(self.database)
+                .unreferenced()
+                .filter(pk__gt=last_id)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            last_id = ids[-1]
+
+            if dry_run:
+                total += len(ids)
+            else:
+                with transaction.atomic(using=self.database):
+                    _, deleted = (
+                        PostalAddress.objects.using(self.database)
+                        .filter(pk__in=ids)
+                        .unreferenced()
+                        .delete()
+                    )
+                total += deleted.get(PostalAddress._meta.label, 0)
+
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f"{action} {total} orphaned addresses "
+                f"({total / elapsed if elapsed else 0:.0f}/s)"
+            )
+            if len(ids) < batch_size:
+                break
+            if sleep:
+                time.sleep(sleep)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{action} {total} orphaned addresses in "
+                f"{time.monotonic() - started:.2f}s"
+            )
+        )
+        return total
@@ -0,0 +1,419 @@
+import itertools
+import random
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+import iso3166
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from address_book_api import routers, search
+from address_book_api.models import (
+    ADDRESS_FIELDS,
+    AddressUser,
+    AddressUserPostalAddress,
+    PostalAddress,
+    address_fingerprint,
+)
+
+STREETS = (
+    "High Street",
+    "Station Road",
+    "Main Street",
+    "Park Road",
+    "Church Lane",
+    "Victoria Road",
+    "Green Lane",
+    "Manor Road",
+    "Mill Lane",
+    "King Street",
+    "Queen Street",
+    "New Road",
+    "Oak Avenue",
+    "Maple Drive",
+    "Rue de la Paix",
+    "Hauptstraße",
+    "Calle Mayor",
+    "Avenida Paulista",
+)
+
+CITIES = (
+    "London",
+    "York",
+    "Cambridge",
+    "Manchester",
+    "Springfield",
+    "Riverside",
+    "Paris",
+    "Lyon",
+    "Berlin",
+    "München",
+    "Madrid",
+    "São Paulo",
+    "Tokyo",
+    "Kyoto",
+)
+
+NULLABLE_FIELDS = ("address2", "zip_code", "city")
+
+
+def parse_weights(value, keys=None):
+    """Parse "KEY=NUMBER,..." into a dict, checking the keys against keys"""
+    weights = {}
+    for item in value.split(","):
+        key, _, number = item.partition("=")
+        if keys is not None and key not in keys:
+            raise CommandError(f"Unexpected {key!r}, expected one of {sorted(keys)}")
+        try:
+            weights[key] = float(number)
+        except ValueError:
+            raise CommandError(f"Expected KEY=NUMBER, got {item!r}")
+    return weights
+
+
+def generate_address(rng, spec, address1):
+    address = {
+        "address1": address1,
+        "address2": f"Flat {rng.randint(1, 99)}",
+        "zip_code": f"{rng.randint(1000, 99999):05}",
+        "city": rng.choice(CITIES),
+        "country": rng.choices(
+            spec["countries"], cum_weights=spec["country_cum_weights"]
+        )[0],
+    }
+    for field, rate in spec["null_rates"].items():
+        if rng.random() < rate:
+            address[field] = None
+    return address
+
+
+def generate_shared_addresses(spec):
+    """The pool that a share_ratio of every address book is drawn from"""
+    rng = random.Random(f"{spec['seed']}:shared")
+    # House numbers without a "-", so they never collide with address_book()'s
+    return [
+        generate_address(rng, spec, f"{index + 1} {rng.choice(STREETS)}")
+        for index in range(spec["shared_addresses"])
+    ]
+
+
+def address_book(spec, index):
+    """The addresses of user number index, as shared pool indexes and address dicts
+
+    Only depends on the seed and index, so the same user gets the same address book
+    however the users are chunked or spread across processes
+    """
+    rng = random.Random(f"{spec['seed']}:{index}")
+    if rng.random() < spec["heavy_user_rate"]:
+        mean = spec["heavy_user_addresses"]
+    else:
+        mean = spec["addresses_per_user"]
+    count = round(rng.expovariate(1 / mean)) if mean else 0
+
+    entries = []
+    shared = set()
+    for position in range(count):
+        if spec["shared_addresses"] and rng.random() < spec["share_ratio"]:
+            shared_index = rng.randrange(spec["shared_addresses"])
+            # An address is only in an address book once
+            if shared_index not in shared:
+                shared.add(shared_index)
+                entries.append(shared_index)
+        else:
+            # The user and position make it unique, hyphenated like Queens (NY)
+            # house numbers
+            address1 = f"{index}-{position + 1} {rng.choice(STREETS)}"
+            entries.append(generate_address(rng, spec, address1))
+    return entries
+
+
+def insert_rows(connection, model, fields, rows):
+    """INSERT rows (tuples of the fields' database values) with a single executemany,
+    skipping the ORM's per row compilation, which is most of bulk_create's time
+    """
+    quote_name = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {quote_name(model._meta.db_table)} "
+            f"({', '.join(quote_name(field) for field in fields)}) "
+            f"VALUES ({', '.join(['%s'] * len(fields))})",
+            rows,
+        )
+
+
+def insert_postal_addresses(using, addresses, owner_count=0):
+    """INSERT new addresses (dicts of ADDRESS_FIELDS) with insert_rows, returns their
+    ids in the same order
+    """
+    connection = connections[using]
+    updated_at = connection.ops.adapt_datetimefield_value(timezone.now())
+    rows = [
+        (
+            *(address[field] for field in ADDRESS_FIELDS),
+            address_fingerprint(address[field] for field in ADDRESS_FIELDS),
+            owner_count,
+            updated_at,
+        )
+        for address in addresses
+    ]
+    insert_rows(
+        connection,
+        PostalAddress,
+        (*ADDRESS_FIELDS, "fingerprint", "owner_count", "updated_at"),
+        rows,
+    )
+
+    # Their ids, by fingerprint like bulk_get_or_create
+    fingerprints = [row[len(ADDRESS_FIELDS)] for row in rows]
+    ids = {}
+    for batch in range(0, len(fingerprints), 500):
+        ids.update(
+            PostalAddress.objects.using(using)
+            .filter(fingerprint__in=fingerprints[batch : batch + 500])
+            .values_list("fingerprint", "pk")
+        )
+    return [ids[fingerprint] for fingerprint in fingerprints]
+
+
+def generate_chunk(spec, start, stop, shared_ids):
+    """Create users start to stop (exclusive) and their address books, returns the
+    number of rows inserted into each table
+
+    shared_ids maps each database to the ids of the shared addresses on it
+    """
+    users = User.objects.bulk_create(
+        [
+            User(
+                username=f"{spec['username_prefix']}{index}", password=spec["password"]
+            )
+            for index in range(start, stop)
+        ]
+    )
+    rows = Counter(users=len(users))
+
+    by_shard = defaultdict(list)
+    for index, user in zip(range(start, stop), users):
+        by_shard[routers.get_shard(user.pk)].append((user, address_book(spec, index)))
+
+    for shard, address_books in by_shard.items():
+        with transaction.atomic(using=shard):
+            address_users = AddressUser.objects.using(shard).bulk_create(
+                [AddressUser(user=user) for user, _ in address_books]
+            )
+
+            # A new address is only in the user's address book, so has one owner
+            new_addresses = [
+                entry
+                for _, entries in address_books
+                for entry in entries
+                if isinstance(entry, dict)
+            ]
+            new_ids = iter(insert_postal_addresses(shard, new_addresses, owner_count=1))
+
+            owners = Counter()
+            links = []
+            for address_user, (_, entries) in zip(address_users, address_books):
+                for entry in entries:
+                    if isinstance(entry, dict):
+                        postal_address_id = next(new_ids)
+                    else:
+                        postal_address_id = shared_ids[shard][entry]
+                        owners[postal_address_id] += 1
+                    links.append((address_user.pk, postal_address_id))
+            insert_rows(
+                connections[shard],
+                AddressUserPostalAddress,
+                ("addressuser_id", "postaladdress_id"),
+                links,
+            )
+
+            # One UPDATE per distinct number of new owners
+            by_count = defaultdict(list)
+            for postal_address_id, count in owners.items():
+                by_count[count].append(postal_address_id)
+            for count, postal_address_ids in by_count.items():
+                PostalAddress.objects.using(shard).filter(
+                    pk__in=postal_address_ids
+                ).update(owner_count=F("owner_count") + count)
+
+        rows.update(
+            address_users=len(address_users),
+            postal_addresses=len(new_addresses),
+            links=len(links),
+        )
+
+    return rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate synthetic users and address books for capacity planning and "
+        "benchmarks. Each user's address book has a random number of addresses "
+        "(exponentially distributed around --addresses-per-user, or "
+        "--heavy-user-addresses for a --heavy-user-rate of heavy users), a "
+        "--share-ratio of them drawn from a pool of --shared-addresses that many "
+        "users have, the rest their own. The data only depends on --seed and each "
+        "user's number, so is the same with any --chunk-size or --workers. Rows are "
+        "written with bulk inserts, --chunk-size users per transaction, and the "
+        "search index is rebuilt once at the end rather than maintained row by row"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument(
+            "--first-user",
+            type=int,
+            default=0,
+            help="Number of the first user, to add users to an earlier run's",
+        )
+        parser.add_argument("--username-prefix", default="synthetic")
+        parser.add_argument(
+            "--password",
+            help="Password of every user (hashed once), they can't log in without",
+        )
+        parser.add_argument("--addresses-per-user", type=float, default=10)
+        parser.add_argument("--heavy-user-rate", type=float, default=0.001)
+        parser.add_argument("--heavy-user-addresses", type=float, default=10000)
+        parser.add_argument("--share-ratio", type=float, default=0.1)
+        parser.add_argument("--shared-addresses", type=int, default=1000)
+        parser.add_argument(
+            "--countries",
+            default="GBR=50,USA=20,FRA=10,DEU=10,ESP=5,BRA=3,JPN=2",
+            help="Weighted mix of alpha-3 country codes",
+        )
+        parser.add_argument(
+            "--null-rates",
+            default="address2=0.6,zip_code=0.05,city=0.02",
+            help=f"Fraction of NULLs in each of {', '.join(NULLABLE_FIELDS)}",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Processes generating chunks in parallel",
+        )
+        parser.add_argument(
+            "--keep-search-triggers",
+            action="store_true",
+            help="Maintain the search index row by row instead of rebuilding it",
+        )
+
+    def handle(self, *args, **options):
+        if options["users"] < 0 or options["chunk_size"] < 1 or options["workers"] < 1:
+            raise CommandError(
+                "--users can't be negative, --chunk-size and --workers at least 1"
+            )
+        if not 0 <= options["share_ratio"] <= 1:
+            raise CommandError("--share-ratio must be between 0 and 1")
+
+        countries = parse_weights(options["countries"], iso3166.countries_by_alpha3)
+        spec = {
+            "seed": options["seed"],
+            "username_prefix": options["username_prefix"],
+            "password": make_password(options["password"]),
+            "addresses_per_user": options["addresses_per_user"],
+            "heavy_user_rate": options["heavy_user_rate"],
+            "heavy_user_addresses": options["heavy_user_addresses"],
+            "share_ratio": options["share_ratio"],
+            "shared_addresses": options["shared_addresses"],
+            "countries": list(countries),
+            "country_cum_weights": list(itertools.accumulate(countries.values())),
+            "null_rates": parse_weights(options["null_rates"], NULLABLE_FIELDS),
+        }
+
+        first = options["first_user"]
+        stop = first + options["users"]
+        if User.objects.filter(
+            username__in=[
+                f"{spec['username_prefix']}{index}" for index in (first, stop - 1)
+            ]
+        ).exists():
+            raise CommandError(
+                "Those users already exist, use --first-user to add more users"
+            )
+
+        databases = settings.DATABASE_SHARDS or [DEFAULT_DB_ALIAS]
+        indexed = [
+            database
+            for database in databases
+            if search.is_available(connections[database])
+            and not options["keep_search_triggers"]
+        ]
+
+        started = time.perf_counter()
+        rows = Counter()
+        for database in indexed:
+            search.drop_search_triggers(connections[database])
+        try:
+            shared_ids = self.create_shared_addresses(spec, databases)
+            chunks = [
+                (start, min(start + options["chunk_size"], stop))
+                for start in range(first, stop, options["chunk_size"])
+            ]
+            for chunk_rows in self.generate(spec, chunks, shared_ids, options):
+                rows.update(chunk_rows)
+                self.report(rows, time.perf_counter() - started)
+        finally:
+            for database in indexed:
+                search_started = time.perf_counter()
+                search.create_search_triggers(connections[database])
+                search.rebuild_search_index(connections[database])
+                self.stdout.write(
+                    f"Rebuilt the search index of {database} in "
+                    f"{time.perf_counter() - search_started:.1f}s"
+                )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Generated {rows['users']} users, {rows['postal_addresses']} "
+                f"addresses and {rows['links']} address book entries in "
+                f"{time.perf_counter() - started:.1f}s"
+            )
+        )
+
+    def create_shared_addresses(self, spec, databases):
+        """Get or create the shared pool on every database, returns their ids"""
+        addresses = generate_shared_addresses(spec)
+        return {
+            database: [
+                postal_address.pk
+                for postal_address in PostalAddress.objects.db_manager(
+                    database
+                ).bulk_get_or_create(addresses)
+            ]
+            for database in databases
+        }
+
+    def generate(self, spec, chunks, shared_ids, options):
+        """Yield the rows inserted for each chunk, as they're done"""
+        if options["workers"] == 1:
+            for start, stop in chunks:
+                yield generate_chunk(spec, start, stop, shared_ids)
+            return
+
+        # Forked workers mustn't share the parent's connections
+        connections.close_all()
+        with ProcessPoolExecutor(options["workers"], initializer=django.setup) as pool:
+            futures = [
+                pool.submit(generate_chunk, spec, start, stop, shared_ids)
+                for start, stop in chunks
+            ]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def report(self, rows, seconds):
+        total = rows["users"] + rows["address_users"]
+        total += rows["postal_addresses"] + rows["links"]
+        self.stdout.write(
+            f"{rows['users']} users, {rows['links']} address book entries, "
+            f"{total} rows in {seconds:.1f}s ({total / seconds:,.0f} rows/s)"
+        )
@@ -0,0 +1,100 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from address_book_api import routers
+from address_book_api.models import (
+    ADDRESS_FIELDS,
+    AddressUser,
+    AddressUserPostalAddress,
+    PostalAddress,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Move every address book that isn't on the shard its user now hashes to "
+        "(see routers.get_shard), after DATABASE_SHARDS has changed or to shard an "
+        "existing address book on the default database. Each user is copied to their "
+        "shard in one transaction, addresses deduplicated against the shard's, and "
+        "then deleted from where they were. Users writing to their address book while "
+        "it's moved can lose the write, so run it while the API is quiet"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count the address books to move",
+        )
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_SHARDS:
+            raise CommandError("No DATABASE_SHARDS are configured")
+
+        moved = 0
+        for source in [DEFAULT_DB_ALIAS, *settings.DATABASE_SHARDS]:
+            # Read up front, rather than iterated while they're deleted
+            for address_user in list(AddressUser.objects.using(source)):
+                target = routers.get_shard(address_user.user_id)
+                if target == source:
+                    continue
+                if not options["dry_run"]:
+                    self.move(address_user, target)
+                moved += 1
+
+        action = "Found" if options["dry_run"] else "Moved"
+        self.stdout.write(
+            self.style.SUCCESS(f"{action} {moved} misplaced address books")
+        )
+
+    def move(self, address_user, target):
+        source = address_user._state.db
+        addresses = list(
+            PostalAddress.objects.using(source)
+            .filter(address_user_links__addressuser=address_user)
+            .order_by("address_user_links__id")
+            .values(*ADDRESS_FIELDS)
+        )
+
+        # Only copied if an earlier run didn't already, before it failed to delete
+        # the original
+        if (
+            not AddressUser.objects.using(target)
+            .filter(user_id=address_user.user_id)
+            .exists()
+        ):
+            with transaction.atomic(using=target):
+                copy = AddressUser.objects.using(target).create(
+                    user_id=address_user.user_id,
+                    # A new version, so cached responses and ETags are superseded
+                    version=address_user.version + 1,
+                    modified_at=timezone.now(),
+                )
+                # Through rows in the same order, so the address book is too
+                postal_addresses = PostalAddress.objects.db_manager(
+                    target
+                ).bulk_get_or_create(addresses)
+                AddressUserPostalAddress.objects.using(target).bulk_create(
+                    [
+                        AddressUserPostalAddress(
+                            addressuser=copy, postaladdress=postal_address
+                        )
+                        for postal_address in postal_addresses
+                    ],
+                    batch_size=1000,
+                )
+                PostalAddress.objects.using(target).filter(
+                    pk__in=[postal_address.pk for postal_address in postal_addresses]
+                ).update(owner_count=F("owner_count") + 1)
+
+        with transaction.atomic(using=source):
+            postal_address_ids = list(
+                address_user.postal_addresses.values_list("pk", flat=True)
+            )
+            address_user.delete()
+            PostalAddress.objects.using(source).filter(
+                pk__in=postal_address_ids
+            ).orphaned().delete()
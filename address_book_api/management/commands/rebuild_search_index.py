@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from address_book_api import search
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the PostalAddress full-text search index from scratch, recreating "
+        "the triggers that keep it in sync if they've been dropped"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database",
+            default=DEFAULT_DB_ALIAS,
+            help="Database (e.g. address book shard) to rebuild the index of",
+        )
+
+    def handle(self, *args, **options):
+        connection = connections[options["database"]]
+        if not search.is_available(connection):
+            raise CommandError("Full-text search is only supported on SQLite")
+
+        search.create_search_triggers(connection)
+        indexed = search.rebuild_search_index(connection)
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} postal addresses"))
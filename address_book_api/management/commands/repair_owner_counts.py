@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from address_book_api.models import PostalAddress
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute PostalAddress.owner_count from the AddressUser associations, "
+        "fixing any addresses whose count has drifted"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database",
+            default=DEFAULT_DB_ALIAS,
+            help="Database (e.g. address book shard) to repair",
+        )
+
+    def handle(self, *args, **options):
+        repaired = PostalAddress.objects.using(
+            options["database"]
+        ).repair_owner_counts()
+        self.stdout.write(
+            self.style.SUCCESS(f"Repaired owner_count of {repaired} postal addresses")
+        )
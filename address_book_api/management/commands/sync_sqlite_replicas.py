@@ -0,0 +1,54 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the primary SQLite database over each of the DATABASE_REPLICAS, a "
+        "stand in for replication when trying out replica reads locally, e.g. "
+        "DATABASE_REPLICA_URLS=sqlite:///replica.sqlite3. Run with --loop to keep "
+        "the replicas lagging at most --interval seconds behind"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep running, copying the primary every --interval seconds",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5,
+            help="Seconds between copies when running with --loop",
+        )
+
+    def handle(self, *args, **options):
+        aliases = [DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS]
+        if len(aliases) == 1:
+            raise CommandError("No DATABASE_REPLICAS are configured")
+        if any(connections[alias].vendor != "sqlite" for alias in aliases):
+            raise CommandError("The primary and replicas all have to be SQLite")
+
+        try:
+            while True:
+                self.sync(settings.DATABASE_REPLICAS)
+                if not options["loop"]:
+                    break
+                time.sleep(options["interval"])
+        except KeyboardInterrupt:
+            self.stdout.write("Interrupted")
+
+    def sync(self, replicas):
+        primary = connections[DEFAULT_DB_ALIAS]
+        primary.ensure_connection()
+        for alias in replicas:
+            replica = connections[alias]
+            replica.ensure_connection()
+            # An online backup, readers of the replica wait for it rather than seeing
+            # a partial copy
+            primary.connection.backup(replica.connection)
+            self.stdout.write(f"Copied {primary.alias} to {alias}")
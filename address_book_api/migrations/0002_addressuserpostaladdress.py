@@ -0,0 +1,60 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("address_book_api", "0001_initial"),
+    ]
+
+    # The through table already exists (it was auto-created by the ManyToManyField),
+    # so only the migration state changes here
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name="AddressUserPostalAddress",
+                    fields=[
+                        (
+                            "id",
+                            models.BigAutoField(
+                                auto_created=True,
+                                primary_key=True,
+                                serialize=False,
+                                verbose_name="ID",
+                            ),
+                        ),
+                        (
+                            "addressuser",
+                            models.ForeignKey(
+                                on_delete=django.db.models.deletion.CASCADE,
+                                to="address_book_api.addressuser",
+                            ),
+                        ),
+                        (
+                            "postaladdress",
+                            models.ForeignKey(
+                                on_delete=django.db.models.deletion.CASCADE,
+                                related_name="address_user_links",
+                                to="address_book_api.postaladdress",
+                            ),
+                        ),
+                    ],
+                    options={
+                        "db_table": "address_book_api_addressuser_postal_addresses",
+                        "unique_together": {("addressuser", "postaladdress")},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name="addressuser",
+                    name="postal_addresses",
+                    field=models.ManyToManyField(
+                        related_name="postaladdresses",
+                        through="address_book_api.AddressUserPostalAddress",
+                        to="address_book_api.postaladdress",
+                    ),
+                ),
+            ],
+        ),
+    ]
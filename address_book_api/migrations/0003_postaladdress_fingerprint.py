@@ -0,0 +1,113 @@
+import hashlib
+import json
+
+from django.db import migrations, models
+
+# Copied from address_book_api.models as they were when the unique index was built,
+# so later changes to the fingerprint format don't change this backfill
+ADDRESS_FIELDS = ("address1", "address2", "zip_code", "city", "country")
+
+
+def address_fingerprint(values):
+    canonical = json.dumps(list(values), ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def backfill_fingerprints(apps, schema_editor):
+    """Fingerprint existing addresses
+
+    The old partial constraints didn't cover every combination of NULL fields, so
+    there may be duplicates. These are merged into the oldest address, moving over
+    any AddressUser associations, before the fingerprint is made unique
+    """
+    PostalAddress = apps.get_model("address_book_api", "PostalAddress")
+    AddressUserPostalAddress = apps.get_model(
+        "address_book_api", "AddressUserPostalAddress"
+    )
+
+    keep = {}
+    duplicates = {}
+    batch = []
+    for address in PostalAddress.objects.order_by("id").iterator(chunk_size=2000):
+        fingerprint = address_fingerprint(
+            getattr(address, field) for field in ADDRESS_FIELDS
+        )
+        if fingerprint in keep:
+            duplicates[address.id] = keep[fingerprint]
+            continue
+
+        keep[fingerprint] = address.id
+        address.fingerprint = fingerprint
+        batch.append(address)
+        if len(batch) >= 2000:
+            PostalAddress.objects.bulk_update(batch, ["fingerprint"])
+            batch = []
+
+    PostalAddress.objects.bulk_update(batch, ["fingerprint"])
+
+    for duplicate_id, keep_id in duplicates.items():
+        owners = AddressUserPostalAddress.objects.filter(
+            postaladdress_id=keep_id
+        ).values("addressuser_id")
+        # Users that already have the kept address just lose the duplicate
+        AddressUserPostalAddress.objects.filter(
+            postaladdress_id=duplicate_id, addressuser_id__in=owners
+        ).delete()
+        AddressUserPostalAddress.objects.filter(postaladdress_id=duplicate_id).update(
+            postaladdress_id=keep_id
+        )
+
+    PostalAddress.objects.filter(id__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("address_book_api", "0002_addressuserpostaladdress"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="postaladdress",
+            name="fingerprint",
+            field=models.CharField(editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(backfill_fingerprints, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="postaladdress",
+            name="fingerprint",
+            field=models.CharField(editable=False, max_length=64, unique=True),
+        ),
+        migrations.RemoveConstraint(
+            model_name="postaladdress",
+            name="unique_with_all",
+        ),
+        migrations.RemoveConstraint(
+            model_name="postaladdress",
+            name="unique_without_address2_zip_code_city",
+        ),
+        migrations.RemoveConstraint(
+            model_name="postaladdress",
+            name="unique_without_zip_code_city",
+        ),
+        migrations.RemoveConstraint(
+            model_name="postaladdress",
+            name="unique_without_city",
+        ),
+        migrations.RemoveConstraint(
+            model_name="postaladdress",
+            name="unique_without_address2",
+        ),
+        migrations.RemoveConstraint(
+            model_name="postaladdress",
+            name="unique_without_zip_code",
+        ),
+        migrations.RemoveConstraint(
+            model_name="postaladdress",
+            name="unique_without_address2_zip_code",
+        ),
+        migrations.RemoveConstraint(
+            model_name="postaladdress",
+            name="unique_without_address2_city",
+        ),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_owners(apps, schema_editor):
+    PostalAddress = apps.get_model("address_book_api", "PostalAddress")
+    AddressUserPostalAddress = apps.get_model(
+        "address_book_api", "AddressUserPostalAddress"
+    )
+
+    PostalAddress.objects.update(
+        owner_count=Coalesce(
+            Subquery(
+                AddressUserPostalAddress.objects.filter(postaladdress=OuterRef("pk"))
+                .order_by()
+                .values("postaladdress")
+                .annotate(count=Count("*"))
+                .values("count")
+            ),
+            0,
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("address_book_api", "0003_postaladdress_fingerprint"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="postaladdress",
+            name="owner_count",
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(count_owners, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations
+
+from address_book_api import search
+
+
+def create_search_index(apps, schema_editor):
+    # Full-text search is only supported on SQLite (FTS5)
+    if search.is_available(schema_editor.connection):
+        search.create_search_index(schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    if search.is_available(schema_editor.connection):
+        search.drop_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("address_book_api", "0004_postaladdress_owner_count"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
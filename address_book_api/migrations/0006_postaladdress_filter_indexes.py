@@ -0,0 +1,45 @@
+from django.db import migrations, models
+
+from address_book_api import sqlite
+
+
+def create_nocase_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+
+    sqlite.create_nocase_indexes(schema_editor.connection)
+    # Without statistics the planner can't tell a selective filter from one that
+    # matches most of the table, so (re)gather them for the new indexes
+    schema_editor.execute("ANALYZE")
+
+
+def drop_nocase_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+
+    sqlite.drop_nocase_indexes(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("address_book_api", "0005_postaladdress_search"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="postaladdress",
+            index=models.Index(
+                fields=["country", "city", "zip_code"], name="address_country_city_zip"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="postaladdress",
+            index=models.Index(fields=["city", "zip_code"], name="address_city_zip"),
+        ),
+        migrations.AddIndex(
+            model_name="postaladdress",
+            index=models.Index(fields=["zip_code"], name="address_zip"),
+        ),
+        migrations.RunPython(create_nocase_indexes, drop_nocase_indexes),
+    ]
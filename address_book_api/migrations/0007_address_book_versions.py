@@ -0,0 +1,36 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+from address_book_api.sqlite import restore_sqlite_schema
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("address_book_api", "0006_postaladdress_filter_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="addressuser",
+            name="modified_at",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now, editable=False
+            ),
+        ),
+        migrations.AddField(
+            model_name="addressuser",
+            name="version",
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="postaladdress",
+            name="updated_at",
+            field=models.DateTimeField(
+                auto_now=True, default=django.utils.timezone.now
+            ),
+            preserve_default=False,
+        ),
+        # Adding the fields rebuilds the tables on SQLite
+        migrations.RunPython(restore_sqlite_schema, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+from address_book_api.sqlite import restore_sqlite_schema
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("address_book_api", "0007_address_book_versions"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="addressuser",
+            name="user",
+            field=models.OneToOneField(
+                db_constraint=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="user",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        # Dropping the constraint rebuilds the table on SQLite
+        migrations.RunPython(restore_sqlite_schema, migrations.RunPython.noop),
+    ]
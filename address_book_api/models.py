@@ -1,9 +1,15 @@
-from django.db import models
+import hashlib
+import json
+
+from django.db import IntegrityError, connections, models, router, transaction
+from django.db.models import Case, Count, F, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.contrib.auth.models import User
-from django.db.models.constraints import UniqueConstraint
-from django.db.models import Q
 import iso3166
 
+from address_book_api import routers
+
 # Create your models here.
 
 # Postal address can be a mess
@@ -13,6 +19,144 @@ import iso3166
 # or validate against google maps api https://github.com/furious-luke/django-address
 from rest_framework.validators import UniqueTogetherValidator
 
+# Most of the multi query methods below are atomic without a savepoint (a SAVEPOINT
+# and RELEASE per call inside the API's transactions), nothing recovers from an error
+# part way through them, so the enclosing transaction is rolled back as a whole.
+# upsert and update_postal_addresses keep theirs, their errors are recovered from
+
+# Fields that together identify a postal address
+ADDRESS_FIELDS = ("address1", "address2", "zip_code", "city", "country")
+
+
+def address_fingerprint(values):
+    """Fixed width key identifying an address, used to enforce uniqueness
+
+    values are the ADDRESS_FIELDS in order. They're JSON encoded before hashing,
+    so a NULL field can't collide with an empty (or "null") string and NULLs
+    compare equal to each other, which a composite unique index won't do
+    """
+    canonical = json.dumps(list(values), ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class PostalAddressQuerySet(models.QuerySet):
+    def orphaned(self):
+        """Addresses that aren't associated with any AddressUser, going by owner_count"""
+        return self.filter(owner_count=0)
+
+    def unreferenced(self):
+        """Addresses that aren't associated with any AddressUser, going by an anti-join
+        on the through table, so unlike orphaned() it doesn't rely on owner_count
+        """
+        return self.filter(address_user_links__isnull=True)
+
+    def repair_owner_counts(self):
+        """Recompute owner_count from the through table, in a single UPDATE of just
+        the rows that have drifted. Returns the number of rows fixed
+        """
+        actual_owner_count = Coalesce(
+            Subquery(
+                AddressUserPostalAddress.objects.filter(postaladdress=OuterRef("pk"))
+                .order_by()
+                .values("postaladdress")
+                .annotate(count=Count("*"))
+                .values("count")
+            ),
+            0,
+        )
+        return (
+            self.alias(actual_owner_count=actual_owner_count)
+            .exclude(owner_count=F("actual_owner_count"))
+            .update(owner_count=actual_owner_count)
+        )
+
+    def bulk_create(self, objs, *args, **kwargs):
+        # bulk_create doesn't call save(), so fingerprint here instead
+        objs = list(objs)
+        for obj in objs:
+            obj.refresh_fingerprint()
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        if set(fields) & set(ADDRESS_FIELDS):
+            now = timezone.now()
+            for obj in objs:
+                obj.refresh_fingerprint()
+                obj.updated_at = now
+            fields = [*fields, "fingerprint", "updated_at"]
+
+        with transaction.atomic(using=self.db, savepoint=False):
+            updated = super().bulk_update(objs, fields, *args, **kwargs)
+            AddressUser.objects.using(self.db).filter(
+                postal_addresses__in=[obj.pk for obj in objs]
+            ).touch()
+        return updated
+
+    def delete(self):
+        # Every owner's address book changes, which is done here (in one query)
+        # rather than a pre_delete handler, which would be sent per address
+        with transaction.atomic(using=self.db, savepoint=False):
+            AddressUser.objects.using(self.db).filter(postal_addresses__in=self).touch()
+            return super().delete()
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
+class PostalAddressManager(models.Manager.from_queryset(PostalAddressQuerySet)):
+    def upsert(self, address):
+        """Race free get_or_create for a single address, returns (PostalAddress, created)
+
+        Rather than checking for the address first, the INSERT is attempted straight
+        away in a savepoint and the fingerprint unique index decides. If it conflicts
+        (including with a concurrent create) the existing row is fetched instead
+        """
+        using = self._db or router.db_for_write(self.model)
+        postal_address = self.model(
+            **{field: address.get(field) for field in ADDRESS_FIELDS}
+        )
+        try:
+            with transaction.atomic(using=using):
+                postal_address.save(force_insert=True, using=using)
+        except IntegrityError:
+            return self.using(using).get(fingerprint=postal_address.fingerprint), False
+
+        return postal_address, True
+
+    def bulk_get_or_create(self, addresses, batch_size=500):
+        """Set based equivalent of get_or_create for many addresses at once
+
+        Takes a list of dicts of address fields and returns the matching PostalAddress
+        for each, in the same order. Each batch costs two queries, an INSERT of every
+        address that ignores conflicts with existing rows (so concurrent creates are safe),
+        followed by a single SELECT by fingerprint to resolve all of them, new and
+        pre-existing
+        """
+        fingerprints = [
+            address_fingerprint(address.get(field) for field in ADDRESS_FIELDS)
+            for address in addresses
+        ]
+        unique_addresses = dict(zip(fingerprints, addresses))
+
+        found = {}
+        batches = list(unique_addresses.items())
+        for start in range(0, len(batches), batch_size):
+            batch = dict(batches[start : start + batch_size])
+            self.bulk_create(
+                [
+                    self.model(
+                        **{field: address.get(field) for field in ADDRESS_FIELDS}
+                    )
+                    for address in batch.values()
+                ],
+                ignore_conflicts=True,
+            )
+            for address in self.filter(fingerprint__in=batch):
+                found[address.fingerprint] = address
+
+        return [found[fingerprint] for fingerprint in fingerprints]
+
 
 class PostalAddress(models.Model):
     # Technically address 1 and country are the only strict requirements
@@ -46,89 +190,394 @@ class PostalAddress(models.Model):
         null=False,
     )
 
+    # Uniqueness of the address fields (NULLs included) is enforced by a single
+    # unique index on their fingerprint, rather than a composite constraint for every
+    # combination of nullable fields. Kept up to date by save() and the bulk
+    # queryset methods, note QuerySet.update() on address fields bypasses it
+    fingerprint = models.CharField(max_length=64, unique=True, editable=False)
+
+    # Number of AddressUsers the address is associated with, so deciding whether an
+    # address can be deleted is an indexed lookup rather than a through table scan.
+    # Maintained with F() updates by the m2m_changed / pre_delete signal handlers,
+    # AddressUser's bulk methods and AddressUserPostalAddress save() / delete(), see
+    # the repair_owner_counts command if it drifts
+    owner_count = models.PositiveIntegerField(default=0, db_index=True, editable=False)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = PostalAddressManager()
+
+    @property
+    def address_key(self):
+        return tuple(getattr(self, field) for field in ADDRESS_FIELDS)
+
+    def refresh_fingerprint(self):
+        self.fingerprint = address_fingerprint(self.address_key)
+
+    def save(self, *args, **kwargs):
+        self.refresh_fingerprint()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and set(update_fields) & set(ADDRESS_FIELDS):
+            kwargs["update_fields"] = {*update_fields, "fingerprint", "updated_at"}
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=self._state.db, savepoint=False):
+            AddressUser.objects.using(self._state.db).filter(
+                postal_addresses=self
+            ).touch()
+            return super().delete(*args, **kwargs)
+
     def __str__(self):
-        return (
-            self.address1
-            + " "
-            + self.address2
-            + " "
-            + self.zip_code
-            + " "
-            + self.city
-            + " "
-            + self.country
-        )
+        # Skipping the NULL fields
+        return " ".join(value for value in self.address_key if value is not None)
 
     class Meta:
         verbose_name = "Postal Address"
         verbose_name_plural = "Postal Addresses"
-        constraints = [
-            # As address2 is optional (null=True)
-            UniqueConstraint(
-                fields=["address1", "address2", "zip_code", "city", "country"],
-                name="unique_with_all",
-            ),
-            UniqueConstraint(
-                fields=["address1", "country"],
-                condition=Q(address2=None, zip_code=None, city=None),
-                name="unique_without_address2_zip_code_city",
-            ),
-            UniqueConstraint(
-                fields=["address1", "address2", "country"],
-                condition=Q(zip_code=None, city=None),
-                name="unique_without_zip_code_city",
-            ),
-            UniqueConstraint(
-                fields=["address1", "address2", "zip_code", "country"],
-                condition=Q(city=None),
-                name="unique_without_city",
-            ),
-            UniqueConstraint(
-                fields=["address1", "zip_code", "country"],
-                condition=Q(address2=None),
-                name="unique_without_address2",
-            ),
-            UniqueConstraint(
-                fields=["address1", "address2", "zip_code", "country"],
-                condition=Q(zip_code=None),
-                name="unique_without_zip_code",
-            ),
-            UniqueConstraint(
-                fields=["address1", "city", "country"],
-                condition=Q(address2=None, zip_code=None),
-                name="unique_without_address2_zip_code",
-            ),
-            UniqueConstraint(
-                fields=["address1", "zip_code", "country"],
-                condition=Q(address2=None, city=None),
-                name="unique_without_address2_city",
+        # For filtering a user's addresses (see PostalAddressFilter). The user is
+        # only known to the through table, so these find the matching addresses,
+        # which are then checked against the through table's unique index. On SQLite
+        # there are also NOCASE indexes on city and zip_code for LIKE lookups
+        # (startswith and the case insensitive ones), see migration 0006
+        indexes = [
+            models.Index(
+                fields=["country", "city", "zip_code"], name="address_country_city_zip"
             ),
+            models.Index(fields=["city", "zip_code"], name="address_city_zip"),
+            models.Index(fields=["zip_code"], name="address_zip"),
         ]
 
 
-class AddressUserManager(models.Manager):
+class AddressUserQuerySet(models.QuerySet):
+    def touch(self):
+        """Mark the users' address books as modified, in a single UPDATE
+
+        The version and modified_at are what conditional GETs of the address book are
+        validated against, so anything that changes a user's addresses, or the
+        addresses themselves, has to touch every user they belong to
+        """
+        return self.update(version=F("version") + 1, modified_at=timezone.now())
+
+
+class AddressUserManager(models.Manager.from_queryset(AddressUserQuerySet)):
     """Add additional method to address user to emulate create_user behaviour
     from django.contrib.auth.models.User
     """
 
-    def create_user(*args, **kwargs):
+    def create_user(self, **kwargs):
         new_user = User.objects.create_user(**kwargs)
 
-        return AddressUser.objects.create(user=new_user)
+        # Users are on the primary, their address book on its shard (if sharded)
+        return self.db_manager(routers.get_shard(new_user.pk)).create(user=new_user)
 
 
 class AddressUser(models.Model):
-    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="user")
+    # Not a database constraint, as the user is on another database when the address
+    # book is sharded
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, related_name="user", db_constraint=False
+    )
     postal_addresses = models.ManyToManyField(
-        PostalAddress, related_name="postaladdresses"
+        PostalAddress,
+        related_name="postaladdresses",
+        through="AddressUserPostalAddress",
     )
+    # Bumped whenever the address book changes, see AddressUserQuerySet.touch()
+    version = models.PositiveBigIntegerField(default=0, editable=False)
+    modified_at = models.DateTimeField(default=timezone.now, editable=False)
 
     @property
     def username(self):
         return self.username
 
+    def _lock_address_book(self, db):
+        """Lock this user's row until the end of the transaction, so concurrent
+        changes to their address book queue up and the links read after it are still
+        there (or still missing) when they're written. Otherwise two concurrent adds
+        of an address could both count it. SQLite has no row locks, its writes are
+        serialized by BEGIN IMMEDIATE transactions instead (see SQLITE_TUNING)
+        """
+        if connections[db].features.has_select_for_update:
+            list(
+                AddressUser.objects.using(db)
+                .filter(pk=self.pk)
+                .select_for_update()
+                .values_list("pk", flat=True)
+            )
+
+    def add_postal_addresses(self, postal_addresses):
+        """Associate many addresses with this user in a single through table INSERT
+
+        Like postal_addresses.add() the addresses that are already associated are
+        looked up first (in one query), so only the owner_count of newly associated
+        addresses is incremented. They're added to the address book in the order
+        given, duplicates dropped
+        """
+        db = self._state.db
+        postal_address_ids = list(
+            dict.fromkeys(postal_address.pk for postal_address in postal_addresses)
+        )
+
+        with transaction.atomic(using=db, savepoint=False):
+            self._lock_address_book(db)
+            existing_ids = set(
+                AddressUserPostalAddress.objects.using(db)
+                .filter(addressuser=self, postaladdress_id__in=postal_address_ids)
+                .values_list("postaladdress_id", flat=True)
+            )
+            added_ids = [pk for pk in postal_address_ids if pk not in existing_ids]
+            if not added_ids:
+                return
+
+            AddressUserPostalAddress.objects.using(db).bulk_create(
+                [
+                    AddressUserPostalAddress(
+                        addressuser=self, postaladdress_id=postal_address_id
+                    )
+                    for postal_address_id in added_ids
+                ],
+                ignore_conflicts=True,
+            )
+            PostalAddress.objects.using(db).filter(pk__in=added_ids).update(
+                owner_count=F("owner_count") + 1
+            )
+            AddressUser.objects.using(db).filter(pk=self.pk).touch()
+
+    def remove_postal_addresses(self, postal_address_ids):
+        """Disassociate many addresses from this user with a single through table DELETE
+
+        Returns the number of addresses that were actually removed. Like
+        postal_addresses.remove() the addresses themselves are left in place,
+        with their owner_count decremented
+        """
+        db = self._state.db
+        links = AddressUserPostalAddress.objects.using(db).filter(
+            addressuser=self, postaladdress_id__in=postal_address_ids
+        )
+
+        with transaction.atomic(using=db, savepoint=False):
+            self._lock_address_book(db)
+            PostalAddress.objects.using(db).filter(
+                pk__in=links.values("postaladdress_id")
+            ).update(owner_count=F("owner_count") - 1)
+            removed, _ = links.delete()
+            if removed:
+                AddressUser.objects.using(db).filter(pk=self.pk).touch()
+
+        return removed
+
+    def update_postal_addresses(self, changes):
+        """Copy on write update of this user's addresses
+
+        changes maps ids of the user's addresses to dicts of the fields to change.
+        Addresses only this user has are updated in place with a single bulk_update.
+        Shared addresses are left as they are for their other owners, this user is
+        moved onto copies with the changes instead (a single INSERT for every copy and
+        a single through table UPDATE). If a changed address already exists the user
+        is moved onto that, like upsert. Returns a dict of each id to the PostalAddress
+        it is now for this user, raises PostalAddress.DoesNotExist if any of the ids
+        aren't this user's
+        """
+        db = self._state.db
+        with transaction.atomic(using=db):
+            addresses = (
+                PostalAddress.objects.using(db)
+                .filter(pk__in=changes, address_user_links__addressuser=self)
+                .select_for_update()
+                .in_bulk()
+            )
+            if len(addresses) != len(changes):
+                raise PostalAddress.DoesNotExist()
+
+            for pk, address in addresses.items():
+                for field, value in changes[pk].items():
+                    setattr(address, field, value)
+                address.refresh_fingerprint()
+
+            existing = dict(
+                PostalAddress.objects.using(db)
+                .filter(
+                    fingerprint__in=[
+                        address.fingerprint for address in addresses.values()
+                    ]
+                )
+                .values_list("fingerprint", "pk")
+            )
+            changed = [
+                address
+                for address in addresses.values()
+                if existing.get(address.fingerprint) != address.pk
+            ]
+            # Only one address can be updated in place to each new fingerprint, any
+            # others with the same changes end up on that address, like a fork
+            in_place, forked, claimed = [], [], set()
+            for address in changed:
+                if (
+                    address.owner_count <= 1
+                    and address.fingerprint not in existing
+                    and address.fingerprint not in claimed
+                ):
+                    in_place.append(address)
+                    claimed.add(address.fingerprint)
+                else:
+                    forked.append(address)
+
+            if in_place:
+                PostalAddress.objects.using(db).bulk_update(
+                    in_place,
+                    {field for address in in_place for field in changes[address.pk]},
+                )
+
+            updated = dict(addresses)
+            if forked:
+                copies = PostalAddress.objects.db_manager(db).bulk_get_or_create(
+                    [
+                        {field: getattr(address, field) for field in ADDRESS_FIELDS}
+                        for address in forked
+                    ]
+                )
+                self._move_postal_addresses(forked, copies)
+                updated.update(
+                    (address.pk, copy) for address, copy in zip(forked, copies)
+                )
+
+        return updated
+
+    def _move_postal_addresses(self, postal_addresses, targets):
+        """Move this user's links from each of postal_addresses to the target at the
+        same position, dropping the link instead if the user already has the target,
+        then delete whichever of postal_addresses are left without owners
+
+        A target can be one of postal_addresses itself (e.g. two addresses swapped
+        for each other), the user keeps their link to it, so a target is only linked
+        (by moving the source's link or, if that's kept, adding one) if the user
+        doesn't already have it
+        """
+        db = self._state.db
+        links = AddressUserPostalAddress.objects.using(db).filter(addressuser=self)
+        kept = set(
+            links.filter(postaladdress__in=targets).values_list(
+                "postaladdress_id", flat=True
+            )
+        )
+        linked, moves, added = set(kept), {}, []
+        for postal_address, target in zip(postal_addresses, targets):
+            if target.pk in linked:
+                continue
+            linked.add(target.pk)
+            if postal_address.pk in kept:
+                added.append(target.pk)
+            else:
+                moves[postal_address.pk] = target.pk
+        # Left without the user
+        removed = [
+            postal_address.pk
+            for postal_address in postal_addresses
+            if postal_address.pk not in kept
+        ]
+
+        PostalAddress.objects.using(db).filter(pk__in=removed).update(
+            owner_count=F("owner_count") - 1
+        )
+        if moves:
+            # The targets aren't linked to the user, so this can't clash with the
+            # through table's unique index
+            links.filter(postaladdress_id__in=moves).update(
+                postaladdress_id=Case(
+                    *[
+                        When(postaladdress_id=source, then=Value(target))
+                        for source, target in moves.items()
+                    ],
+                    output_field=models.BigIntegerField(),
+                )
+            )
+        if added:
+            AddressUserPostalAddress.objects.using(db).bulk_create(
+                [
+                    AddressUserPostalAddress(addressuser=self, postaladdress_id=pk)
+                    for pk in added
+                ]
+            )
+        PostalAddress.objects.using(db).filter(pk__in=[*moves.values(), *added]).update(
+            owner_count=F("owner_count") + 1
+        )
+        links.filter(
+            postaladdress_id__in=[pk for pk in removed if pk not in moves]
+        ).delete()
+
+        PostalAddress.objects.using(db).filter(pk__in=removed).orphaned().delete()
+        AddressUser.objects.using(db).filter(pk=self.pk).touch()
+
     def __str__(self):
         postal_addresses = ", ".join(str(seg) for seg in self.postal_addresses.all())
         return str(self.user) + ": " + str(postal_addresses)
 
     objects = AddressUserManager()
+
+
+class AddressUserPostalAddress(models.Model):
+    """Through table for AddressUser.postal_addresses
+
+    This was originally the auto-created ManyToMany table, it's declared explicitly
+    (on the same db table) so that queries from the PostalAddress side can key on the
+    through row id, e.g. for cursor pagination of a user's address book
+
+    Rows saved or deleted one at a time (e.g. by the admin inline) keep owner_count
+    and the address book versions in step in save() and delete(). The ManyToMany
+    managers and AddressUser's bulk methods never call them, they do it themselves
+    (see signals.py). This isn't done with post_save / post_delete handlers, as a
+    delete handler would be sent for every row those delete (and every cascade),
+    rather than the single DELETE they make now
+    """
+
+    addressuser = models.ForeignKey(AddressUser, on_delete=models.CASCADE)
+    postaladdress = models.ForeignKey(
+        PostalAddress, on_delete=models.CASCADE, related_name="address_user_links"
+    )
+
+    class Meta:
+        db_table = "address_book_api_addressuser_postal_addresses"
+        unique_together = [["addressuser", "postaladdress"]]
+
+    @staticmethod
+    def _count_link(using, link, delta):
+        """Add delta to the owner_count of the address of link, an (addressuser_id,
+        postaladdress_id) pair, and touch the user's address book
+        """
+        addressuser_id, postaladdress_id = link
+        PostalAddress.objects.using(using).filter(pk=postaladdress_id).update(
+            owner_count=F("owner_count") + delta
+        )
+        AddressUser.objects.using(using).filter(pk=addressuser_id).touch()
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get("using") or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            previous = None
+            if not self._state.adding:
+                # The row may be pointed at another address (or user)
+                previous = (
+                    type(self)
+                    .objects.using(using)
+                    .filter(pk=self.pk)
+                    .values_list("addressuser_id", "postaladdress_id")
+                    .first()
+                )
+            super().save(*args, **kwargs)
+
+            current = (self.addressuser_id, self.postaladdress_id)
+            if previous != current:
+                if previous is not None:
+                    self._count_link(using, previous, -1)
+                self._count_link(using, current, 1)
+
+    def delete(self, using=None, keep_parents=False):
+        using = using or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            deleted, rows = super().delete(using=using, keep_parents=keep_parents)
+            if deleted:
+                self._count_link(
+                    using, (self.addressuser_id, self.postaladdress_id), -1
+                )
+        return deleted, rows
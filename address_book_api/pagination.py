@@ -0,0 +1,18 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class PostalAddressCursorPagination(CursorPagination):
+    """Keyset pagination for a user's postal addresses
+
+    Pages are keyed on the id of the AddressUser <-> PostalAddress through row
+    (annotated onto the queryset as `book_position`), so every page is a
+    `WHERE book_position > <cursor> ORDER BY book_position LIMIT n` range read off
+    the through table's addressuser_id index, and page N costs the same as page 1.
+    Cursors are opaque base64 tokens handed back in the next/previous links.
+    """
+
+    ordering = "book_position"
+    page_size = settings.ADDRESS_BOOK_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = settings.ADDRESS_BOOK_MAX_PAGE_SIZE
@@ -0,0 +1,81 @@
+from rest_framework.renderers import JSONRenderer
+
+
+class NDJSONRenderer(JSONRenderer):
+    """Newline delimited JSON, one object per line
+
+    Lists are rendered one item per line, anything else as a single line.
+    Used by the streaming address list, but also lets clients that ask for
+    application/x-ndjson get a sensible response from the other endpoints
+    """
+
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+
+        if not isinstance(data, list):
+            data = [data]
+
+        return b"".join(self.render_line(item) for item in data)
+
+    def render_line(self, item):
+        return super().render(item) + b"\n"
+
+
+def stream_json(items, ndjson=False, chunk_size=1000):
+    """Yield a JSON array (or NDJSON lines) for items without building the whole document
+
+    Rendered items are buffered up to chunk_size at a time, so memory stays bounded
+    by the chunk rather than the number of items
+    """
+    if ndjson:
+        render_item = NDJSONRenderer().render_line
+    else:
+        render_item = JSONRenderer().render
+        yield b"["
+
+    buffer = []
+    for index, item in enumerate(items):
+        if index and not ndjson:
+            buffer.append(b",")
+        buffer.append(render_item(item))
+
+        if index % chunk_size == chunk_size - 1:
+            yield b"".join(buffer)
+            buffer = []
+
+    if buffer:
+        yield b"".join(buffer)
+
+    if not ndjson:
+        yield b"]"
+
+
+async def astream_json(items, ndjson=False, chunk_size=1000):
+    """stream_json() for an async iterable of items, e.g. QuerySet.aiterator()"""
+    if ndjson:
+        render_item = NDJSONRenderer().render_line
+    else:
+        render_item = JSONRenderer().render
+        yield b"["
+
+    buffer = []
+    index = 0
+    async for item in items:
+        if index and not ndjson:
+            buffer.append(b",")
+        buffer.append(render_item(item))
+
+        if index % chunk_size == chunk_size - 1:
+            yield b"".join(buffer)
+            buffer = []
+        index += 1
+
+    if buffer:
+        yield b"".join(buffer)
+
+    if not ndjson:
+        yield b"]"
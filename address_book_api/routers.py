@@ -0,0 +1,118 @@
+"""Routing between the primary database ("default"), its read replicas
+(settings.DATABASE_REPLICAS) and the address book shards (settings.DATABASE_SHARDS)
+
+Every write goes to the primary, and so do reads unless a request opts into replica
+reads with read_from() (PostalAddressViewSet does so for list and retrieve). Each user
+sticks to the primary for DATABASE_PRIMARY_STICKY_SECONDS after any write, so they
+read their own writes however far the replicas lag behind. The stickiness is kept in
+the default cache, which has to be shared between processes (e.g. Redis) for it to
+hold across them.
+
+With shards configured, the address book (this app's models) is partitioned by user
+instead: each AddressUser, their through table rows and their addresses live on the
+shard get_shard() picks for their user id, while users, tokens, sessions etc. stay on
+the primary. Queries of the address book go to the shard of the instance they're made
+through (e.g. address_user.postal_addresses), otherwise to the shard set for the
+current context with use_shard() (the views set the requesting user's), or the
+primary if there's none. Addresses are only deduplicated within a shard, an address
+shared by users on different shards is a row on each of them.
+"""
+
+import hashlib
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+_read_database = ContextVar("read_database", default=DEFAULT_DB_ALIAS)
+_shard = ContextVar("shard", default=None)
+
+
+def is_sharded(model):
+    return (
+        bool(settings.DATABASE_SHARDS) and model._meta.app_label == "address_book_api"
+    )
+
+
+class AddressBookRouter:
+    def db_for_read(self, model, **hints):
+        if is_sharded(model):
+            return self.db_for_shard(hints)
+        return _read_database.get()
+
+    def db_for_write(self, model, **hints):
+        if is_sharded(model):
+            return self.db_for_shard(hints)
+        # Including instances read from a replica
+        return DEFAULT_DB_ALIAS
+
+    def db_for_shard(self, hints):
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db is not None:
+            return instance._state.db
+        return _shard.get()
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same data as the primary, and AddressUsers on shards
+        # refer to their users on the primary
+        return True
+
+
+def sticky_cache_key(user_id):
+    return f"primary-sticky:{user_id}"
+
+
+def stick_to_primary(user_id):
+    """Route the user's reads to the primary for DATABASE_PRIMARY_STICKY_SECONDS,
+    called after they write
+    """
+    if settings.DATABASE_REPLICAS:
+        cache.set(
+            sticky_cache_key(user_id), True, settings.DATABASE_PRIMARY_STICKY_SECONDS
+        )
+
+
+def get_read_database(user_id):
+    """A random replica, or the primary if there are none or the user wrote recently"""
+    if not settings.DATABASE_REPLICAS or cache.get(sticky_cache_key(user_id)):
+        return DEFAULT_DB_ALIAS
+
+    return random.choice(settings.DATABASE_REPLICAS)
+
+
+def get_shard(user_id):
+    """The shard of the user's address book, the primary if there are no shards
+
+    Picked by rendezvous hashing, the shard whose hash with the user id is highest,
+    so adding a shard only moves the users that now hash highest to it (see the
+    rebalance_shards command)
+    """
+    if not settings.DATABASE_SHARDS:
+        return DEFAULT_DB_ALIAS
+
+    return max(
+        settings.DATABASE_SHARDS,
+        key=lambda alias: hashlib.sha256(f"{alias}:{user_id}".encode()).digest(),
+    )
+
+
+def read_from(alias):
+    """Route reads in the current context (thread or task) to alias, returns a token
+    for reset()
+    """
+    return _read_database.set(alias)
+
+
+def use_shard(alias):
+    """Route address book queries in the current context to the shard alias, returns
+    a token for reset()
+    """
+    return _shard.set(alias)
+
+
+def reset(*tokens):
+    """Undo read_from() / use_shard()"""
+    for token in reversed(tokens):
+        token.var.reset(token)
@@ -0,0 +1,227 @@
+"""Full-text search of postal addresses, backed by an SQLite FTS5 table
+
+The FTS table holds a copy of each address's fields plus an "owners" column of
+"u<AddressUser id>" tokens, so a search can be scoped to a user's address book inside
+the FTS query itself (an intersection of doclists) rather than by joining every
+match against the through table.
+
+It's kept in sync by triggers on the PostalAddress and through tables rather than
+Django signals, as bulk_create, bulk_update, QuerySet.update() and the bulk
+AddressUser methods don't send any.
+"""
+
+import re
+import unicodedata
+
+from django.db import connection, connections
+
+from address_book_api.models import (
+    ADDRESS_FIELDS,
+    AddressUserPostalAddress,
+    PostalAddress,
+)
+
+SEARCH_TABLE = "address_book_api_postaladdress_search"
+
+_ADDRESS_TABLE = PostalAddress._meta.db_table
+_LINK_TABLE = AddressUserPostalAddress._meta.db_table
+_COLUMNS = ADDRESS_FIELDS
+
+# How much a word matching in each column counts towards an address's bm25 rank
+_WEIGHTS = {
+    "address1": 10.0,
+    "address2": 5.0,
+    "zip_code": 5.0,
+    "city": 5.0,
+    "country": 1.0,
+}
+# bm25() takes a weight for every column, the owners column doesn't count
+_BM25 = f"bm25({SEARCH_TABLE}, {', '.join(str(_WEIGHTS[column]) for column in _COLUMNS)}, 0.0)"
+
+_WORD = re.compile(r"\w+")
+
+# Words left out of searches, they'd only match by prefix (e.g. "the" -> "theatre")
+_STOPWORDS = {"a", "an", "and", "at", "by", "in", "of", "on", "or", "the", "to"}
+
+_TRIGGERS = {
+    f"{SEARCH_TABLE}_address_insert": f"""
+        AFTER INSERT ON {_ADDRESS_TABLE} BEGIN
+            INSERT INTO {SEARCH_TABLE} (rowid, {", ".join(_COLUMNS)}, owners)
+            VALUES (new.id, {", ".join(f"new.{column}" for column in _COLUMNS)}, '');
+        END
+    """,
+    f"{SEARCH_TABLE}_address_update": f"""
+        AFTER UPDATE OF {", ".join(_COLUMNS)} ON {_ADDRESS_TABLE} BEGIN
+            UPDATE {SEARCH_TABLE}
+            SET {", ".join(f"{column} = new.{column}" for column in _COLUMNS)}
+            WHERE rowid = new.id;
+        END
+    """,
+    f"{SEARCH_TABLE}_address_delete": f"""
+        AFTER DELETE ON {_ADDRESS_TABLE} BEGIN
+            DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id;
+        END
+    """,
+    f"{SEARCH_TABLE}_link_insert": f"""
+        AFTER INSERT ON {_LINK_TABLE} BEGIN
+            UPDATE {SEARCH_TABLE}
+            SET owners = owners || ' u' || new.addressuser_id
+            WHERE rowid = new.postaladdress_id;
+        END
+    """,
+    f"{SEARCH_TABLE}_link_delete": f"""
+        AFTER DELETE ON {_LINK_TABLE} BEGIN
+            UPDATE {SEARCH_TABLE}
+            SET owners = trim(
+                replace(' ' || owners || ' ', ' u' || old.addressuser_id || ' ', ' ')
+            )
+            WHERE rowid = old.postaladdress_id;
+        END
+    """,
+    f"{SEARCH_TABLE}_link_update": f"""
+        AFTER UPDATE OF addressuser_id, postaladdress_id ON {_LINK_TABLE} BEGIN
+            UPDATE {SEARCH_TABLE}
+            SET owners = trim(
+                replace(' ' || owners || ' ', ' u' || old.addressuser_id || ' ', ' ')
+            )
+            WHERE rowid = old.postaladdress_id;
+            UPDATE {SEARCH_TABLE}
+            SET owners = owners || ' u' || new.addressuser_id
+            WHERE rowid = new.postaladdress_id;
+        END
+    """,
+}
+
+
+def is_available(using=connection):
+    return using.vendor == "sqlite"
+
+
+def create_search_index(using=connection):
+    """Create the FTS table and its triggers, and index the existing addresses"""
+    with using.cursor() as cursor:
+        cursor.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+                {", ".join(_COLUMNS)}, owners,
+                tokenize = 'unicode61 remove_diacritics 2',
+                prefix = '2 3'
+            )
+            """)
+    create_search_triggers(using)
+    rebuild_search_index(using)
+
+
+def drop_search_index(using=connection):
+    drop_search_triggers(using)
+    with using.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+def create_search_triggers(using=connection):
+    with using.cursor() as cursor:
+        for name, trigger in _TRIGGERS.items():
+            cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {trigger}")
+
+
+def drop_search_triggers(using=connection):
+    """Stop maintaining the search index, e.g. to speed up a large import. The index
+    is stale until the triggers are recreated and it's rebuilt
+    """
+    with using.cursor() as cursor:
+        for name in _TRIGGERS:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def rebuild_search_index(using=connection):
+    """Repopulate the FTS table from scratch, returns the number of addresses indexed"""
+    with using.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+        cursor.execute(f"""
+            INSERT INTO {SEARCH_TABLE} (rowid, {", ".join(_COLUMNS)}, owners)
+            SELECT
+                address.id,
+                {", ".join(f"address.{column}" for column in _COLUMNS)},
+                coalesce(
+                    (
+                        SELECT group_concat('u' || link.addressuser_id, ' ')
+                        FROM {_LINK_TABLE} link
+                        WHERE link.postaladdress_id = address.id
+                    ),
+                    ''
+                )
+            FROM {_ADDRESS_TABLE} address
+            """)
+        indexed = cursor.rowcount
+        cursor.execute(
+            f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')"
+        )
+
+    return indexed
+
+
+def normalise(text):
+    """Case fold and strip diacritics, as the FTS table's unicode61 tokenizer does"""
+    text = text.casefold()
+    if text.isascii():
+        return text
+
+    return "".join(
+        character
+        for character in unicodedata.normalize("NFKD", text)
+        if not unicodedata.combining(character)
+    )
+
+
+def search_terms(text):
+    """The words of a search, ignoring common words like "the" """
+    return [
+        term
+        for term in (normalise(word) for word in _WORD.findall(text))
+        if term not in _STOPWORDS
+    ]
+
+
+def match_expressions(address_user, terms):
+    """FTS5 queries for the terms, scoped to the user's addresses
+
+    The last term is matched as a prefix (as it may be partly typed), the others as
+    whole words. The first query requires every term to match, the second (to fall
+    back on if nothing does) any of them, so e.g. "the Cambridge coworking space"
+    still finds "Our Coworking space, Cambridge". The terms only match the address
+    columns, not the owners column's "u<AddressUser id>" tokens
+    """
+    phrases = [f'"{term}"' for term in terms[:-1]] + [f'"{terms[-1]}"*']
+    owner = f"owners : u{address_user.pk}"
+    columns = f"{{{' '.join(_COLUMNS)}}}"
+
+    expressions = [f"{owner} AND {columns} : ({' AND '.join(phrases)})"]
+    if len(phrases) > 1:
+        expressions.append(f"{owner} AND {columns} : ({' OR '.join(phrases)})")
+    return expressions
+
+
+def search_postal_addresses(address_user, text, limit):
+    """Ids of the user's addresses best matching text, best match first
+
+    Every match is ranked by FTS5's bm25, with the columns weighted by _WEIGHTS (so
+    a rarer word, in a more important column, ranks higher), ties go to the newest
+    """
+    terms = search_terms(text)
+    if not terms:
+        return []
+
+    # The user's shard, if the address book is sharded
+    with connections[address_user._state.db].cursor() as cursor:
+        for expression in match_expressions(address_user, terms):
+            cursor.execute(
+                f"""
+                SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s
+                ORDER BY {_BM25}, rowid DESC LIMIT %s
+                """,
+                [expression, limit],
+            )
+            ids = [rowid for rowid, in cursor.fetchall()]
+            if ids:
+                return ids
+
+    return []
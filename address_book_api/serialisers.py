@@ -1,10 +1,72 @@
+from django.core.exceptions import ImproperlyConfigured
 from rest_framework import serializers
-from rest_framework.validators import UniqueTogetherValidator
 
-from address_book_api.models import AddressUser, PostalAddress
+from address_book_api.models import (
+    ADDRESS_FIELDS,
+    AddressUser,
+    PostalAddress,
+    address_fingerprint,
+)
+from address_book_api.timing import TimedListSerializer, TimedSerializerMixin
 
 
-class PostalAddressSerializer(serializers.ModelSerializer):
+class UniqueAddressValidator:
+    """Equivalent of UniqueTogetherValidator over the address fields, done as
+    a single lookup on the PostalAddress fingerprint index
+    """
+
+    message = "The fields {field_names} must make a unique set."
+    requires_context = True
+
+    def __call__(self, attrs, serializer):
+        instance = serializer.instance
+        fingerprint = address_fingerprint(
+            attrs[field] if field in attrs else getattr(instance, field, None)
+            for field in ADDRESS_FIELDS
+        )
+
+        queryset = PostalAddress.objects.filter(fingerprint=fingerprint)
+        if instance is not None:
+            queryset = queryset.exclude(pk=instance.pk)
+
+        if queryset.exists():
+            raise serializers.ValidationError(
+                self.message.format(field_names=", ".join(ADDRESS_FIELDS)),
+                code="unique",
+            )
+
+
+class SparseFieldsMixin:
+    """Serializer that takes fields / exclude keyword arguments, lists of field names
+    to keep / drop from its representation, e.g. from ?fields=id,city
+    """
+
+    def __init__(self, *args, fields=None, exclude=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is None and exclude is None:
+            return
+
+        for argument, names in (("fields", fields), ("exclude", exclude)):
+            unknown = set(names or ()).difference(self.fields)
+            if unknown:
+                raise serializers.ValidationError(
+                    {argument: f"Unknown fields: {', '.join(sorted(unknown))}"}
+                )
+
+        dropped = set(self.fields).difference(self.fields if fields is None else fields)
+        dropped.update(exclude or ())
+        if dropped == set(self.fields):
+            raise serializers.ValidationError(
+                {"fields": "At least one field has to be returned"}
+            )
+
+        for name in dropped:
+            self.fields.pop(name)
+
+
+class PostalAddressSerializer(
+    TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer
+):
     """Serializer for PostalAddress
     Note: the default Serializer.save() will not update the association
     AddressUser -> PostalAddressSerializer
@@ -13,30 +75,100 @@ class PostalAddressSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = PostalAddress
-        fields = "__all__"
+        exclude = ("fingerprint", "owner_count", "updated_at")
         read_only = ("id",)
+        list_serializer_class = TimedListSerializer
 
     # We've added the constraint to the model
     # but for good measure we'll also add it to the serializer validator
     # This automatically returns the correct 400 error
-    validators = [
-        UniqueTogetherValidator(
-            queryset=PostalAddress.objects.all(),
-            fields=["address1", "address2", "zip_code", "city", "country"],
-        )
-    ]
+    validators = [UniqueAddressValidator()]
+
+
+class PostalAddressUpsertSerializer(PostalAddressSerializer):
+    """Validates a PostalAddress without querying the database, used when creating
+    addresses. Existing addresses are resolved (rather than rejected) by
+    PostalAddress.objects.upsert or bulk_get_or_create, so a single or bulk payload
+    can be validated in memory
+    """
 
+    validators = []
 
-class AddressUserSerializer(serializers.HyperlinkedModelSerializer):
-    postal_addresses = PostalAddressSerializer(many=True)
 
-    postal_addresses_ids = serializers.PrimaryKeyRelatedField(
-        many=True,
-        # write_only=True,
-        source="postal_addresses",  # just to make it looks a little bit better
-        queryset=PostalAddress.objects.all(),
+class PostalAddressPatchSerializer(PostalAddressUpsertSerializer):
+    """An item of a bulk PATCH, the id of one of the user's addresses and the fields
+    to change. Validated in memory like PostalAddressUpsertSerializer, clashes with
+    existing addresses are resolved by AddressUser.update_postal_addresses
+    """
+
+    # Bounded by the (64 bit) primary key, larger ids would overflow in the query
+    id = serializers.IntegerField(min_value=1, max_value=2**63 - 1)
+
+    def validate(self, attrs):
+        # A partial update doesn't enforce required fields
+        if "id" not in attrs:
+            raise serializers.ValidationError({"id": "This field is required."})
+        return attrs
+
+
+# Fields whose to_representation() hands the column value to the JSON renderer as is
+PLAIN_FIELDS = (
+    serializers.CharField,
+    serializers.ChoiceField,
+    serializers.IntegerField,
+)
+
+
+def representation_values(serializer, queryset, *extra):
+    """Read only fast path for serializer(queryset, many=True).data
+
+    Returns queryset.values() of the serializer's fields, in the serializer's field
+    order, so each row is a plain dict that renders to exactly the same JSON as the
+    serializer's representation, without instantiating a model or running the
+    serializer fields for every row. That only holds for fields that are model
+    columns represented as they are, anything else raises ImproperlyConfigured.
+    extra names annotations to read as well (e.g. for pagination), which come after
+    the fields
+    """
+    fields = []
+    for name, field in serializer.fields.items():
+        if field.source != name or not isinstance(field, PLAIN_FIELDS):
+            raise ImproperlyConfigured(
+                f"{type(serializer).__name__}.{name} can't be read with values()"
+            )
+        fields.append(name)
+
+    return queryset.values(*fields, *extra)
+
+
+class AddressUserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """Read only profile of an AddressUser, with their most recently added addresses
+    (up to ADDRESS_BOOK_PROFILE_ADDRESSES of them) and the ids of all their addresses
+
+    Expects the recent_postal_addresses and postal_addresses_ids attributes set by
+    AddressUserViewSet, which reads them with a fixed number of queries
+    """
+
+    username = serializers.CharField(source="user.username", read_only=True)
+    address_count = serializers.SerializerMethodField()
+    postal_addresses = PostalAddressSerializer(
+        many=True, read_only=True, source="recent_postal_addresses"
+    )
+    postal_addresses_ids = serializers.ListField(
+        child=serializers.IntegerField(), read_only=True
     )
 
     class Meta:
         model = AddressUser
-        fields = "__all__"
+        fields = (
+            "id",
+            "username",
+            "version",
+            "modified_at",
+            "address_count",
+            "postal_addresses",
+            "postal_addresses_ids",
+        )
+
+    def get_address_count(self, address_user):
+        return len(address_user.postal_addresses_ids)
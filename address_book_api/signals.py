@@ -0,0 +1,129 @@
+"""Keeps PostalAddress.owner_count and the AddressUser address book versions in step
+with the AddressUser <-> PostalAddress association, for changes made through the
+ManyToMany managers (admin, serializers, postal_addresses.add() etc.), AddressUser
+deletes and PostalAddress saves.
+
+AddressUser.add_postal_addresses / remove_postal_addresses write to the through table
+directly and update both themselves, as do the PostalAddress bulk_update and delete
+methods, and AddressUserPostalAddress save() and delete() for through rows changed one
+at a time.
+
+Each handler works on the database of the change (the user's shard, if the address
+book is sharded), and deleting a user deletes their AddressUser from its shard.
+
+Also drops the CachedTokenAuthentication entries of tokens that are deleted, and of
+users that are saved or log out, tunes new SQLite connections and instruments every
+new connection's queries (see timing.py).
+"""
+
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_out
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from address_book_api import routers, sqlite, timing
+from address_book_api.authentication import forget_tokens
+from address_book_api.models import AddressUser, PostalAddress
+
+
+def decrement_owner_counts(links):
+    """Decrement the owner_count of the addresses of the given through table rows,
+    this has to run before the rows are deleted
+    """
+    PostalAddress.objects.using(links.db).filter(
+        pk__in=links.values("postaladdress_id")
+    ).update(owner_count=F("owner_count") - 1)
+
+
+@receiver(m2m_changed, sender=AddressUser.postal_addresses.through)
+def update_owner_count(sender, instance, action, reverse, pk_set, using, **kwargs):
+    # For add, pk_set only contains the ids that weren't already associated, but for
+    # remove it's every id passed in, so the links that actually exist are used
+    links = sender.objects.using(using)
+    if reverse:
+        postal_address = PostalAddress.objects.using(using).filter(pk=instance.pk)
+        if action == "post_add":
+            postal_address.update(owner_count=F("owner_count") + len(pk_set))
+        elif action == "pre_remove":
+            removed = links.filter(
+                postaladdress=instance, addressuser_id__in=pk_set
+            ).count()
+            postal_address.update(owner_count=F("owner_count") - removed)
+        elif action == "pre_clear":
+            postal_address.update(owner_count=0)
+    else:
+        if action == "post_add":
+            PostalAddress.objects.using(using).filter(pk__in=pk_set).update(
+                owner_count=F("owner_count") + 1
+            )
+        elif action == "pre_remove":
+            decrement_owner_counts(
+                links.filter(addressuser=instance, postaladdress_id__in=pk_set)
+            )
+        elif action == "pre_clear":
+            decrement_owner_counts(links.filter(addressuser=instance))
+
+
+@receiver(pre_delete, sender=AddressUser)
+def release_postal_addresses(sender, instance, using, **kwargs):
+    # The through table rows are removed by cascade, which doesn't send m2m_changed
+    decrement_owner_counts(
+        AddressUser.postal_addresses.through.objects.using(using).filter(
+            addressuser=instance
+        )
+    )
+
+
+@receiver(m2m_changed, sender=AddressUser.postal_addresses.through)
+def touch_address_books(sender, instance, action, reverse, pk_set, using, **kwargs):
+    address_users = AddressUser.objects.using(using)
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            address_users.filter(pk=instance.pk).touch()
+    elif action in ("post_add", "post_remove"):
+        address_users.filter(pk__in=pk_set).touch()
+    elif action == "pre_clear":
+        address_users.filter(postal_addresses=instance).touch()
+
+
+@receiver(post_save, sender=PostalAddress)
+def touch_owners(sender, instance, created, using, **kwargs):
+    # Every user sharing the address sees the change, a new address has no users yet
+    if not created:
+        AddressUser.objects.using(using).filter(postal_addresses=instance).touch()
+
+
+@receiver(post_delete, sender=User)
+def delete_sharded_address_user(sender, instance, using, **kwargs):
+    # The cascade only reaches the AddressUser on the user's own database
+    shard = routers.get_shard(instance.pk)
+    if shard != using:
+        AddressUser.objects.using(shard).filter(user_id=instance.pk).delete()
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    forget_tokens([instance.key])
+
+
+@receiver(post_save, sender=User)
+@receiver(user_logged_out)
+def forget_user_tokens(sender, user=None, instance=None, **kwargs):
+    # post_save sends the user as instance, user_logged_out as user
+    user = user or instance
+    if user is not None:
+        forget_tokens(Token.objects.filter(user=user).values_list("key", flat=True))
+
+
+@receiver(connection_created)
+def configure_sqlite_connection(sender, connection, **kwargs):
+    if connection.vendor == "sqlite":
+        sqlite.configure_connection(connection)
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    timing.install(connection)
@@ -0,0 +1,49 @@
+"""SQLite specific schema that Django's migrations don't manage
+
+Migrations altering a table on SQLite often rebuild it (create a copy, move the rows
+over and drop the original), which silently drops any triggers and hand written
+indexes on it. Such migrations should end with restore_sqlite_schema
+
+Also the per connection tuning of settings.SQLITE_PRAGMAS
+"""
+
+from django.conf import settings
+
+from address_book_api import search
+
+# Django's LIKE based lookups on SQLite (startswith, iexact, istartswith) are case
+# insensitive, so they can only use an index with the NOCASE collation
+NOCASE_INDEXES = {
+    "address_city_nocase": "city",
+    "address_zip_nocase": "zip_code",
+}
+
+
+def create_nocase_indexes(connection):
+    with connection.cursor() as cursor:
+        for name, column in NOCASE_INDEXES.items():
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {name} ON address_book_api_postaladdress "
+                f"({column} COLLATE NOCASE)"
+            )
+
+
+def drop_nocase_indexes(connection):
+    with connection.cursor() as cursor:
+        for name in NOCASE_INDEXES:
+            cursor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+def restore_sqlite_schema(apps, schema_editor):
+    """RunPython operation recreating the indexes and search triggers"""
+    if schema_editor.connection.vendor != "sqlite":
+        return
+
+    create_nocase_indexes(schema_editor.connection)
+    search.create_search_triggers(schema_editor.connection)
+
+
+def configure_connection(connection):
+    """Apply settings.SQLITE_PRAGMAS to a new connection"""
+    for name, value in settings.SQLITE_PRAGMAS.items():
+        connection.connection.execute(f"PRAGMA {name} = {value}")
@@ -1,11 +1,25 @@
+import json
+import pickle
 from collections import OrderedDict
 
-from django.test import TestCase
-from rest_framework.exceptions import ErrorDetail
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
 from rest_framework.reverse import reverse
 from rest_framework.test import APIClient
 
-from address_book_api.models import AddressUser, PostalAddress
+from address_book_api.apis import PostalAddressFilter
+from address_book_api.authentication import token_cache_key
+from address_book_api.models import (
+    AddressUser,
+    AddressUserPostalAddress,
+    PostalAddress,
+)
+from address_book_api.serialisers import PostalAddressSerializer
 
 
 class AddressAPITestCase(TestCase):
@@ -74,7 +88,7 @@ class AddressAPITestCase(TestCase):
         """View user's associated addresses"""
         response = self.client.get(reverse("postaladdress-list"))
         self.assertCountEqual(
-            response.data,
+            response.data["results"],
             [
                 OrderedDict(
                     [
@@ -115,110 +129,612 @@ class AddressAPITestCase(TestCase):
         we should test filtering with other params works
         """
         response = self.client.get(f"{reverse('postaladdress-list')}?zip_code=728wye")
+        self.assertIsNone(response.data["next"])
+        self.assertIsNone(response.data["previous"])
         self.assertCountEqual(
-            response.data,
-            OrderedDict(
-                [
-                    ("count", 2),
-                    ("next", None),
-                    ("previous", None),
-                    (
-                        "results",
-                        [
-                            OrderedDict(
-                                [
-                                    ("id", self.address1.id),
-                                    ("address1", "25 SomeDay Road"),
-                                    ("address2", "testuser1only"),
-                                    ("zip_code", "728wye"),
-                                    ("city", "London"),
-                                    ("country", "GBR"),
-                                ]
-                            ),
-                            OrderedDict(
-                                [
-                                    ("id", self.address2.id),
-                                    ("address1", "14 SomeDay Road"),
-                                    ("address2", "testuser1only"),
-                                    ("zip_code", "728wye"),
-                                    ("city", "London"),
-                                    ("country", "GBR"),
-                                ]
-                            ),
-                        ],
-                    ),
+            response.data["results"],
+            [
+                OrderedDict(
+                    [
+                        ("id", self.address1.id),
+                        ("address1", "25 SomeDay Road"),
+                        ("address2", "testuser1only"),
+                        ("zip_code", "728wye"),
+                        ("city", "London"),
+                        ("country", "GBR"),
+                    ]
+                ),
+                OrderedDict(
+                    [
+                        ("id", self.address2.id),
+                        ("address1", "14 SomeDay Road"),
+                        ("address2", "testuser1only"),
+                        ("zip_code", "728wye"),
+                        ("city", "London"),
+                        ("country", "GBR"),
+                    ]
+                ),
+            ],
+        )
+
+    def test_view_address_filter_lookups(self):
+        """Lookups beyond exact match, on their own and combined"""
+        cases = [
+            ("city__in=London,York", [self.address1, self.address2]),
+            ("city__iexact=cambridge", [self.shared_postal_address]),
+            ("city__istartswith=lon", [self.address1, self.address2]),
+            ("zip_code__startswith=728", [self.address1, self.address2]),
+            ("zip_code__range=a,z", [self.shared_postal_address]),
+            ("country__in=GBR,FRA&city=Cambridge", [self.shared_postal_address]),
+            ("country=FRA", []),
+        ]
+        for params, expected in cases:
+            with self.subTest(params):
+                response = self.client.get(f"{reverse('postaladdress-list')}?{params}")
+                self.assertCountEqual(
+                    [address["id"] for address in response.data["results"]],
+                    [address.id for address in expected],
+                )
+
+    def test_view_address_filter_country(self):
+        """?country= only takes ISO 3166 alpha-3 codes, and the filter form class
+        is built once rather than per request
+        """
+        url = reverse("postaladdress-list")
+        response = self.client.get(f"{url}?country=XXX")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json(),
+            {
+                "country": [
+                    "Select a valid choice. XXX is not one of the available choices."
                 ]
+            },
+        )
+        self.assertEqual(len(self.client.get(f"{url}?country=").data["results"]), 3)
+
+        form_class = PostalAddressFilter().get_form_class()
+        self.assertIs(PostalAddressFilter().get_form_class(), form_class)
+        # Each filterset still gets its own form, with its own data
+        first, second = (
+            PostalAddressFilter({"country": country}) for country in ("GBR", "FRA")
+        )
+        self.assertIsNot(first.form, second.form)
+        self.assertEqual(first.form.data["country"], "GBR")
+        self.assertEqual(second.form.data["country"], "FRA")
+
+    def test_view_address_filter_query_plan(self):
+        """No filter should make SQLite fall back to scanning a table"""
+        for params in [
+            "city=London",
+            "city__in=London,York",
+            "city__iexact=london",
+            "city__istartswith=lon",
+            "zip_code=728wye",
+            "zip_code__range=7,8",
+            "zip_code__istartswith=728",
+            "country=GBR",
+            "country__in=GBR,FRA",
+            "country=GBR&city=London&zip_code=728wye",
+        ]:
+            with self.subTest(params), CaptureQueriesContext(connection) as queries:
+                self.client.get(f"{reverse('postaladdress-list')}?{params}")
+
+                (sql,) = [
+                    query["sql"]
+                    for query in queries.captured_queries
+                    if 'FROM "address_book_api_postaladdress"' in query["sql"]
+                ]
+                with connection.cursor() as cursor:
+                    cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+                    plan = [row[3] for row in cursor.fetchall()]
+
+                self.assertFalse(
+                    [step for step in plan if step.startswith("SCAN")], plan
+                )
+
+    def test_view_address_representation(self):
+        """The list reads rows with values(), the JSON is still exactly what
+        PostalAddressSerializer renders
+        """
+        self.test_user1.postal_addresses.add(
+            PostalAddress.objects.create(
+                address1='Ünïcödé "Quoted" Straße', country="DEU"
+            )
+        )
+        url = reverse("postaladdress-list")
+        expected = PostalAddressSerializer(
+            self.test_user1.postal_addresses.order_by("address_user_links__id"),
+            many=True,
+        ).data
+
+        response = self.client.get(url)
+        self.assertEqual(
+            response.content,
+            JSONRenderer().render(
+                {"next": None, "previous": None, "results": expected}
             ),
         )
 
+        response = self.client.get(f"{url}?stream=true")
+        self.assertEqual(
+            b"".join(response.streaming_content), JSONRenderer().render(expected)
+        )
+
+    def test_view_address_sparse_fields(self):
+        """?fields= / ?exclude= narrow both the response and the columns read"""
+        url = reverse("postaladdress-list")
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"{url}?fields=id,city,country")
+        self.assertEqual(
+            response.json()["results"][0],
+            {"id": self.address1.id, "city": "London", "country": "GBR"},
+        )
+        sql = [
+            query["sql"]
+            for query in queries.captured_queries
+            if 'FROM "address_book_api_postaladdress"' in query["sql"]
+        ]
+        self.assertEqual(len(sql), 1)
+        self.assertNotIn('"address1"', sql[0])
+
+        response = self.client.get(f"{url}?exclude=address1,address2&q=coworking")
+        self.assertEqual(
+            response.json()["results"],
+            [
+                {
+                    "id": self.shared_postal_address.id,
+                    "zip_code": "reqaw2",
+                    "city": "Cambridge",
+                    "country": "GBR",
+                }
+            ],
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"{url}/{self.address1.id}?fields=city")
+        self.assertEqual(response.json(), {"city": "London"})
+        self.assertFalse(
+            [
+                query
+                for query in queries.captured_queries
+                if '"address_book_api_postaladdress"."address1"' in query["sql"]
+            ]
+        )
+
+        response = self.client.get(f"{url}?fields=id,fingerprint,owner_count")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json(), {"fields": "Unknown fields: fingerprint, owner_count"}
+        )
+        response = self.client.get(f"{url}?fields=id&exclude=id")
+        self.assertEqual(response.status_code, 400)
+
     def test_view_address_pagination(self):
-        """Test pagination for batch get"""
-        response = self.client.get(f"{reverse('postaladdress-list')}?limit=2&offset=2")
-        self.assertCountEqual(
-            response.data,
-            OrderedDict(
-                [
-                    ("count", 3),
-                    ("next", "http://testserver/api/v1/addressbook/?limit=2&offset=2"),
-                    ("previous", None),
-                    (
-                        "results",
-                        [
-                            OrderedDict(
-                                [
-                                    ("id", self.address1.id),
-                                    ("address1", "25 SomeDay Road"),
-                                    ("address2", "testuser1only"),
-                                    ("zip_code", "728wye"),
-                                    ("city", "London"),
-                                    ("country", "GBR"),
-                                ]
-                            ),
-                            OrderedDict(
-                                [
-                                    ("id", self.address2.id),
-                                    ("address1", "14 SomeDay Road"),
-                                    ("address2", "testuser1only"),
-                                    ("zip_code", "728wye"),
-                                    ("city", "London"),
-                                    ("country", "GBR"),
-                                ]
-                            ),
-                        ],
-                    ),
+        """Test cursor pagination for batch get"""
+        response = self.client.get(f"{reverse('postaladdress-list')}?page_size=2")
+        self.assertEqual(
+            [address["id"] for address in response.data["results"]],
+            [self.address1.id, self.address2.id],
+        )
+        self.assertIsNone(response.data["previous"])
+        self.assertIsNotNone(response.data["next"])
+
+        response = self.client.get(response.data["next"])
+        self.assertEqual(
+            response.data["results"],
+            [
+                OrderedDict(
+                    [
+                        ("id", self.shared_postal_address.id),
+                        ("address1", "Our Coworking space"),
+                        ("address2", "testuser1andtestuser2"),
+                        ("zip_code", "reqaw2"),
+                        ("city", "Cambridge"),
+                        ("country", "GBR"),
+                    ]
+                ),
+            ],
+        )
+        self.assertIsNone(response.data["next"])
+
+        response = self.client.get(response.data["previous"])
+        self.assertEqual(
+            [address["id"] for address in response.data["results"]],
+            [self.address1.id, self.address2.id],
+        )
+
+    def test_view_address_pagination_constant_cost(self):
+        """Deep pages should be a keyed range read, costing the same as the first page"""
+        first_page_url = f"{reverse('postaladdress-list')}?page_size=1"
+        with CaptureQueriesContext(connection) as first_page:
+            response = self.client.get(first_page_url)
+        with CaptureQueriesContext(connection) as next_page:
+            self.client.get(response.data["next"])
+
+        self.assertEqual(len(first_page), len(next_page))
+        self.assertNotIn("OFFSET", next_page.captured_queries[-1]["sql"])
+
+    def test_view_address_stream(self):
+        """?stream=1 should return the whole book unpaginated as a streamed JSON array"""
+        response = self.client.get(
+            f"{reverse('postaladdress-list')}?stream=1&page_size=1"
+        )
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(
+            json.loads(b"".join(response.streaming_content)),
+            [
+                {
+                    "id": address.id,
+                    "address1": address.address1,
+                    "address2": address.address2,
+                    "zip_code": address.zip_code,
+                    "city": address.city,
+                    "country": address.country,
+                }
+                for address in [
+                    self.address1,
+                    self.address2,
+                    self.shared_postal_address,
                 ]
-            ),
+            ],
         )
-        response = self.client.get(f"{reverse('postaladdress-list')}?limit=2")
-        self.assertCountEqual(
-            response.data,
-            OrderedDict(
+
+    def test_view_address_stream_ndjson(self):
+        """Asking for application/x-ndjson streams one address per line"""
+        response = self.client.get(
+            reverse("postaladdress-list"), HTTP_ACCEPT="application/x-ndjson"
+        )
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(
+            [json.loads(line)["id"] for line in lines],
+            [self.address1.id, self.address2.id, self.shared_postal_address.id],
+        )
+
+        # Filters apply to streams too
+        response = self.client.get(
+            f"{reverse('postaladdress-list')}?city=London",
+            HTTP_ACCEPT="application/x-ndjson",
+        )
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(
+            [json.loads(line)["id"] for line in lines],
+            [self.address1.id, self.address2.id],
+        )
+
+    def test_view_address_search(self):
+        """Search is ranked and scoped to the user's addresses"""
+        response = self.client.get(
+            reverse("postaladdress-list"), {"q": "the Cambridge coworking space"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [address["id"] for address in response.data["results"]],
+            [self.shared_postal_address.id],
+        )
+
+        # Words match as prefixes, all of them if possible
+        response = self.client.get(reverse("postaladdress-list"), {"q": "25 Some"})
+        self.assertEqual(
+            [address["id"] for address in response.data["results"]],
+            [self.address1.id],
+        )
+
+        # Otherwise any of them, rarer words in more important fields rank higher
+        response = self.client.get(
+            reverse("postaladdress-list"), {"q": "London coworking"}
+        )
+        self.assertEqual(
+            [address["id"] for address in response.data["results"]],
+            [self.shared_postal_address.id, self.address2.id, self.address1.id],
+        )
+
+        # user2's addresses aren't included
+
+        response = self.client.get(reverse("postaladdress-list"), {"q": "York"})
+        self.assertEqual(response.data["results"], [])
+
+        # Nor does the search match the owners of the addresses
+        response = self.client.get(
+            reverse("postaladdress-list"), {"q": f"u{self.test_user1.pk}"}
+        )
+        self.assertEqual(response.data["results"], [])
+
+    def test_view_address_search_ranks_every_match(self):
+        """The best match is found however many newer addresses match too"""
+        best = PostalAddress.objects.create(
+            address1="London House", city="London", country="GBR"
+        )
+        self.test_user1.add_postal_addresses([best])
+        self.test_user1.add_postal_addresses(
+            PostalAddress.objects.bulk_get_or_create(
                 [
-                    ("count", 3),
-                    ("next", None),
-                    ("previous", None),
-                    (
-                        "results",
-                        [
-                            OrderedDict(
-                                [
-                                    ("id", self.shared_postal_address.id),
-                                    ("address1", "Our Coworking space"),
-                                    ("address2", "testuser1andtestuser2"),
-                                    ("zip_code", "reqaw2"),
-                                    ("city", "Cambridge"),
-                                    ("country", "GBR"),
-                                ]
-                            ),
-                        ],
-                    ),
+                    {
+                        "address1": f"{index} Side Street",
+                        "city": "London",
+                        "country": "GBR",
+                    }
+                    for index in range(300)
                 ]
-            ),
+            )
+        )
+
+        response = self.client.get(
+            reverse("postaladdress-list"), {"q": "london", "page_size": 5}
+        )
+        self.assertEqual(response.data["results"][0]["id"], best.id)
+        self.assertEqual(len(response.data["results"]), 5)
+
+    def test_view_address_search_in_sync(self):
+        """The search index follows bulk creates, updates and removals"""
+        self.client.post(
+            f"{reverse('postaladdress-list')}/bulk/",
+            [
+                {"address1": "1 Search Street", "country": "GBR"},
+                {
+                    "address1": "64 SomeDay Road",
+                    "address2": "testuser2only",
+                    "zip_code": "22kss",
+                    "city": "York",
+                    "country": "GBR",
+                },
+            ],
+            format="json",
+        )
+        response = self.client.get(reverse("postaladdress-list"), {"q": "york search"})
+        self.assertCountEqual(
+            [address["address1"] for address in response.data["results"]],
+            ["1 Search Street", "64 SomeDay Road"],
+        )
+
+        PostalAddress.objects.filter(address1="1 Search Street").update(
+            address1="1 Found Street"
+        )
+        self.test_user1.remove_postal_addresses([self.address3.id])
+        response = self.client.get(reverse("postaladdress-list"), {"q": "york found"})
+        self.assertEqual(
+            [address["address1"] for address in response.data["results"]],
+            ["1 Found Street"],
+        )
+
+        # Still searchable by user2
+        self.client.login(username="testuser2", password="notarealpassword")
+        response = self.client.get(reverse("postaladdress-list"), {"q": "york"})
+        self.assertEqual(len(response.data["results"]), 2)
+
+    def test_view_address_lookup_queries(self):
+        """The user and their AddressUser should each only be loaded once per request"""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("postaladdress-list"))
+
+        froms = [query["sql"].split(" FROM ")[1].split()[0] for query in queries]
+        self.assertEqual(1, froms.count('"auth_user"'))
+        self.assertEqual(1, froms.count('"address_book_api_addressuser"'))
+
+    def test_view_address_not_modified(self):
+        """Unchanged address books are answered with a 304, without querying
+        for the addresses
+        """
+        url = reverse("postaladdress-list")
+        response = self.client.get(url)
+        etag = response["ETag"]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertFalse(
+            [
+                query
+                for query in queries.captured_queries
+                if 'FROM "address_book_api_postaladdress"' in query["sql"]
+            ]
+        )
+
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]
+        )
+        self.assertEqual(response.status_code, 304)
+
+        # A different representation has a different ETag
+        response = self.client.get(f"{url}?city=London", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        detail = f"{url}/{self.address1.id}"
+        response = self.client.get(detail)
+        self.assertEqual(
+            self.client.get(detail, HTTP_IF_NONE_MATCH=response["ETag"]).status_code,
+            304,
+        )
+
+    def test_view_address_modified(self):
+        """Changes to the address book, including edits of an address it shares with
+        other users (e.g. in the admin), invalidate the ETag
+        """
+        url = reverse("postaladdress-list")
+
+        def assertModified(change):
+            etag = self.client.get(url)["ETag"]
+            change()
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+
+        assertModified(
+            lambda: self.client.post(
+                url, {"address1": "New Road", "country": "GBR"}, format="json"
+            )
+        )
+        assertModified(
+            lambda: self.client.delete(f"{url}/batch/?ids={self.address2.id}")
+        )
+        assertModified(lambda: self.client.delete(f"{url}/{self.address1.id}"))
+
+        def edit_shared_address():
+            self.shared_postal_address.city = "Oxford"
+            self.shared_postal_address.save(update_fields=["city"])
+
+        assertModified(edit_shared_address)
+        assertModified(
+            lambda: self.test_user2.postal_addresses.add(self.address3)
+            or self.test_user1.postal_addresses.add(self.address3)
+        )
+
+    @override_settings(ADDRESS_BOOK_LIST_CACHE=True)
+    def test_view_address_cached(self):
+        """The list is cached per user and query, until the addresses change"""
+        caches["address_book"].clear()
+        url = reverse("postaladdress-list")
+
+        response = self.client.get(f"{url}?city=London")
+        self.assertEqual(response["X-Cache"], "MISS")
+
+        with CaptureQueriesContext(connection) as queries:
+            cached = self.client.get(f"{url}?city=London")
+        self.assertEqual(cached["X-Cache"], "HIT")
+        self.assertEqual(cached.json(), response.json())
+        self.assertFalse(
+            [
+                query
+                for query in queries.captured_queries
+                if 'FROM "address_book_api_postaladdress"' in query["sql"]
+            ]
+        )
+
+        self.assertEqual(self.client.get(url)["X-Cache"], "MISS")
+
+        # testuser2 doesn't see testuser1's cached list
+        client = APIClient()
+        client.login(username="testuser2", password="notarealpassword")
+        self.assertEqual(client.get(url)["X-Cache"], "MISS")
+        self.assertEqual(client.get(url)["X-Cache"], "HIT")
+
+        # Editing the shared address invalidates both users' lists
+        self.shared_postal_address.city = "Leeds"
+        self.shared_postal_address.save(update_fields=["city"])
+        response = self.client.get(url)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertIn("Leeds", [row["city"] for row in response.json()["results"]])
+        self.assertEqual(client.get(url)["X-Cache"], "MISS")
+
+        # testuser2 patching it copies it for them, so only their list changes
+        client.patch(
+            f"{url}/{self.shared_postal_address.id}", {"city": "Oxford"}, format="json"
+        )
+        self.assertEqual(self.client.get(url)["X-Cache"], "HIT")
+        response = client.get(url)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertIn("Oxford", [row["city"] for row in response.json()["results"]])
+
+        self.client.delete(f"{url}/{self.address1.id}")
+        response = self.client.get(url)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertNotIn(
+            self.address1.id, [row["id"] for row in response.json()["results"]]
         )
 
+        User.objects.create_superuser("admin", password="notarealpassword")
+        self.assertEqual(self.client.get(f"{url}/cache-stats").status_code, 403)
+        self.client.login(username="admin", password="notarealpassword")
+        stats = self.client.get(f"{url}/cache-stats").json()
+        self.assertEqual(stats["hits"], 3)
+        self.assertEqual(stats["misses"], 7)
+
+    def test_admin_address_user_inline(self):
+        """The AddressUser admin edits the address book with an inline of the through
+        table, keeping owner_count in step
+        """
+        User.objects.create_superuser("admin", password="notarealpassword")
+        self.client.login(username="admin", password="notarealpassword")
+        url = reverse(
+            "admin:address_book_api_addressuser_change", args=[self.test_user1.pk]
+        )
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "addressuserpostaladdress_set-TOTAL_FORMS")
+
+        links = list(
+            AddressUserPostalAddress.objects.filter(
+                addressuser=self.test_user1
+            ).order_by("pk")
+        )
+        data = {
+            "user": self.test_user1.user_id,
+            "addressuserpostaladdress_set-TOTAL_FORMS": len(links) + 1,
+            "addressuserpostaladdress_set-INITIAL_FORMS": len(links),
+            "addressuserpostaladdress_set-MIN_NUM_FORMS": 0,
+            "addressuserpostaladdress_set-MAX_NUM_FORMS": 1000,
+        }
+        for index, link in enumerate(links):
+            prefix = f"addressuserpostaladdress_set-{index}"
+            data[f"{prefix}-id"] = link.pk
+            data[f"{prefix}-addressuser"] = self.test_user1.pk
+            data[f"{prefix}-postaladdress"] = link.postaladdress_id
+            # Drop the first address
+            if index == 0:
+                data[f"{prefix}-DELETE"] = "on"
+        prefix = f"addressuserpostaladdress_set-{len(links)}"
+        data[f"{prefix}-addressuser"] = self.test_user1.pk
+        data[f"{prefix}-postaladdress"] = self.address3.pk
+
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        self.assertCountEqual(
+            self.test_user1.postal_addresses.all(),
+            [link.postaladdress for link in links[1:]] + [self.address3],
+        )
+        self.assertEqual(PostalAddress.objects.get(pk=self.address3.pk).owner_count, 2)
+        self.assertEqual(
+            PostalAddress.objects.get(pk=links[0].postaladdress_id).owner_count, 0
+        )
+
+    def test_view_address_not_cached(self):
+        """Caching is opt in"""
+        response = self.client.get(reverse("postaladdress-list"))
+        self.assertNotIn("X-Cache", response)
+
+    @override_settings(ADDRESS_BOOK_PROFILE_ADDRESSES=2)
+    def test_profile(self):
+        """The profile nests the newest addresses and lists every id"""
+        url = reverse("addressuser-profile")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        profile = response.json()
+        self.assertEqual(profile["username"], "testuser1")
+        self.assertEqual(profile["address_count"], 3)
+        self.assertEqual(
+            profile["postal_addresses_ids"],
+            [self.address1.id, self.address2.id, self.shared_postal_address.id],
+        )
+        self.assertEqual(
+            [address["id"] for address in profile["postal_addresses"]],
+            [self.shared_postal_address.id, self.address2.id],
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+
+        PostalAddress.objects.bulk_get_or_create(
+            [
+                {"address1": f"{index} Profile Road", "country": "GBR"}
+                for index in range(50)
+            ]
+        )
+        self.test_user1.add_postal_addresses(
+            PostalAddress.objects.filter(address1__endswith="Profile Road")
+        )
+        with self.assertNumQueries(len(queries.captured_queries)):
+            profile = self.client.get(url).json()
+        self.assertEqual(profile["address_count"], 53)
+        self.assertEqual(len(profile["postal_addresses"]), 2)
+
     def test_create_address_post(self):
         """Should be able to create address
-        Should return a 400 error if same addresses is added multiple times
+        Should return 200 (and not a duplicate) if same addresses is added multiple times
         """
         count = self.test_user1.postal_addresses.count()
         response = self.client.post(
@@ -252,18 +768,14 @@ class AddressAPITestCase(TestCase):
             format="json",
         )
 
-        self.assertEqual(response.status_code, 400)
-
-        self.assertDictEqual(
-            response.data,
-            {
-                "non_field_errors": [
-                    ErrorDetail(
-                        string="The fields address1, address2, zip_code, city, country must make a unique set.",
-                        code="unique",
-                    )
-                ]
-            },
+        # Posting the same address again is an upsert, it's already attached
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data["id"],
+            self.test_user1.postal_addresses.get(address1="Addressssss 1").id,
+        )
+        self.assertEqual(
+            PostalAddress.objects.filter(address1="Addressssss 1").count(), 1
         )
 
         # Check to make sure that count is still the same (only one added)
@@ -275,7 +787,7 @@ class AddressAPITestCase(TestCase):
 
         response = self.client.get(reverse("postaladdress-list"))
         self.assertCountEqual(
-            response.data,
+            response.data["results"],
             [
                 OrderedDict(
                     [
@@ -325,53 +837,197 @@ class AddressAPITestCase(TestCase):
             ],
         )
 
+    def test_create_existing_address_post(self):
+        """Creating an address that already exists for another user attaches it,
+        without a uniqueness pre-check query
+        """
+        payload = {
+            "address1": "64 SomeDay Road",
+            "address2": "testuser2only",
+            "zip_code": "22kss",
+            "city": "York",
+            "country": "GBR",
+        }
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse("postaladdress-list"), payload, format="json"
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["id"], self.address3.id)
+        self.assertTrue(
+            self.test_user1.postal_addresses.filter(pk=self.address3.pk).exists()
+        )
+        self.assertTrue(
+            self.test_user2.postal_addresses.filter(pk=self.address3.pk).exists()
+        )
+        self.assertEqual(PostalAddress.objects.filter(**payload).count(), 1)
+
+        # Nothing looks the address up before the INSERT is attempted
+        selects = [
+            query["sql"]
+            for query in queries.captured_queries
+            if query["sql"].startswith("SELECT")
+            and "address_book_api_postaladdress" in query["sql"]
+        ]
+        self.assertEqual(len(selects), 1)
+
+    def test_bulk_create_address_post(self):
+        """Bulk create should create new addresses, attach ones that already exist
+        (including ones owned by other users) and ignore duplicates in the payload
+        """
+        payload = [
+            {
+                "address1": "1 Bulk Street",
+                "address2": "Second line",
+                "zip_code": "b1",
+                "city": "Bath",
+                "country": "GBR",
+            },
+            {
+                "address1": "64 SomeDay Road",
+                "address2": "testuser2only",
+                "zip_code": "22kss",
+                "city": "York",
+                "country": "GBR",
+            },
+            {
+                "address1": "1 Bulk Street",
+                "address2": "Second line",
+                "zip_code": "b1",
+                "city": "Bath",
+                "country": "GBR",
+            },
+        ]
+        response = self.client.post(
+            f"{reverse('postaladdress-list')}/bulk/", payload, format="json"
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(response.data[0]["id"], response.data[2]["id"])
+        self.assertEqual(response.data[1]["id"], self.address3.id)
+
+        self.assertEqual(5, self.test_user1.postal_addresses.count())
+        self.assertTrue(
+            self.test_user1.postal_addresses.filter(address1="1 Bulk Street").exists()
+        )
+        self.assertTrue(
+            self.test_user2.postal_addresses.filter(id=self.address3.id).exists()
+        )
+        self.assertEqual(
+            1, PostalAddress.objects.filter(address1="1 Bulk Street").count()
+        )
+
+    def test_bulk_create_keeps_payload_order(self):
+        """Bulk created addresses are added to the address book in payload order,
+        including existing ones (with lower ids) further down the payload
+        """
+        payload = [
+            {"address1": f"{number} Ordered Road", "country": "GBR"}
+            for number in (9, 3, 7, 1, 5)
+        ] + [PostalAddressSerializer(self.address3).data]
+        response = self.client.post(
+            f"{reverse('postaladdress-list')}/bulk/", payload, format="json"
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            [address["id"] for address in response.data],
+            list(
+                AddressUserPostalAddress.objects.filter(
+                    addressuser=self.test_user1,
+                    postaladdress__in=[address["id"] for address in response.data],
+                )
+                .order_by("pk")
+                .values_list("postaladdress_id", flat=True)
+            ),
+        )
+
+    def test_bulk_create_query_count(self):
+        """The number of queries shouldn't depend on the number of addresses"""
+
+        def payload(size, prefix):
+            return [
+                {
+                    "address1": f"{prefix} {index} Bulk Street",
+                    "address2": None,
+                    "zip_code": "b1",
+                    "city": "Bath",
+                    "country": "GBR",
+                }
+                for index in range(size)
+            ]
+
+        with CaptureQueriesContext(connection) as small:
+            response = self.client.post(
+                f"{reverse('postaladdress-list')}/bulk/",
+                payload(2, "small"),
+                format="json",
+            )
+            self.assertEqual(response.status_code, 201)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.post(
+                f"{reverse('postaladdress-list')}/bulk/",
+                payload(120, "large"),
+                format="json",
+            )
+            self.assertEqual(response.status_code, 201)
+
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(125, self.test_user1.postal_addresses.count())
+
+    def test_bulk_create_invalid(self):
+        """Nothing should be created if any address in the payload is invalid"""
+        response = self.client.post(
+            f"{reverse('postaladdress-list')}/bulk/",
+            [
+                {"address1": "1 Bulk Street", "country": "GBR"},
+                {"address1": "2 Bulk Street", "country": "NOTACOUNTRY"},
+            ],
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(
+            PostalAddress.objects.filter(address1__endswith="Bulk Street").exists()
+        )
+
     def test_patch(self):
         """Should correctly update an address"""
         response = self.client.get(reverse("postaladdress-list"))
         self.assertCountEqual(
-            response.data,
-            OrderedDict(
-                [
-                    ("count", 4),
-                    ("next", None),
-                    ("previous", None),
-                    (
-                        "results",
-                        [
-                            OrderedDict(
-                                [
-                                    ("id", self.address1.id),
-                                    ("address1", "25 SomeDay Road"),
-                                    ("address2", "testuser1only"),
-                                    ("zip_code", "728wye"),
-                                    ("city", "London"),
-                                    ("country", "GBR"),
-                                ]
-                            ),
-                            OrderedDict(
-                                [
-                                    ("id", self.address2.id),
-                                    ("address1", "14 SomeDay Road"),
-                                    ("address2", "testuser1only"),
-                                    ("zip_code", "728wye"),
-                                    ("city", "London"),
-                                    ("country", "GBR"),
-                                ]
-                            ),
-                            OrderedDict(
-                                [
-                                    ("id", self.shared_postal_address.id),
-                                    ("address1", "Our Coworking space"),
-                                    ("address2", "testuser1andtestuser2"),
-                                    ("zip_code", "reqaw2"),
-                                    ("city", "Cambridge"),
-                                    ("country", "GBR"),
-                                ]
-                            ),
-                        ],
-                    ),
-                ]
-            ),
+            response.data["results"],
+            [
+                OrderedDict(
+                    [
+                        ("id", self.address1.id),
+                        ("address1", "25 SomeDay Road"),
+                        ("address2", "testuser1only"),
+                        ("zip_code", "728wye"),
+                        ("city", "London"),
+                        ("country", "GBR"),
+                    ]
+                ),
+                OrderedDict(
+                    [
+                        ("id", self.address2.id),
+                        ("address1", "14 SomeDay Road"),
+                        ("address2", "testuser1only"),
+                        ("zip_code", "728wye"),
+                        ("city", "London"),
+                        ("country", "GBR"),
+                    ]
+                ),
+                OrderedDict(
+                    [
+                        ("id", self.shared_postal_address.id),
+                        ("address1", "Our Coworking space"),
+                        ("address2", "testuser1andtestuser2"),
+                        ("zip_code", "reqaw2"),
+                        ("city", "Cambridge"),
+                        ("country", "GBR"),
+                    ]
+                ),
+            ],
         )
 
         response = self.client.patch(
@@ -387,7 +1043,9 @@ class AddressAPITestCase(TestCase):
         self.assertEqual(response.status_code, 200)
 
         # Test that it's been correctly updated
-        response = self.client.get(f"{reverse('postaladdress-list')}/{self.address1.id}/")
+        response = self.client.get(
+            f"{reverse('postaladdress-list')}/{self.address1.id}/"
+        )
         self.assertCountEqual(
             response.data,
             {
@@ -400,9 +1058,9 @@ class AddressAPITestCase(TestCase):
             },
         )
 
-        # Test that unique constraints hold, i.e. you can't update to something that already exists
+        # Updating to an address that already exists moves the user onto it
         response = self.client.patch(
-            f"/{reverse('postaladdress-list')}/{self.address1.id}/",
+            f"{reverse('postaladdress-list')}/{self.address1.id}/",
             {
                 "address1": "14 SomeDay Road",
                 "address2": "testuser1only",
@@ -411,17 +1069,225 @@ class AddressAPITestCase(TestCase):
                 "country": "GBR",
             },
         )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["id"], self.address2.id)
+        self.assertCountEqual(
+            self.test_user1.postal_addresses.all(),
+            [self.address2, self.shared_postal_address],
+        )
+        self.assertFalse(PostalAddress.objects.filter(pk=self.address1.id).exists())
+
+        # A shared address is copied for the user, rather than changed for everyone
+        response = self.client.patch(
+            f"{reverse('postaladdress-list')}/{self.shared_postal_address.id}/",
+            {"city": "Oxford"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.data["id"], self.shared_postal_address.id)
+        self.assertEqual(response.data["city"], "Oxford")
+        self.shared_postal_address.refresh_from_db()
+        self.assertEqual(self.shared_postal_address.city, "Cambridge")
+        self.assertTrue(
+            self.test_user2.postal_addresses.filter(
+                pk=self.shared_postal_address.id
+            ).exists()
+        )
+
+        for identifier, payload in (
+            (self.address3.id, {"city": "Leeds"}),
+            ("99999999999999999999", {"city": "Leeds"}),
+            ("x", {"city": "Leeds"}),
+        ):
+            response = self.client.patch(
+                f"{reverse('postaladdress-list')}/{identifier}/", payload, format="json"
+            )
+            self.assertEqual(response.status_code, 404, identifier)
+        response = self.client.patch(
+            f"{reverse('postaladdress-list')}/{self.address2.id}/",
+            {"country": "XXX"},
+            format="json",
+        )
         self.assertEqual(response.status_code, 400)
+
+    def test_bulk_patch(self):
+        """Own addresses are updated in place, shared ones are copied for the user"""
+        url = reverse("postaladdress-list")
+        client2 = APIClient()
+        client2.login(username="testuser2", password="notarealpassword")
+        etag2 = client2.get(url)["ETag"]
+
+        response = self.client.patch(
+            f"{url}/bulk",
+            [
+                {"id": self.address1.id, "city": "Leeds"},
+                {"id": self.shared_postal_address.id, "address2": "Desk 4"},
+            ],
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        updated, copy = response.json()
+        self.assertEqual(updated["id"], self.address1.id)
+        self.assertEqual(updated["city"], "Leeds")
+        self.assertNotEqual(copy["id"], self.shared_postal_address.id)
+        self.assertEqual(copy["address2"], "Desk 4")
+        self.assertEqual(copy["address1"], "Our Coworking space")
+
         self.assertCountEqual(
-            response.data,
-            {
-                "non_field_errors": [
-                    ErrorDetail(
-                        string="The fields address1, address2, zip_code, city, country, user must make a unique set.",
-                        code="unique",
-                    )
-                ]
-            },
+            self.test_user1.postal_addresses.values_list("id", flat=True),
+            [self.address1.id, self.address2.id, copy["id"]],
+        )
+        self.assertEqual(
+            PostalAddress.objects.get(pk=copy["id"]).owner_count,
+            1,
+        )
+        # testuser2's address (and so their address book) is untouched
+        self.shared_postal_address.refresh_from_db()
+        self.assertEqual(self.shared_postal_address.address2, "testuser1andtestuser2")
+        self.assertEqual(self.shared_postal_address.owner_count, 1)
+        self.assertEqual(client2.get(url, HTTP_IF_NONE_MATCH=etag2).status_code, 304)
+
+        response = self.client.get(f"{url}?q=desk")
+        self.assertEqual(
+            [row["id"] for row in response.json()["results"]], [copy["id"]]
+        )
+
+    def test_bulk_patch_existing(self):
+        """Changing an address into one that exists moves the user onto it"""
+        url = reverse("postaladdress-list")
+        response = self.client.patch(
+            f"{url}/bulk",
+            [
+                {"id": self.address1.id, "address1": "14 SomeDay Road"},
+                {"id": self.shared_postal_address.id, "address1": "54 Askel road"},
+            ],
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        merged, copy = response.json()
+        self.assertEqual(merged["id"], self.address2.id)
+        self.assertNotEqual(copy["id"], self.shared_postal_address.id)
+        self.assertFalse(PostalAddress.objects.filter(pk=self.address1.id).exists())
+
+        # Changing the copy back moves the user back onto the shared address, and the
+        # copy is deleted
+        response = self.client.patch(
+            f"{url}/bulk",
+            [{"id": copy["id"], "address1": "Our Coworking space"}],
+            format="json",
+        )
+        self.assertEqual(response.json()[0]["id"], self.shared_postal_address.id)
+        self.assertFalse(PostalAddress.objects.filter(pk=copy["id"]).exists())
+
+        # The address is still shared, so this copies it, onto address4 of testuser2
+        response = self.client.patch(
+            f"{url}/bulk",
+            [
+                {
+                    "id": self.shared_postal_address.id,
+                    "address1": "54 Askel road",
+                    "address2": "testuser2only",
+                    "zip_code": "fds0l2",
+                    "city": "York",
+                }
+            ],
+            format="json",
+        )
+        self.assertEqual(response.json()[0]["id"], self.address4.id)
+        self.assertCountEqual(
+            self.test_user1.postal_addresses.values_list("id", flat=True),
+            [self.address2.id, self.address4.id],
+        )
+        self.address4.refresh_from_db()
+        self.shared_postal_address.refresh_from_db()
+        self.assertEqual(self.address4.owner_count, 2)
+        self.assertEqual(self.shared_postal_address.owner_count, 1)
+
+    def test_bulk_patch_swap(self):
+        """Addresses changed into each other (swapped, or in a cycle) are all kept"""
+        url = f"{reverse('postaladdress-list')}/bulk"
+        fields = ("address1", "address2", "zip_code", "city", "country")
+
+        def contents(address):
+            return {field: getattr(address, field) for field in fields}
+
+        def book():
+            return self.test_user1.postal_addresses.values(*fields)
+
+        before = list(book())
+        address_count = PostalAddress.objects.count()
+        for cycle in (
+            [self.address1, self.address2],
+            [self.address1, self.shared_postal_address, self.address2],
+        ):
+            response = self.client.patch(
+                url,
+                [
+                    {"id": address.id, **contents(cycle[(index + 1) % len(cycle)])}
+                    for index, address in enumerate(cycle)
+                ],
+                format="json",
+            )
+            self.assertEqual(response.status_code, 200)
+            for row in response.json():
+                self.assertEqual(
+                    contents(PostalAddress.objects.get(pk=row["id"])),
+                    {field: row[field] for field in fields},
+                )
+                self.assertTrue(
+                    self.test_user1.postal_addresses.filter(pk=row["id"]).exists()
+                )
+
+            self.assertCountEqual(book(), before)
+            self.assertEqual(PostalAddress.objects.count(), address_count)
+            self.shared_postal_address.refresh_from_db()
+            self.assertEqual(self.shared_postal_address.owner_count, 2)
+
+    def test_bulk_patch_invalid(self):
+        """Bulk PATCHes are all or nothing"""
+        url = f"{reverse('postaladdress-list')}/bulk"
+        for payload, status_code in (
+            (
+                [{"id": self.address1.id, "city": "Leeds"}, {"id": self.address3.id}],
+                404,
+            ),
+            ([{"id": self.address1.id}, {"id": self.address1.id}], 400),
+            ([{"id": 99999999999999999999, "city": "Leeds"}], 400),
+            ([{"city": "Leeds"}], 400),
+            ([{"id": self.address1.id, "country": "XXX"}], 400),
+            ([], 400),
+        ):
+            response = self.client.patch(url, payload, format="json")
+            self.assertEqual(response.status_code, status_code, payload)
+
+        self.address1.refresh_from_db()
+        self.assertEqual(self.address1.city, "London")
+
+    def test_bulk_patch_query_count(self):
+        """The number of queries doesn't depend on the number of addresses"""
+        url = reverse("postaladdress-list")
+        addresses = PostalAddress.objects.bulk_get_or_create(
+            [
+                {"address1": f"{index} Patch Road", "country": "GBR"}
+                for index in range(40)
+            ]
+        )
+        self.test_user1.add_postal_addresses(addresses)
+        self.test_user2.add_postal_addresses(addresses[20:])
+
+        def patch(addresses):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.patch(
+                    f"{url}/bulk",
+                    [{"id": address.id, "city": "Bath"} for address in addresses],
+                    format="json",
+                )
+            self.assertEqual(response.status_code, 200)
+            return len(queries.captured_queries)
+
+        self.assertEqual(
+            patch(addresses[:2] + addresses[20:22]),
+            patch(addresses[2:20] + addresses[22:]),
         )
 
     def test_delete_address(self):
@@ -433,7 +1299,10 @@ class AddressAPITestCase(TestCase):
         )
 
         self.assertEqual(
-            self.client.delete(f"{reverse('postaladdress-list')}/{address1_id}").status_code, 204
+            self.client.delete(
+                f"{reverse('postaladdress-list')}/{address1_id}"
+            ).status_code,
+            204,
         )
         self.assertFalse(
             self.test_user1.postal_addresses.filter(id=address1_id).exists()
@@ -445,7 +1314,10 @@ class AddressAPITestCase(TestCase):
         # Attempt to delete a resource that doesn't exist
 
         self.assertEqual(
-            self.client.delete(f"{reverse('postaladdress-list')}/{address1_id}").status_code, 404
+            self.client.delete(
+                f"{reverse('postaladdress-list')}/{address1_id}"
+            ).status_code,
+            404,
         )
 
         self.assertEqual(
@@ -454,7 +1326,9 @@ class AddressAPITestCase(TestCase):
 
         # Attempt to delete addresses that are not assigned to you
         self.assertEqual(
-            self.client.delete(f"{reverse('postaladdress-list')}/{self.address4.id}").status_code,
+            self.client.delete(
+                f"{reverse('postaladdress-list')}/{self.address4.id}"
+            ).status_code,
             404,
         )
         # Attempt to delete shared address
@@ -474,6 +1348,14 @@ class AddressAPITestCase(TestCase):
             PostalAddress.objects.filter(id=self.shared_postal_address.id).exists()
         )
 
+        # Ids that can't exist (past the 64 bit range) aren't found either
+        self.assertEqual(
+            self.client.delete(
+                f"{reverse('postaladdress-list')}/99999999999999999999"
+            ).status_code,
+            404,
+        )
+
     def test_delete_address_batch(self):
         count = self.test_user1.postal_addresses.count()
         address1_id = self.address1.id
@@ -490,9 +1372,7 @@ class AddressAPITestCase(TestCase):
         )
         self.assertFalse(PostalAddress.objects.filter(id=address1_id).exists())
         self.assertFalse(PostalAddress.objects.filter(id=address2_id).exists())
-        self.assertEqual(
-            count - 2, PostalAddress.objects.filter(user=self.test_user1).count()
-        )
+        self.assertEqual(count - 2, self.test_user1.postal_addresses.count())
 
         # Test that you can't delete someone else's PostalAddress
         self.assertEqual(
@@ -504,6 +1384,79 @@ class AddressAPITestCase(TestCase):
 
         self.assertTrue(PostalAddress.objects.filter(id=self.address3.id).exists())
 
+        # Ids that aren't ids are rejected, including those past the 64 bit range
+        for ids in ("x", f"{self.address3.id},99999999999999999999", f"-{2**64}"):
+            self.assertEqual(
+                self.client.delete(
+                    f"{reverse('postaladdress-list')}/batch/?ids={ids}"
+                ).status_code,
+                400,
+                ids,
+            )
+
+    def test_delete_address_batch_shared(self):
+        """Batch deleting a shared address should only remove it from the user"""
+        ids = f"{self.address1.id},{self.shared_postal_address.id}"
+        self.assertEqual(
+            self.client.delete(
+                f"{reverse('postaladdress-list')}/batch/?ids={ids}"
+            ).status_code,
+            204,
+        )
+        self.assertFalse(PostalAddress.objects.filter(id=self.address1.id).exists())
+        self.assertFalse(
+            self.test_user1.postal_addresses.filter(
+                id=self.shared_postal_address.id
+            ).exists()
+        )
+        # Still referenced by user2
+        self.assertTrue(
+            self.test_user2.postal_addresses.filter(
+                id=self.shared_postal_address.id
+            ).exists()
+        )
+        self.shared_postal_address.refresh_from_db()
+        self.assertEqual(self.shared_postal_address.owner_count, 1)
+
+    def test_delete_address_batch_query_count(self):
+        """The number of queries shouldn't depend on the number of addresses deleted"""
+        addresses = PostalAddress.objects.bulk_get_or_create(
+            [
+                {"address1": f"{index} Batch Road", "country": "GBR"}
+                for index in range(60)
+            ]
+        )
+        self.test_user1.add_postal_addresses(addresses)
+
+        with CaptureQueriesContext(connection) as small:
+            response = self.client.delete(
+                f"{reverse('postaladdress-list')}/batch/?ids={addresses[0].id}"
+            )
+            self.assertEqual(response.status_code, 204)
+        ids = ",".join(str(address.id) for address in addresses[1:])
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.delete(
+                f"{reverse('postaladdress-list')}/batch/?ids={ids}"
+            )
+            self.assertEqual(response.status_code, 204)
+
+        self.assertEqual(len(small), len(large))
+        self.assertFalse(
+            PostalAddress.objects.filter(address1__endswith="Batch Road").exists()
+        )
+
+    def test_delete_address_batch_invalid(self):
+        self.assertEqual(
+            self.client.delete(f"{reverse('postaladdress-list')}/batch/").status_code,
+            400,
+        )
+        self.assertEqual(
+            self.client.delete(
+                f"{reverse('postaladdress-list')}/batch/?ids=1,two"
+            ).status_code,
+            400,
+        )
+
     def test_delete_address_batch_transactional(self):
         """Test that when multiple addresses are sent for deletion, that if one object
         is not found, the whole operation fails and no addresses are deleted
@@ -541,7 +1494,9 @@ class AuthenticationTestCase(TestCase):
         Addresses with from other users should not be visible
 
         """
-        self.assertEqual(self.client.get(reverse("postaladdress-list")).status_code, 401)
+        self.assertEqual(
+            self.client.get(reverse("postaladdress-list")).status_code, 401
+        )
 
     def test_user_login(self):
         """
@@ -550,7 +1505,9 @@ class AuthenticationTestCase(TestCase):
         """
 
         self.client.login(username="testuser1", password="notarealpassword")
-        self.assertEqual(self.client.get(reverse("postaladdress-list")).status_code, 200)
+        self.assertEqual(
+            self.client.get(reverse("postaladdress-list")).status_code, 200
+        )
 
     def test_user_logout(self):
         """
@@ -558,9 +1515,38 @@ class AuthenticationTestCase(TestCase):
 
         """
         self.client.login(username="testuser1", password="notarealpassword")
-        self.assertEqual(self.client.get(reverse("postaladdress-list")).status_code, 200)
+        self.assertEqual(
+            self.client.get(reverse("postaladdress-list")).status_code, 200
+        )
         self.client.logout()
-        self.assertEqual(self.client.get(reverse("postaladdress-list")).status_code, 401)
+        self.assertEqual(
+            self.client.get(reverse("postaladdress-list")).status_code, 401
+        )
+
+    def test_not_address_book_user(self):
+        """
+        Test: Users without an AddressUser are refused rather than erroring
+
+        """
+        User.objects.create_user(username="plainuser", password="notarealpassword")
+        self.client.login(username="plainuser", password="notarealpassword")
+        self.assertEqual(
+            self.client.get(reverse("postaladdress-list")).status_code, 403
+        )
+        self.assertEqual(
+            self.client.post(
+                reverse("postaladdress-list"),
+                {"address1": "1 Nowhere Lane", "country": "GBR"},
+                format="json",
+            ).status_code,
+            403,
+        )
+        self.assertFalse(
+            PostalAddress.objects.filter(address1="1 Nowhere Lane").exists()
+        )
+        self.assertEqual(
+            self.client.get(reverse("addressuser-profile")).status_code, 403
+        )
 
     def test_user_api_token(self):
         """
@@ -576,3 +1562,83 @@ class AuthenticationTestCase(TestCase):
         token = response.data["token"]
         client = APIClient(HTTP_AUTHORIZATION="Token " + token)
         self.assertEqual(client.get(reverse("postaladdress-list")).status_code, 200)
+
+    def test_user_api_token_cached(self):
+        """
+        Test: The token's user is cached until the token is deleted
+        """
+        token = Token.objects.create(user=self.test_user.user)
+        client = APIClient(HTTP_AUTHORIZATION="Token " + token.key)
+        self.assertEqual(client.get(reverse("postaladdress-list")).status_code, 200)
+        # The cache may be shared, so the password hash is never put in it
+        self.assertNotIn(
+            self.test_user.user.password,
+            pickle.dumps(cache.get(token_cache_key(token.key))).decode("latin-1"),
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(reverse("postaladdress-list"))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(
+            [
+                query
+                for query in queries.captured_queries
+                if '"authtoken_token"' in query["sql"]
+            ]
+        )
+
+        token.delete()
+        self.assertEqual(client.get(reverse("postaladdress-list")).status_code, 401)
+
+    def test_user_access_token(self):
+        """
+        Test: Authentication via a signed access token doesn't touch the auth tables
+        """
+        response = self.client.post(
+            "/api-token-auth/",
+            {"username": "testuser1", "password": "notarealpassword"},
+            format="json",
+        )
+        self.assertEqual(response.data["expires_in"], 300)
+        access = response.data["access"]
+
+        client = APIClient(HTTP_AUTHORIZATION="Bearer " + access)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(reverse("postaladdress-list"))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(
+            [
+                query
+                for query in queries.captured_queries
+                if 'FROM "auth_user"' in query["sql"]
+                or 'FROM "authtoken_token"' in query["sql"]
+            ]
+        )
+
+        client = APIClient(HTTP_AUTHORIZATION="Bearer " + access[:-1])
+        self.assertEqual(client.get(reverse("postaladdress-list")).status_code, 401)
+
+        with self.settings(ADDRESS_BOOK_ACCESS_TOKEN_MAX_AGE=-1):
+            client = APIClient(HTTP_AUTHORIZATION="Bearer " + access)
+            response = client.get(reverse("postaladdress-list"))
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()["detail"], "Access token has expired.")
+
+    def test_schema(self):
+        """The OpenAPI schema is served without authenticating, and the address ids
+        are typed from the viewset's (empty) queryset
+        """
+        response = self.client.get(reverse("schema"), HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, 200)
+        schema = json.loads(response.content)
+        detail = next(
+            operations
+            for path, operations in schema["paths"].items()
+            if path.startswith("/api/v1/addressbook/{")
+        )
+        (identifier,) = [
+            parameter
+            for parameter in detail["get"]["parameters"]
+            if parameter["name"] == "id"
+        ]
+        self.assertEqual(identifier["schema"]["type"], "integer")
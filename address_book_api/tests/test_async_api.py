@@ -0,0 +1,183 @@
+from django.test import TestCase
+from rest_framework.authtoken.models import Token
+from rest_framework.reverse import reverse
+
+from address_book_api.authentication import issue_access_token
+from address_book_api.models import AddressUser, PostalAddress
+
+
+class AsyncAddressAPITestCase(TestCase):
+    def setUp(self) -> None:
+        self.test_user1 = AddressUser.objects.create_user(
+            username="testuser1", password="notarealpassword"
+        )
+        self.test_user2 = AddressUser.objects.create_user(
+            username="testuser2", password="notarealpassword"
+        )
+        self.addresses = PostalAddress.objects.bulk_get_or_create(
+            [
+                {
+                    "address1": f"{index} SomeDay Road",
+                    "city": "London" if index % 2 else "York",
+                    "country": "GBR",
+                }
+                for index in range(5)
+            ]
+        )
+        self.test_user1.add_postal_addresses(self.addresses)
+        self.test_user2.add_postal_addresses(self.addresses[:1])
+
+        self.url = reverse("postaladdress-async-list")
+        self.headers = {
+            "Authorization": f"Bearer {issue_access_token(self.test_user1.user)}"
+        }
+
+    async def test_list(self):
+        """Pages of the async list link to each other like the DRF list's"""
+        response = await self.async_client.get(
+            self.url, {"page_size": 2}, headers=self.headers
+        )
+        self.assertEqual(response.status_code, 200)
+        page = response.json()
+        self.assertEqual(
+            [row["id"] for row in page["results"]],
+            [address.id for address in self.addresses[:2]],
+        )
+        self.assertIsNone(page["previous"])
+
+        response = await self.async_client.get(page["next"], headers=self.headers)
+        page = response.json()
+        self.assertEqual(
+            [row["id"] for row in page["results"]],
+            [address.id for address in self.addresses[2:4]],
+        )
+
+        response = await self.async_client.get(page["previous"], headers=self.headers)
+        self.assertEqual(
+            [row["id"] for row in response.json()["results"]],
+            [address.id for address in self.addresses[:2]],
+        )
+
+        # The DRF view's cursors work too
+        sync_page = (
+            await self.async_client.get(
+                reverse("postaladdress-list"), {"page_size": 2}, headers=self.headers
+            )
+        ).json()
+        response = await self.async_client.get(
+            sync_page["next"].replace("/addressbook", "/async/addressbook"),
+            headers=self.headers,
+        )
+        self.assertEqual(response.json(), page)
+
+    async def test_list_filter_stream(self):
+        response = await self.async_client.get(
+            self.url,
+            {"city": "London", "fields": "id,city", "stream": "true"},
+            headers=self.headers,
+        )
+        content = b"".join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(
+            content,
+            b"["
+            + b",".join(
+                f'{{"id":{address.id},"city":"London"}}'.encode()
+                for address in self.addresses[1::2]
+            )
+            + b"]",
+        )
+
+        response = await self.async_client.get(
+            self.url, {"zip_code__range": "a"}, headers=self.headers
+        )
+        self.assertEqual(response.status_code, 400)
+
+    async def test_retrieve(self):
+        address = self.addresses[0]
+        response = await self.async_client.get(
+            f"{self.url}/{address.id}", {"exclude": "address2"}, headers=self.headers
+        )
+        self.assertEqual(
+            response.json(),
+            {
+                "id": address.id,
+                "address1": "0 SomeDay Road",
+                "zip_code": None,
+                "city": "York",
+                "country": "GBR",
+            },
+        )
+
+        other = await PostalAddress.objects.acreate(
+            address1="Not Mine Road", country="GBR"
+        )
+        response = await self.async_client.get(
+            f"{self.url}/{other.id}", headers=self.headers
+        )
+        self.assertEqual(response.status_code, 404)
+
+    async def test_create_delete(self):
+        """Create is an upsert and delete keeps shared addresses, as in the DRF views"""
+        token = await Token.objects.acreate(user=self.test_user2.user)
+        headers = {"Authorization": f"Token {token.key}"}
+
+        response = await self.async_client.post(
+            self.url,
+            {"address1": "1 SomeDay Road", "city": "London", "country": "GBR"},
+            content_type="application/json",
+            headers=headers,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["id"], self.addresses[1].id)
+
+        response = await self.async_client.post(
+            self.url,
+            {"address1": "New Road", "country": "GBR"},
+            content_type="application/json",
+            headers=headers,
+        )
+        self.assertEqual(response.status_code, 201)
+        created = response.json()["id"]
+
+        response = await self.async_client.post(
+            self.url,
+            {"address1": "New Road", "country": "XXX"},
+            content_type="application/json",
+            headers=headers,
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("country", response.json())
+
+        for pk in (created, self.addresses[1].id):
+            response = await self.async_client.delete(
+                f"{self.url}/{pk}", headers=headers
+            )
+            self.assertEqual(response.status_code, 204)
+
+        self.assertFalse(await PostalAddress.objects.filter(pk=created).aexists())
+        self.assertEqual(
+            await PostalAddress.objects.filter(
+                pk=self.addresses[1].id, owner_count=1
+            ).acount(),
+            1,
+        )
+
+        response = await self.async_client.delete(
+            f"{self.url}/{created}", headers=headers
+        )
+        self.assertEqual(response.status_code, 404)
+
+    async def test_authentication(self):
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response["WWW-Authenticate"], "Bearer")
+
+        response = await self.async_client.get(
+            self.url, headers={"Authorization": "Token notatoken"}
+        )
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), {"detail": "Invalid token."})
+
+        await AddressUser.objects.filter(pk=self.test_user1.pk).adelete()
+        response = await self.async_client.get(self.url, headers=self.headers)
+        self.assertEqual(response.status_code, 403)
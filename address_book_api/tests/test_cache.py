@@ -0,0 +1,28 @@
+from django.test import SimpleTestCase
+
+from address_book_api.cache import LRULocMemCache
+
+
+class LRULocMemCacheTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        self.cache = LRULocMemCache("test", {"OPTIONS": {"MAX_ENTRIES": 3}})
+
+    def tearDown(self) -> None:
+        self.cache.clear()
+
+    def test_evicts_least_recently_used(self):
+        """Only the least recently used entry is evicted to make room"""
+        for key in ("a", "b", "c"):
+            self.cache.set(key, key)
+
+        self.cache.get("a")
+        self.cache.set("d", "d")
+
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(
+            self.cache.get_many(["a", "c", "d"]), {"a": "a", "c": "c", "d": "d"}
+        )
+        self.assertEqual(
+            self.cache.stats(),
+            {"hits": 4, "misses": 1, "evictions": 1, "entries": 3, "max_entries": 3},
+        )
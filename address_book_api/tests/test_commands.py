@@ -0,0 +1,242 @@
+import json
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+from address_book_api import search
+from address_book_api.management.commands import benchmark_api
+from address_book_api.models import ADDRESS_FIELDS, AddressUser, PostalAddress
+
+
+class CollectOrphanedAddressesTestCase(TestCase):
+    def setUp(self) -> None:
+        self.user = AddressUser.objects.create_user(username="testuser")
+        self.owned = PostalAddress.objects.create(address1="Owned Road", country="GBR")
+        self.user.postal_addresses.add(self.owned)
+        PostalAddress.objects.bulk_create(
+            [
+                PostalAddress(address1=f"{index} Orphan Road", country="GBR")
+                for index in range(5)
+            ]
+        )
+
+    def test_collect(self):
+        """Only unreferenced addresses are deleted, across several batches"""
+        out = StringIO()
+        call_command("collect_orphaned_addresses", "--batch-size=2", stdout=out)
+
+        self.assertEqual(list(PostalAddress.objects.all()), [self.owned])
+        self.assertIn("Deleted 5 orphaned addresses in", out.getvalue())
+
+    def test_collect_dry_run(self):
+        out = StringIO()
+        call_command("collect_orphaned_addresses", "--dry-run", stdout=out)
+
+        self.assertEqual(PostalAddress.objects.count(), 6)
+        self.assertIn("Found 5 orphaned addresses in", out.getvalue())
+
+    def test_collect_ignores_owner_count(self):
+        """Orphans are found by anti-join, a drifted owner_count doesn't matter"""
+        PostalAddress.objects.update(owner_count=1)
+        call_command("collect_orphaned_addresses", stdout=StringIO())
+
+        self.assertEqual(list(PostalAddress.objects.all()), [self.owned])
+
+
+class RepairOwnerCountsTestCase(TestCase):
+    def test_repair(self):
+        user = AddressUser.objects.create_user(username="testuser")
+        address = PostalAddress.objects.create(address1="25 Day Road", country="GBR")
+        user.postal_addresses.add(address)
+        PostalAddress.objects.update(owner_count=0)
+
+        out = StringIO()
+        call_command("repair_owner_counts", stdout=out)
+
+        address.refresh_from_db()
+        self.assertEqual(address.owner_count, 1)
+        self.assertIn("Repaired owner_count of 1 postal addresses", out.getvalue())
+
+
+class RebuildSearchIndexTestCase(TestCase):
+    def test_rebuild(self):
+        """Addresses created while the triggers were dropped are indexed by a rebuild"""
+        user = AddressUser.objects.create_user(username="testuser")
+        search.drop_search_triggers()
+        user.postal_addresses.add(
+            PostalAddress.objects.create(address1="25 Day Road", country="GBR")
+        )
+        self.assertEqual(search.search_postal_addresses(user, "Day", 10), [])
+
+        out = StringIO()
+        call_command("rebuild_search_index", stdout=out)
+
+        self.assertEqual(len(search.search_postal_addresses(user, "Day", 10)), 1)
+        self.assertIn("Indexed 1 postal addresses", out.getvalue())
+
+
+class BenchmarkSerializationTestCase(TestCase):
+    def test_benchmark(self):
+        """The benchmark reports each size and leaves nothing behind"""
+        out, err = StringIO(), StringIO()
+        call_command(
+            "benchmark_serialization",
+            "--rows",
+            "10",
+            "20",
+            "--repeat=1",
+            stdout=out,
+            stderr=err,
+        )
+
+        lines = out.getvalue().splitlines()
+        self.assertEqual([line.split()[0] for line in lines[1:]], ["10", "20"])
+        self.assertEqual(err.getvalue(), "")
+        self.assertFalse(PostalAddress.objects.exists())
+
+
+class GenerateSyntheticDataTestCase(TestCase):
+    def generate(self, *args):
+        out = StringIO()
+        call_command(
+            "generate_synthetic_data",
+            "--users=50",
+            "--addresses-per-user=5",
+            "--shared-addresses=10",
+            "--share-ratio=0.3",
+            *args,
+            stdout=out,
+        )
+        return out.getvalue()
+
+    def address_books(self):
+        return {
+            address_user.user.username: list(
+                address_user.postal_addresses.order_by(
+                    "address_user_links__id"
+                ).values_list(*ADDRESS_FIELDS)
+            )
+            for address_user in AddressUser.objects.all()
+        }
+
+    def test_generate(self):
+        out = self.generate("--chunk-size=7", "--null-rates=address2=1")
+
+        self.assertIn("Generated 50 users", out)
+        self.assertEqual(AddressUser.objects.count(), 50)
+        self.assertEqual(PostalAddress.objects.repair_owner_counts(), 0)
+        self.assertFalse(PostalAddress.objects.exclude(address2=None).exists())
+        self.assertTrue(PostalAddress.objects.filter(owner_count__gt=1).exists())
+
+        # The search index is rebuilt, and maintained again afterwards
+        address_user = AddressUser.objects.get(user__username="synthetic0")
+        address = address_user.postal_addresses.first()
+        self.assertIn(
+            address.pk,
+            search.search_postal_addresses(address_user, address.address1, 10),
+        )
+        address_user.postal_addresses.add(
+            PostalAddress.objects.create(address1="25 Day Road", country="GBR")
+        )
+        self.assertEqual(
+            len(search.search_postal_addresses(address_user, "Day", 10)), 1
+        )
+
+    def test_deterministic(self):
+        """The same seed generates the same address books, however they're chunked"""
+        self.generate("--chunk-size=50")
+        address_books = self.address_books()
+        User.objects.all().delete()
+        PostalAddress.objects.all().delete()
+
+        self.generate("--chunk-size=3")
+        self.assertEqual(self.address_books(), address_books)
+
+        with self.assertRaises(CommandError):
+            self.generate()
+        self.generate("--first-user=50")
+        self.assertEqual(AddressUser.objects.count(), 100)
+
+
+class BenchmarkAPITestCase(TestCase):
+    def benchmark(self, *args):
+        out = StringIO()
+        call_command(
+            "benchmark_api",
+            "--addresses=5",
+            "--share-ratios",
+            "0",
+            "0.5",
+            "--requests=2",
+            # Already on the test databases
+            "--existing-databases",
+            *args,
+            stdout=out,
+        )
+        return out.getvalue()
+
+    def test_benchmark(self):
+        """Every operation is measured, and nothing is left behind"""
+        with tempfile.TemporaryDirectory() as directory:
+            output = Path(directory) / "results.json"
+            self.benchmark(f"--output={output}")
+            results = json.loads(output.read_text())["results"]
+
+            self.assertEqual(
+                [(result["operation"], result["share_ratio"]) for result in results],
+                [("token_auth", None)]
+                + [
+                    (operation, share_ratio)
+                    for share_ratio in (0, 0.5)
+                    for operation in (
+                        "list",
+                        "filtered_list",
+                        "retrieve",
+                        "create",
+                        "patch",
+                        "destroy",
+                        "batch_delete",
+                        "admin_postaladdress_changelist",
+                        "admin_addressuser_changelist",
+                    )
+                ],
+            )
+            self.assertTrue(all(result["queries"] > 0 for result in results))
+            self.assertFalse(User.objects.exists())
+            self.assertFalse(PostalAddress.objects.exists())
+
+            # Compared against itself, with plenty of leeway
+            self.assertIn(
+                "No regressions",
+                self.benchmark(f"--baseline={output}", "--threshold=100"),
+            )
+
+            # A baseline that's faster and makes fewer queries
+            for result in results:
+                result["p50_ms"] /= 1000
+                result["queries"] -= 1
+            output.write_text(json.dumps({"results": results}))
+            with self.assertRaisesMessage(CommandError, "regressions"):
+                self.benchmark(f"--baseline={output}")
+
+    def test_benchmark_test_databases(self):
+        """By default it runs on test databases, which are destroyed however the
+        run ends
+        """
+        with mock.patch.object(
+            benchmark_api.Command, "setup_databases", return_value=["old config"]
+        ) as setup_databases, mock.patch.object(
+            benchmark_api, "teardown_databases"
+        ) as teardown_databases, mock.patch.object(
+            benchmark_api.Command, "measure_token_auth", side_effect=KeyboardInterrupt
+        ):
+            with self.assertRaises(KeyboardInterrupt):
+                call_command("benchmark_api", stdout=StringIO())
+
+        setup_databases.assert_called_once()
+        teardown_databases.assert_called_once_with(["old config"], verbosity=0)
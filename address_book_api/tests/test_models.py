@@ -1,7 +1,16 @@
+import itertools
+from unittest import mock
+
+from django.db import connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.db.utils import IntegrityError
-from address_book_api.models import AddressUser, PostalAddress
-
+from address_book_api.models import (
+    AddressUser,
+    AddressUserPostalAddress,
+    PostalAddress,
+    address_fingerprint,
+)
 
 # Create your tests here.
 
@@ -25,7 +34,71 @@ class PostalAddressTestCase(TestCase):
             city="London",
             country="GBR",
         )
-        # Todo: Add test of all permutations of nullable zip_code, city, country
+
+    def test_uniqueness_with_nulls(self):
+        """Uniqueness should hold for every combination of the nullable fields,
+        with NULL distinct from an empty string
+        """
+        for address2, zip_code, city in itertools.product(
+            [None, "", "Flat 1"], [None, "728wye"], [None, "London"]
+        ):
+            fields = dict(
+                address1="25 SomeDay Road",
+                address2=address2,
+                zip_code=zip_code,
+                city=city,
+                country="GBR",
+            )
+            PostalAddress.objects.create(**fields)
+            with transaction.atomic():
+                self.assertRaises(
+                    IntegrityError, PostalAddress.objects.create, **fields
+                )
+
+        self.assertEqual(12, PostalAddress.objects.count())
+
+    def test_fingerprint_bulk_update(self):
+        """Bulk updates of address fields should keep the fingerprint in step"""
+        address = PostalAddress.objects.create(
+            address1="25 SomeDay Road", country="GBR"
+        )
+        address.city = "London"
+        PostalAddress.objects.bulk_update([address], ["city"])
+
+        self.assertTrue(
+            PostalAddress.objects.filter(
+                fingerprint=address_fingerprint(
+                    ["25 SomeDay Road", None, None, "London", "GBR"]
+                )
+            ).exists()
+        )
+
+    def test_filter_indexes(self):
+        """The lookups PostalAddressFilter offers on country, city and zip_code
+        can all be answered from an index
+        """
+        for lookup, index in [
+            ({"country": "GBR", "city": "London"}, "address_country_city_zip"),
+            ({"country__in": ["GBR", "FRA"]}, "address_country_city_zip"),
+            ({"city": "London"}, "address_city_zip"),
+            ({"city__in": ["London", "York"]}, "address_city_zip"),
+            ({"city__iexact": "london"}, "address_city_nocase"),
+            ({"city__istartswith": "lon"}, "address_city_nocase"),
+            ({"zip_code": "728wye"}, "address_zip"),
+            ({"zip_code__range": ("7", "8")}, "address_zip"),
+            ({"zip_code__startswith": "728"}, "address_zip_nocase"),
+        ]:
+            with self.subTest(lookup):
+                sql, params = (
+                    PostalAddress.objects.filter(**lookup)
+                    .values("id")
+                    .query.sql_with_params()
+                )
+                with connection.cursor() as cursor:
+                    cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+                    plan = " ".join(row[3] for row in cursor.fetchall())
+
+                self.assertRegex(plan, rf"^SEARCH \S+ USING (COVERING )?INDEX {index} ")
 
 
 class AddressUserTestCase(TestCase):
@@ -61,6 +134,151 @@ class AddressUserTestCase(TestCase):
         # Check that there are still only 2 addresses
         self.assertEqual(2, len(user1.postal_addresses.all()))
 
+    def assertOwnerCounts(self, expected):
+        self.assertDictEqual(
+            {
+                address: PostalAddress.objects.get(pk=address.pk).owner_count
+                for address in expected
+            },
+            expected,
+        )
+
+    def test_owner_count(self):
+        """owner_count should follow the associations, however they're changed"""
+        user1 = AddressUser.objects.create_user(username="testuser1")
+        user2 = AddressUser.objects.create_user(username="testuser2")
+        address1 = PostalAddress.objects.create(address1="25 Day Road", country="GBR")
+        address2 = PostalAddress.objects.create(address1="14 Day Road", country="GBR")
+        self.assertOwnerCounts({address1: 0, address2: 0})
+
+        user1.postal_addresses.add(address1, address2)
+        # Adding an address that's already associated shouldn't count twice
+        user1.postal_addresses.add(address1)
+        address1.postaladdresses.add(user2)
+        self.assertOwnerCounts({address1: 2, address2: 1})
+
+        # Only addresses that were actually associated are decremented
+        user2.postal_addresses.remove(address1, address2)
+        self.assertOwnerCounts({address1: 1, address2: 1})
+
+        user2.add_postal_addresses([address1, address2])
+        user2.add_postal_addresses([address1])
+        self.assertOwnerCounts({address1: 2, address2: 2})
+
+        self.assertEqual(user2.remove_postal_addresses([address2.pk]), 1)
+        self.assertOwnerCounts({address1: 2, address2: 1})
+
+        user1.postal_addresses.clear()
+        self.assertOwnerCounts({address1: 1, address2: 0})
+
+        user2.delete()
+        self.assertOwnerCounts({address1: 0, address2: 0})
+        self.assertEqual(PostalAddress.objects.orphaned().count(), 2)
+
+    def test_owner_count_locks_address_book(self):
+        """Where the database has row locks, adding and removing addresses lock the
+        user first, so concurrent changes can't count the same link twice
+        """
+        user = AddressUser.objects.create_user(username="testuser")
+        address = PostalAddress.objects.create(address1="25 Day Road", country="GBR")
+
+        # SQLite doesn't have FOR UPDATE, so pretend it does and leave the clause out
+        with mock.patch.object(
+            type(connection.features), "has_select_for_update", True
+        ), mock.patch.object(connection.ops, "for_update_sql", return_value=""):
+            for change in (
+                lambda: user.add_postal_addresses([address]),
+                lambda: user.remove_postal_addresses([address.pk]),
+            ):
+                with CaptureQueriesContext(connection) as queries:
+                    change()
+                self.assertIn('FROM "address_book_api_addressuser"', queries[0]["sql"])
+                self.assertIn(f"= {user.pk}", queries[0]["sql"])
+        self.assertOwnerCounts({address: 0})
+
+    def test_owner_count_through_rows(self):
+        """Through rows saved and deleted one at a time (e.g. by the admin inline)
+        keep owner_count and the versions in step too
+        """
+        user = AddressUser.objects.create_user(username="testuser")
+        address1 = PostalAddress.objects.create(address1="25 Day Road", country="GBR")
+        address2 = PostalAddress.objects.create(address1="14 Day Road", country="GBR")
+
+        def version():
+            return AddressUser.objects.get(pk=user.pk).version
+
+        before = version()
+        link = AddressUserPostalAddress.objects.create(
+            addressuser=user, postaladdress=address1
+        )
+        self.assertOwnerCounts({address1: 1, address2: 0})
+        self.assertGreater(version(), before)
+
+        # Saving it unchanged doesn't count it again
+        before = version()
+        link.save()
+        self.assertOwnerCounts({address1: 1, address2: 0})
+        self.assertEqual(version(), before)
+
+        link.postaladdress = address2
+        link.save()
+        self.assertOwnerCounts({address1: 0, address2: 1})
+        self.assertGreater(version(), before)
+
+        before = version()
+        link.delete()
+        self.assertOwnerCounts({address1: 0, address2: 0})
+        self.assertGreater(version(), before)
+
+    def test_repair_owner_counts(self):
+        user = AddressUser.objects.create_user(username="testuser")
+        address1 = PostalAddress.objects.create(address1="25 Day Road", country="GBR")
+        address2 = PostalAddress.objects.create(address1="14 Day Road", country="GBR")
+        user.postal_addresses.add(address1)
+        PostalAddress.objects.update(owner_count=5)
+
+        self.assertEqual(PostalAddress.objects.repair_owner_counts(), 2)
+        self.assertOwnerCounts({address1: 1, address2: 0})
+        self.assertEqual(PostalAddress.objects.repair_owner_counts(), 0)
+
+    def test_version(self):
+        """Anything that changes a user's addresses should bump their version"""
+        user1 = AddressUser.objects.create_user(username="testuser1")
+        user2 = AddressUser.objects.create_user(username="testuser2")
+        address = PostalAddress.objects.create(address1="25 Day Road", country="GBR")
+
+        def versions():
+            return {
+                user.pk: user.version
+                for user in AddressUser.objects.filter(pk__in=[user1.pk, user2.pk])
+            }
+
+        def assertBumped(change, *users):
+            before = versions()
+            change()
+            after = versions()
+            self.assertEqual(
+                {pk for pk in before if after[pk] != before[pk]},
+                {user.pk for user in users},
+            )
+
+        assertBumped(lambda: user1.postal_addresses.add(address), user1)
+        assertBumped(lambda: user2.add_postal_addresses([address]), user2)
+
+        # owner_count is maintained in the database, so only save the address fields
+        address.city = "London"
+        assertBumped(lambda: address.save(update_fields=["city"]), user1, user2)
+        address.city = "York"
+        assertBumped(
+            lambda: PostalAddress.objects.bulk_update([address], ["city"]),
+            user1,
+            user2,
+        )
+
+        assertBumped(lambda: user2.remove_postal_addresses([address.pk]), user2)
+        assertBumped(lambda: address.postaladdresses.add(user2), user2)
+        assertBumped(address.delete, user1, user2)
+
 
 def test_delete_address_user(self):
     """Test correct handling of deleting address user
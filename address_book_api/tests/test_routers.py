@@ -0,0 +1,300 @@
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase, override_settings
+from rest_framework.reverse import reverse
+
+from address_book_api import routers
+from address_book_api.authentication import issue_access_token
+from address_book_api.models import AddressUser, PostalAddress
+
+# Databases standing in for a replica of the test database and for shards, declared
+# in the settings when running the tests
+REPLICA = "replica_test"
+SHARDS = ["shard_test1", "shard_test2"]
+
+
+@override_settings(DATABASE_REPLICAS=[REPLICA])
+class ReplicaRoutingTestCase(TransactionTestCase):
+    """The test database as the primary and a replica copied from it with
+    sync_sqlite_replicas, which needs the data committed (and the replica outside of
+    a transaction) rather than rolled back after each test
+    """
+
+    databases = {DEFAULT_DB_ALIAS, REPLICA}
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.address_user = AddressUser.objects.create_user(username="testuser")
+        self.address_user.add_postal_addresses(
+            [PostalAddress.objects.create(address1="Replicated Road", country="GBR")]
+        )
+        call_command("sync_sqlite_replicas", stdout=StringIO())
+
+        self.url = reverse("postaladdress-list")
+        self.headers = {
+            "Authorization": f"Bearer {issue_access_token(self.address_user.user)}"
+        }
+
+    def get_address1s(self):
+        response = self.client.get(self.url, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return [row["address1"] for row in response.json()["results"]]
+
+    def test_router(self):
+        router = routers.AddressBookRouter()
+        self.assertEqual(router.db_for_read(PostalAddress), DEFAULT_DB_ALIAS)
+
+        token = routers.read_from(REPLICA)
+        try:
+            self.assertEqual(router.db_for_read(PostalAddress), REPLICA)
+            self.assertEqual(router.db_for_write(PostalAddress), DEFAULT_DB_ALIAS)
+        finally:
+            routers.reset(token)
+
+        self.assertEqual(routers.get_read_database(self.address_user.user_id), REPLICA)
+        routers.stick_to_primary(self.address_user.user_id)
+        self.assertEqual(
+            routers.get_read_database(self.address_user.user_id), DEFAULT_DB_ALIAS
+        )
+
+    def test_reads_from_replica(self):
+        """Lists and retrieves read the replica, whatever's since been written to the
+        primary directly
+        """
+        PostalAddress.objects.create(address1="Primary Road", country="GBR")
+        self.address_user.add_postal_addresses(
+            [PostalAddress.objects.get(address1="Primary Road")]
+        )
+
+        self.assertEqual(self.get_address1s(), ["Replicated Road"])
+        # Other reads are from the primary
+        self.assertEqual(
+            self.address_user.postal_addresses.filter(address1="Primary Road").count(),
+            1,
+        )
+
+    def test_read_your_writes(self):
+        """After a write through the API the user's reads stick to the primary"""
+        response = self.client.post(
+            self.url,
+            {"address1": "Written Road", "country": "GBR"},
+            content_type="application/json",
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.get_address1s(), ["Replicated Road", "Written Road"])
+
+        # Until the sticky window is over
+        cache.clear()
+        self.assertEqual(self.get_address1s(), ["Replicated Road"])
+
+        call_command("sync_sqlite_replicas", stdout=StringIO())
+        self.assertEqual(self.get_address1s(), ["Replicated Road", "Written Road"])
+
+    def test_writes_go_to_primary(self):
+        """Instances read from the replica are still written to the primary"""
+        address = self.address_user.postal_addresses.get()
+        token = routers.read_from(REPLICA)
+        try:
+            replica_user = AddressUser.objects.get(pk=self.address_user.pk)
+            self.assertEqual(replica_user._state.db, REPLICA)
+            replica_user.postal_addresses.remove(address)
+        finally:
+            routers.reset(token)
+
+        self.assertFalse(self.address_user.postal_addresses.exists())
+
+
+@override_settings(DATABASE_SHARDS=SHARDS)
+class ShardingTestCase(TransactionTestCase):
+    databases = {DEFAULT_DB_ALIAS, *SHARDS}
+
+    def create_users(self):
+        """A user on each shard"""
+        address_users = {}
+        index = 0
+        while len(address_users) < len(SHARDS):
+            address_user = AddressUser.objects.create_user(username=f"testuser{index}")
+            address_users.setdefault(address_user._state.db, address_user)
+            index += 1
+        return [address_users[shard] for shard in SHARDS]
+
+    def headers(self, address_user):
+        return {"Authorization": f"Bearer {issue_access_token(address_user.user)}"}
+
+    def assertAddressBook(self, address_user, address1s):
+        self.assertCountEqual(
+            list(
+                AddressUser.objects.using(routers.get_shard(address_user.user_id))
+                .get(user_id=address_user.user_id)
+                .postal_addresses.order_by("address_user_links__id")
+                .values_list("address1", flat=True)
+            ),
+            address1s,
+        )
+
+    def test_get_shard(self):
+        """Adding a shard only moves users onto it"""
+        before = {user_id: routers.get_shard(user_id) for user_id in range(1000)}
+        self.assertEqual(set(before.values()), set(SHARDS))
+
+        with self.settings(DATABASE_SHARDS=[*SHARDS, "shard_test3"]):
+            for user_id, shard in before.items():
+                self.assertIn(routers.get_shard(user_id), [shard, "shard_test3"])
+
+    def test_create_user(self):
+        for shard, address_user in zip(SHARDS, self.create_users()):
+            self.assertEqual(address_user._state.db, shard)
+            self.assertEqual(routers.get_shard(address_user.user_id), shard)
+            self.assertTrue(User.objects.filter(pk=address_user.user_id).exists())
+            self.assertFalse(
+                AddressUser.objects.using(DEFAULT_DB_ALIAS)
+                .filter(user_id=address_user.user_id)
+                .exists()
+            )
+
+    def test_api(self):
+        """Each user's requests go to their shard, an address shared across shards is
+        a row on each
+        """
+        url = reverse("postaladdress-list")
+        address_users = self.create_users()
+        for address_user in address_users:
+            for address1 in ["Shared Road", f"{address_user.user.username} Road"]:
+                response = self.client.post(
+                    url,
+                    {"address1": address1, "country": "GBR"},
+                    content_type="application/json",
+                    headers=self.headers(address_user),
+                )
+                self.assertEqual(response.status_code, 201)
+
+        for shard, address_user in zip(SHARDS, address_users):
+            response = self.client.get(url, headers=self.headers(address_user))
+            self.assertEqual(
+                [row["address1"] for row in response.json()["results"]],
+                ["Shared Road", f"{address_user.user.username} Road"],
+            )
+            shared = PostalAddress.objects.using(shard).get(address1="Shared Road")
+            self.assertEqual(shared.owner_count, 1)
+
+            response = self.client.get(
+                reverse("addressuser-profile"), headers=self.headers(address_user)
+            )
+            self.assertEqual(response.status_code, 200)
+
+            response = self.client.delete(
+                f"{url}/{shared.pk}", headers=self.headers(address_user)
+            )
+            self.assertEqual(response.status_code, 204)
+            self.assertFalse(
+                PostalAddress.objects.using(shard)
+                .filter(address1="Shared Road")
+                .exists()
+            )
+            self.assertAddressBook(address_user, [f"{address_user.user.username} Road"])
+
+        self.assertFalse(
+            PostalAddress.objects.using(DEFAULT_DB_ALIAS)
+            .filter(address1__endswith=" Road")
+            .exists()
+        )
+
+    async def test_async_api(self):
+        address_user = await sync_to_async(AddressUser.objects.create_user)(
+            username="testuser"
+        )
+        response = await self.async_client.post(
+            reverse("postaladdress-async-list"),
+            {"address1": "Async Road", "country": "GBR"},
+            content_type="application/json",
+            headers=self.headers(address_user),
+        )
+        self.assertEqual(response.status_code, 201)
+        response = await self.async_client.get(
+            reverse("postaladdress-async-list"), headers=self.headers(address_user)
+        )
+        self.assertEqual(
+            [row["address1"] for row in response.json()["results"]], ["Async Road"]
+        )
+
+    def test_delete_user(self):
+        """Deleting a user on the primary deletes their address book on the shard"""
+        for shard, address_user in zip(SHARDS, self.create_users()):
+            address_user.user.delete()
+            self.assertFalse(
+                AddressUser.objects.using(shard)
+                .filter(user_id=address_user.user_id)
+                .exists()
+            )
+
+    def test_rebalance_shards(self):
+        with self.settings(DATABASE_SHARDS=[]):
+            address_users = [
+                AddressUser.objects.create_user(username=f"rebalanced{index}")
+                for index in range(6)
+            ]
+            shared = PostalAddress.objects.create(
+                address1="Rebalanced Shared Road", country="GBR"
+            )
+            for address_user in address_users:
+                address_user.add_postal_addresses(
+                    [
+                        PostalAddress.objects.create(
+                            address1=f"{address_user.user.username} Road",
+                            country="GBR",
+                        ),
+                        shared,
+                    ]
+                )
+        user_ids = [address_user.user_id for address_user in address_users]
+
+        stdout = StringIO()
+        call_command("rebalance_shards", "--dry-run", stdout=stdout)
+        self.assertIn("Found 6 misplaced address books", stdout.getvalue())
+        self.assertEqual(
+            AddressUser.objects.using(DEFAULT_DB_ALIAS)
+            .filter(user_id__in=user_ids)
+            .count(),
+            6,
+        )
+
+        call_command("rebalance_shards", stdout=stdout)
+        self.assertIn("Moved 6 misplaced address books", stdout.getvalue())
+        self.assertFalse(
+            AddressUser.objects.using(DEFAULT_DB_ALIAS)
+            .filter(user_id__in=user_ids)
+            .exists()
+        )
+        self.assertFalse(
+            PostalAddress.objects.using(DEFAULT_DB_ALIAS)
+            .filter(address1__startswith="Rebalanced")
+            .exists()
+        )
+
+        for address_user in address_users:
+            self.assertAddressBook(
+                address_user,
+                [f"{address_user.user.username} Road", "Rebalanced Shared Road"],
+            )
+        # Shared by the users on each shard, whichever shards they hashed to
+        for shard in SHARDS:
+            owners = (
+                AddressUser.objects.using(shard).filter(user_id__in=user_ids).count()
+            )
+            self.assertEqual(
+                sum(
+                    PostalAddress.objects.using(shard)
+                    .filter(address1="Rebalanced Shared Road")
+                    .values_list("owner_count", flat=True)
+                ),
+                owners,
+            )
+
+        call_command("rebalance_shards", stdout=stdout)
+        self.assertIn("Moved 0 misplaced address books", stdout.getvalue())
@@ -0,0 +1,105 @@
+import json
+import re
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from rest_framework.reverse import reverse
+
+from address_book_api.authentication import issue_access_token
+from address_book_api.models import AddressUser, PostalAddress
+from address_book_api.timing import sql_template
+
+
+def metrics(response):
+    """The Server-Timing header's metrics, by name"""
+    return {
+        metric.split(";")[0]: metric for metric in response["Server-Timing"].split(", ")
+    }
+
+
+@override_settings(ADDRESS_BOOK_SERVER_TIMING=True)
+class ServerTimingTestCase(TestCase):
+    def setUp(self) -> None:
+        self.test_user1 = AddressUser.objects.create_user(
+            username="testuser1", password="notarealpassword"
+        )
+        self.test_user1.add_postal_addresses(
+            PostalAddress.objects.bulk_get_or_create(
+                [
+                    {"address1": f"{index} SomeDay Road", "country": "GBR"}
+                    for index in range(3)
+                ]
+            )
+        )
+        self.headers = {
+            "Authorization": f"Bearer {issue_access_token(self.test_user1.user)}"
+        }
+
+    def test_server_timing(self):
+        """Requests report their queries and the time spent in each part"""
+        with self.assertLogs("address_book_api.timing", "INFO") as logs:
+            response = self.client.get(
+                reverse("postaladdress-list"), headers=self.headers
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            set(metrics(response)), {"db", "auth", "serialize", "view", "total"}
+        )
+        queries = re.fullmatch(
+            r'db;dur=[\d.]+;desc="(\d+) queries"', metrics(response)["db"]
+        )
+        self.assertGreater(int(queries[1]), 0)
+
+        self.assertEqual(logs.records[0].levelname, "INFO")
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["path"], reverse("postaladdress-list"))
+        self.assertEqual(record["status"], 200)
+        self.assertEqual(record["queries"], int(queries[1]))
+        self.assertNotIn("n_plus_one", record)
+
+    async def test_async_server_timing(self):
+        with self.assertLogs("address_book_api.timing", "INFO"):
+            response = await self.async_client.get(
+                reverse("postaladdress-async-list"), headers=self.headers
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            set(metrics(response)), {"db", "auth", "serialize", "view", "total"}
+        )
+
+    @override_settings(ADDRESS_BOOK_N_PLUS_ONE_THRESHOLD=2)
+    def test_n_plus_one(self):
+        """The same query repeated more than ADDRESS_BOOK_N_PLUS_ONE_THRESHOLD times
+        is logged as a warning
+        """
+        for index in range(2, 5):
+            AddressUser.objects.create_user(username=f"testuser{index}")
+        self.client.force_login(User.objects.create_superuser(username="admin"))
+
+        # The changelist looks each AddressUser's addresses up separately
+        with self.assertLogs("address_book_api.timing", "INFO") as logs:
+            response = self.client.get(
+                reverse("admin:address_book_api_addressuser_changelist")
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(logs.records[0].levelname, "WARNING")
+        repeated = json.loads(logs.records[0].getMessage())["n_plus_one"]
+        self.assertTrue(repeated)
+        self.assertTrue(all(query["count"] > 2 for query in repeated))
+
+    @override_settings(ADDRESS_BOOK_SERVER_TIMING=False)
+    def test_disabled(self):
+        response = self.client.get(reverse("postaladdress-list"), headers=self.headers)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Server-Timing", response)
+
+    def test_sql_template(self):
+        """Queries differing only in the length of a parameter list are the same"""
+        self.assertEqual(
+            sql_template("SELECT 1 WHERE id IN (%s, %s, %s) AND a = %s"),
+            sql_template("SELECT 1 WHERE id IN (%s, %s) AND a = %s"),
+        )
@@ -0,0 +1,212 @@
+"""Per request instrumentation, reported as a Server-Timing header and a log line by
+ServerTimingMiddleware when settings.ADDRESS_BOOK_SERVER_TIMING is on
+
+Each request records the number and total time of its SQL queries (on every
+database), and the time spent authenticating, in serializers (validating and
+representing data, and rendering the response) and in the view. The durations are
+kept in a context variable, so they follow the request into sync_to_async threads,
+and the parts of the code doing the work report them with timed().
+
+Queries are grouped by their SQL with the parameters left out, a group of more than
+ADDRESS_BOOK_N_PLUS_ONE_THRESHOLD queries is likely an N+1 (a query per row of an
+earlier one) and is logged as a warning.
+"""
+
+import json
+import logging
+import re
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+_timings = ContextVar("timings", default=None)
+
+# Lists of placeholders (e.g. IN (%s, %s, %s)) vary in length with the parameters
+_PLACEHOLDERS = re.compile(r"%s(?:, %s)+")
+
+
+class RequestTimings:
+    def __init__(self):
+        # Seconds spent in each part of the request
+        self.durations = defaultdict(float)
+        self.queries = Counter()
+        self.active = set()
+        self.view_started = None
+
+
+def sql_template(sql):
+    return _PLACEHOLDERS.sub("%s, ...", sql)
+
+
+@contextmanager
+def timed(name):
+    """Add the time spent in the block to the current request's name duration, only
+    the outermost block counts when they're nested
+    """
+    timings = _timings.get()
+    if timings is None or name in timings.active:
+        yield
+        return
+
+    timings.active.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.durations[name] += time.perf_counter() - started
+        timings.active.discard(name)
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper counting and timing the queries of the current request"""
+    timings = _timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+
+    timings.queries[sql_template(sql)] += 1
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.durations["db"] += time.perf_counter() - started
+
+
+def install(connection):
+    """Record the queries of a connection, called as it's created"""
+    if record_query not in connection.execute_wrappers:
+        # First, as connection.execute_wrapper() blocks pop the last wrapper on exit
+        connection.execute_wrappers.insert(0, record_query)
+
+
+class TimedSerializerMixin:
+    """Time validating and representing data, for serializers and list serializers"""
+
+    def is_valid(self, *args, **kwargs):
+        with timed("serialize"):
+            return super().is_valid(*args, **kwargs)
+
+    @property
+    def data(self):
+        with timed("serialize"):
+            return super().data
+
+
+class TimedListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    pass
+
+
+class ServerTimingMixin:
+    """Time a DRF view's authentication, and its response rendering as part of
+    serializing
+    """
+
+    def perform_authentication(self, request):
+        with timed("auth"):
+            super().perform_authentication(request)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        # Rendered here rather than by the handler after the view returns, which
+        # renders each response once, so it's only timed
+        if _timings.get() is not None and hasattr(response, "render"):
+            with timed("serialize"):
+                response.render()
+        return response
+
+
+class ServerTimingMiddleware:
+    """Report each request's timings in a Server-Timing header and an INFO log line
+    (a warning if it looks like an N+1), see the module docstring
+
+    Goes first in MIDDLEWARE, so total covers the other middleware. Queries made
+    while a streaming response is sent, after the middleware has returned, aren't
+    counted
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not settings.ADDRESS_BOOK_SERVER_TIMING:
+            return self.get_response(request)
+
+        timings = RequestTimings()
+        token = _timings.set(timings)
+        try:
+            started = time.perf_counter()
+            response = self.get_response(request)
+            self.finish(request, response, timings, started)
+        finally:
+            _timings.reset(token)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.ADDRESS_BOOK_SERVER_TIMING:
+            return await self.get_response(request)
+
+        timings = RequestTimings()
+        token = _timings.set(timings)
+        try:
+            started = time.perf_counter()
+            response = await self.get_response(request)
+            self.finish(request, response, timings, started)
+        finally:
+            _timings.reset(token)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timings = _timings.get()
+        if timings is not None:
+            timings.view_started = time.perf_counter()
+
+    def finish(self, request, response, timings, started):
+        finished = time.perf_counter()
+        durations = timings.durations
+        durations["total"] = finished - started
+        if timings.view_started is not None:
+            durations["view"] = finished - timings.view_started
+        query_count = sum(timings.queries.values())
+
+        metrics = [f'db;dur={durations["db"] * 1000:.1f};desc="{query_count} queries"']
+        metrics += [
+            f"{name};dur={durations[name] * 1000:.1f}"
+            for name in ("auth", "serialize", "view", "total")
+            if name in durations
+        ]
+        response["Server-Timing"] = ", ".join(metrics)
+
+        repeated = [
+            {"sql": sql, "count": count}
+            for sql, count in timings.queries.most_common()
+            if count > settings.ADDRESS_BOOK_N_PLUS_ONE_THRESHOLD
+        ]
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "queries": query_count,
+            **{
+                f"{name}_ms": round(seconds * 1000, 1)
+                for name, seconds in durations.items()
+            },
+        }
+        if repeated:
+            record["n_plus_one"] = repeated
+            logger.warning(json.dumps(record))
+        else:
+            logger.info(json.dumps(record))
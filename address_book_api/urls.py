@@ -5,15 +5,37 @@ from drf_spectacular.views import (
     SpectacularRedocView,
     SpectacularSwaggerView,
 )
-from address_book_api.apis import PostalAddressViewSet
+from address_book_api.apis import AddressUserViewSet, PostalAddressViewSet
+from address_book_api.async_apis import (
+    AsyncPostalAddressDetailView,
+    AsyncPostalAddressListView,
+)
 from address_book_api.views import index_html
 
 router = routers.DefaultRouter()
-router.register(r"", PostalAddressViewSet, basename="postaladdress")
+# Accept both /addressbook/<id> and /addressbook/<id>/
+router.trailing_slash = "/?"
+router.register(r"addressbook", PostalAddressViewSet, basename="postaladdress")
 
 
 urlpatterns = [
-    path("api/v1/addressbook", include(router.urls), name="api"),
+    path("api/v1/", include(router.urls), name="api"),
+    path(
+        "api/v1/profile",
+        AddressUserViewSet.as_view({"get": "retrieve"}),
+        name="addressuser-profile",
+    ),
+    # Native async versions of the address book endpoints, for ASGI
+    path(
+        "api/v1/async/addressbook",
+        AsyncPostalAddressListView.as_view(),
+        name="postaladdress-async-list",
+    ),
+    path(
+        "api/v1/async/addressbook/<int:pk>",
+        AsyncPostalAddressDetailView.as_view(),
+        name="postaladdress-async-detail",
+    ),
     # YOUR PATTERNS
     path("api/schema/openapi", SpectacularAPIView.as_view(), name="schema"),
     # Optional UI:
@@ -13,14 +13,16 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+
 from django.contrib import admin
 from django.urls import path, include
-from rest_framework.authtoken.views import obtain_auth_token
+
+from address_book_api.apis import ObtainAuthTokenView
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path(
-        "api-token-auth/", obtain_auth_token, name="api_token_auth"
+        "api-token-auth/", ObtainAuthTokenView.as_view(), name="api_token_auth"
     ),  # Get token for token based Auth
     path("api-auth/", include("rest_framework.urls")),  # Adds login into browsable api
     path("", include("address_book_api.urls")),